@@ -2,22 +2,36 @@
 
 Endpoints para generar imágenes usando Stable Diffusion XL a través de ComfyUI.
 Soporta diferentes workflows: txt2img, img2img, sketch2img, y combinaciones de múltiples imágenes.
+
+Los endpoints de generación encolan un trabajo y responden 202 con su estado inicial;
+el resultado se consulta en ``GET /comfy/jobs/{job_id}`` o llega por WebSocket.
+Una petición idéntica a otra que sigue en curso devuelve el mismo trabajo; la
+cabecera opcional ``Idempotency-Key`` permite controlarlo explícitamente
+(ver ``services.jobs``). Un trabajo se cancela con ``POST /comfy/jobs/{job_id}/cancel``.
+
+El trabajo bloqueante (consultas a la base de datos, lectura y escritura de
+archivos) se ejecuta en el pool de ``services.executor`` para no bloquear el event loop.
+Las consultas de la galería y la asociación de imágenes a sesiones usan
+directamente la sesión asíncrona (``AsyncSessionDep``).
 """
 
-from fastapi import APIRouter, UploadFile, File, Depends, Query
-from app.dependencies import SessionDep, CurrentUser
+import httpx
+from fastapi import APIRouter, UploadFile, File, Depends, Query, Header, HTTPException, status
+from app.dependencies import AsyncSessionDep, SessionDep, CurrentUser, ComfyClientDep
 import app.schemas as schemas
 import app.crud as crud
+import app.services as services
+from app.services.executor import ejecutar as run_blocking
 
 router = APIRouter()
 
 
 @router.post("/users/{user_id}/session-images/link", response_model=schemas.ImageGenerationResponse)
-async def link_image_to_session(db: SessionDep, user_id: int, current_user: CurrentUser, image_file_name: str = Query(...), session_id: int = Query(...)):
+async def link_image_to_session(db: AsyncSessionDep, user_id: int, current_user: CurrentUser, image_file_name: str = Query(...), session_id: int = Query(...)):
     """Asocia una imagen existente a una sesión sin duplicar el archivo.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         user_id (int): ID del usuario propietario de la imagen.
         current_user (CurrentUser): Usuario autenticado.
         image_file_name (str): Nombre del archivo de imagen existente.
@@ -26,12 +40,16 @@ async def link_image_to_session(db: SessionDep, user_id: int, current_user: Curr
     Returns:
         schemas.ImageGenerationResponse: Respuesta con información de la imagen vinculada.
     """
-    return crud.comfy.link_image_to_session(db=db, image_file_name=image_file_name, user_id=user_id, session_id=session_id)
+    return await crud.comfy.link_image_to_session_async(db=db, image_file_name=image_file_name, user_id=user_id, session_id=session_id)
+
 
+@router.post("/users/{user_id}/images", response_model=schemas.GenerationJob, status_code=status.HTTP_202_ACCEPTED)
+async def generate_image_for_user(db: SessionDep, user_id: int, prompt: schemas.Prompt, current_user: CurrentUser, session_id: int | None = None,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255)):
+    """Encola la generación de una imagen con el workflow txt2img (o img2img).
 
-@router.post("/users/{user_id}/images", response_model=schemas.ImageGenerationResponse)
-async def generate_image_for_user(db: SessionDep, user_id: int, prompt: schemas.Prompt, current_user: CurrentUser, session_id: int | None = None):
-    """Genera imagen usando ComfyUI workflow txt2img.
+    Con ``count`` > 1 o una lista de ``seeds`` se generan varias variaciones del
+    mismo prompt en un único envío a ComfyUI.
     
     Args:
         db (Session): Sesión de base de datos.
@@ -39,16 +57,18 @@ async def generate_image_for_user(db: SessionDep, user_id: int, prompt: schemas.
         prompt (schemas.Prompt): Prompt de texto y parámetros de generación.
         current_user (CurrentUser): Usuario autenticado.
         session_id (int, optional): ID de sesión asociada. Default None.
+        idempotency_key (str, optional): Cabecera ``Idempotency-Key``; la misma clave devuelve el mismo trabajo.
     
     Returns:
-        schemas.ImageGenerationResponse: Imagen generada con metadata.
+        schemas.GenerationJob: Trabajo encolado; la imagen estará en ``result`` al terminar
+        (y todas las del lote en ``results`` e ``images``).
     """
-    db_user = crud.user.get_user(db, user_id=user_id)
-    return crud.comfy.create_user_image(db=db, prompt=prompt, user_id=user_id, session_id=session_id)
+    return await run_blocking(crud.comfy.create_user_image, db=db, prompt=prompt, user_id=user_id, session_id=session_id, idempotency_key=idempotency_key)
 
-@router.post("/users/{user_id}/sketch-images/", response_model=schemas.ImageGenerationResponse)
-async def generate_sketch_image_for_user(db: SessionDep, user_id: int, prompt: schemas.SketchPrompt, current_user: CurrentUser, session_id: int | None = None):
-    """Genera imagen usando ComfyUI workflow sketch2img o img2img.
+@router.post("/users/{user_id}/sketch-images/", response_model=schemas.GenerationJob, status_code=status.HTTP_202_ACCEPTED)
+async def generate_sketch_image_for_user(db: SessionDep, user_id: int, prompt: schemas.SketchPrompt, current_user: CurrentUser, session_id: int | None = None,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255)):
+    """Encola la generación de una imagen con el workflow sketch2img.
     
     Args:
         db (Session): Sesión de base de datos.
@@ -56,16 +76,17 @@ async def generate_sketch_image_for_user(db: SessionDep, user_id: int, prompt: s
         prompt (schemas.SketchPrompt): Prompt con imagen base y parámetros.
         current_user (CurrentUser): Usuario autenticado.
         session_id (int, optional): ID de sesión asociada. Default None.
+        idempotency_key (str, optional): Cabecera ``Idempotency-Key``; la misma clave devuelve el mismo trabajo.
     
     Returns:
-        schemas.ImageGenerationResponse: Imagen generada con metadata.
+        schemas.GenerationJob: Trabajo encolado; la imagen estará en ``result`` al terminar.
     """
-    db_user = crud.user.get_user(db, user_id=user_id)
-    return crud.comfy.create_user_sketch_image(db=db, prompt=prompt, user_id=user_id, session_id=session_id)
+    return await run_blocking(crud.comfy.create_user_sketch_image, db=db, prompt=prompt, user_id=user_id, session_id=session_id, idempotency_key=idempotency_key)
 
-@router.post("/users/{user_id}/multiple-images/", response_model=schemas.ImageGenerationResponse)
-async def generate_image_for_user_multiple(db: SessionDep, user_id: int, images: schemas.TemplateImagesIn, current_user: CurrentUser, session_id: int | None = None):
-    """Genera imagen combinando múltiples imágenes (2, 3 o 4).
+@router.post("/users/{user_id}/multiple-images/", response_model=schemas.GenerationJob, status_code=status.HTTP_202_ACCEPTED)
+async def generate_image_for_user_multiple(db: SessionDep, user_id: int, images: schemas.TemplateImagesIn, current_user: CurrentUser, session_id: int | None = None,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255)):
+    """Encola la generación de una imagen combinando múltiples imágenes (2, 3 o 4).
     
     Args:
         db (Session): Sesión de base de datos.
@@ -73,12 +94,87 @@ async def generate_image_for_user_multiple(db: SessionDep, user_id: int, images:
         images (schemas.TemplateImagesIn): Lista de imágenes y parámetros.
         current_user (CurrentUser): Usuario autenticado.
         session_id (int, optional): ID de sesión asociada. Default None.
+        idempotency_key (str, optional): Cabecera ``Idempotency-Key``; la misma clave devuelve el mismo trabajo.
+    
+    Returns:
+        schemas.GenerationJob: Trabajo encolado; la imagen estará en ``result`` al terminar.
+    """
+    return await run_blocking(crud.comfy.create_user_img_by_mult_images, db=db, images=images, user_id=user_id, session_id=session_id, idempotency_key=idempotency_key)
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.GenerationJob)
+async def get_generation_job(job_id: str, current_user: CurrentUser):
+    """Obtiene el estado de un trabajo de generación.
+    
+    Args:
+        job_id (str): ID del trabajo devuelto al encolar la generación.
+        current_user (CurrentUser): Usuario autenticado.
     
     Returns:
-        schemas.ImageGenerationResponse: Imagen generada combinando las fuentes.
+        schemas.GenerationJob: Estado del trabajo (queued, running, done, failed) y,
+        mientras espera, su posición en la cola (``queue_position``).
+    
+    Raises:
+        HTTPException: 404 si el trabajo no existe o ya fue purgado.
+        HTTPException: 403 si el trabajo pertenece a otro usuario.
+    """
+    job = services.jobs.manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tienes permiso para ver este trabajo")
+    return services.jobs.manager.describir(job)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=schemas.GenerationJob)
+async def cancel_generation_job(job_id: str, current_user: CurrentUser):
+    """Cancela un trabajo de generación en cola o en ejecución.
+
+    Si ComfyUI ya lo está ejecutando se interrumpe; si está en su cola, se retira.
+    Cancelar un trabajo ya terminado no tiene efecto.
+
+    Args:
+        job_id (str): ID del trabajo devuelto al encolar la generación.
+        current_user (CurrentUser): Usuario autenticado.
+
+    Returns:
+        schemas.GenerationJob: Estado del trabajo tras la cancelación.
+
+    Raises:
+        HTTPException: 404 si el trabajo no existe o ya fue purgado.
+        HTTPException: 403 si el trabajo pertenece a otro usuario.
+    """
+    manager = services.jobs.manager
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="No tienes permiso para cancelar este trabajo")
+    await run_blocking(manager.cancelar, job, "cancelada por el usuario")
+    return manager.describir(job)
+
+
+@router.get("/status", response_model=schemas.ComfyStatus)
+async def get_comfy_status(comfy: ComfyClientDep, current_user: CurrentUser):
+    """Comprueba si ComfyUI responde y cuántos trabajos tiene en cola.
+
+    Args:
+        comfy (ComfyClient): Cliente compartido de ComfyUI.
+        current_user (CurrentUser): Usuario autenticado.
+
+    Returns:
+        schemas.ComfyStatus: Disponibilidad y tamaño de la cola de ComfyUI.
     """
-    db_user = crud.user.get_user(db, user_id=user_id)
-    return crud.comfy.create_user_img_by_mult_images(db=db, images=images, user_id=user_id, session_id=session_id)
+    try:
+        queue = await comfy.queue()
+    except httpx.HTTPError as e:
+        print(f"ComfyUI no disponible: {e}")
+        return {"reachable": False}
+    return {
+        "reachable": True,
+        "running": len(queue.get("queue_running", [])),
+        "pending": len(queue.get("queue_pending", [])),
+    }
 
 
 @router.post('/users/{user_id}/images/upload', response_model=schemas.ImageGenerationResponse)
@@ -95,7 +191,7 @@ async def upload_image_for_user(db: SessionDep, user_id: int, current_user: Curr
     Returns:
         schemas.ImageGenerationResponse: Información de la imagen subida.
     """
-    return crud.comfy.create_user_uploaded_image(db=db, upload_file=file, user_id=user_id, isDrawn=isDrawn)
+    return await run_blocking(crud.comfy.create_user_uploaded_image, db=db, upload_file=file, user_id=user_id, isDrawn=isDrawn)
 
 
 @router.post('/users/{user_id}/images/drawn', response_model=schemas.ImageGenerationResponse)
@@ -111,27 +207,27 @@ async def upload_drawn_image_for_user(db: SessionDep, user_id: int, current_user
     Returns:
         schemas.ImageGenerationResponse: Información del dibujo guardado.
     """
-    return crud.comfy.create_user_drawn_image(db=db, upload_file=file, user_id=user_id)
+    return await run_blocking(crud.comfy.create_user_drawn_image, db=db, upload_file=file, user_id=user_id)
 
 @router.get('/users/{user_id}/images', response_model=schemas.ImagesOut)
-async def get_images_for_user(db: SessionDep, user_id: int, current_user: CurrentUser):
+async def get_images_for_user(db: AsyncSessionDep, user_id: int, current_user: CurrentUser):
     """Obtiene todas las imágenes de un usuario.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         user_id (int): ID del usuario.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
         schemas.ImagesOut: Lista de imágenes del usuario.
     """
-    return crud.comfy.get_images_for_user(db=db, user_id=user_id)
+    return await crud.comfy.get_images_for_user_async(db=db, user_id=user_id)
 
 @router.get("/template-images")
-def get_template_images():
+async def get_template_images():
     """Obtiene lista de imágenes plantilla disponibles.
     
     Returns:
         list: Nombres de archivos de imágenes plantilla.
     """
-    return crud.comfy.get_template_images()
+    return await run_blocking(crud.comfy.get_template_images)
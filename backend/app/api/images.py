@@ -0,0 +1,50 @@
+"""Router de API para las versiones reducidas de las imágenes.
+
+Las galerías piden miniaturas (``thumb``) o tamaños intermedios (``medium``) en
+lugar de los originales de ``/images``. La URL lleva el tamaño y el nombre del
+archivo original; las schemas de imágenes ya la incluyen en ``thumbnailUrl`` y
+``mediumUrl``. Se envían con la misma política de caché que los originales
+(``services.image_serving``).
+"""
+
+import os
+from fastapi import APIRouter, HTTPException, Request
+import app.services as services
+from app.services.executor import ejecutar as run_blocking
+
+router = APIRouter()
+
+
+@router.get("/derived/{size}/{file_name}")
+async def get_derived_image(request: Request, size: str, file_name: str):
+    """Sirve la versión reducida de una imagen, creándola si aún no existe.
+
+    Args:
+        request (Request): Petición (para ``If-None-Match`` y ``Range``).
+        size (str): Tamaño configurado ("thumb", "medium").
+        file_name (str): Nombre del archivo original.
+
+    Returns:
+        Response: Imagen WebP, AVIF o JPEG según ``IMAGE_DERIVATIVE_FORMAT``, o 304
+        si el cliente ya la tiene.
+
+    Raises:
+        HTTPException: 404 si el tamaño no existe o no hay imagen original con ese nombre,
+            500 si la imagen no se puede procesar.
+    """
+    derivatives = services.derivatives
+    try:
+        ruta = await run_blocking(derivatives.obtener, file_name, size)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Tamaño de imagen desconocido: {size}")
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Error al reducir la imagen: {str(e)}")
+    serving = services.image_serving
+    inmutable = derivatives.carpeta_de(file_name) in serving.IMAGE_IMMUTABLE_FOLDERS
+    return await serving.respuesta_imagen(
+        request.scope, ruta, os.stat(ruta),
+        serving.CACHE_INMUTABLE if inmutable else serving.CACHE_REVALIDAR,
+        media_type=derivatives.TIPOS_MIME[derivatives.FORMATO],
+    )
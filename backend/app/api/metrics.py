@@ -0,0 +1,31 @@
+"""Router de API con métricas internas del servidor.
+
+Expone el estado de los pools y colas del backend para poder detectar
+saturación (p. ej. peticiones esperando hilo libre).
+"""
+
+from fastapi import APIRouter
+import app.services as services
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Obtiene las métricas de saturación del backend.
+
+    Returns:
+        dict: Métricas por componente.
+            - executor (dict): Pool de trabajo bloqueante de los endpoints.
+            - generation_cache (dict): Caché de resultados de generaciones.
+            - image_etags (dict): Hashes de contenido recordados para los ETag de las imágenes.
+            - jobs (dict): Cola de trabajos de generación.
+            - comfy_nodes (list[dict]): Estado y carga de cada instancia de ComfyUI.
+    """
+    return {
+        "executor": services.executor.pool.metricas(),
+        "generation_cache": services.result_cache.cache.metricas(),
+        "image_etags": services.image_serving.huellas.metricas(),
+        "jobs": services.jobs.manager.metricas(),
+        "comfy_nodes": services.comfy_pool.pool.metricas(),
+    }
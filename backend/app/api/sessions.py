@@ -2,17 +2,23 @@
 
 Endpoints para crear, actualizar, consultar y finalizar sesiones entre terapeutas y pacientes.
 Incluye gestión de sesiones activas, próximas y finalizadas.
+
+Las consultas, que el frontend repite en cada pantalla, usan la sesión
+asíncrona (``AsyncSessionDep``) para no bloquear el event loop; la creación y
+la edición son endpoints síncronos que FastAPI ejecuta en su pool de hilos.
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 import app.schemas as schemas
 from sqlalchemy.orm import Session
-from app.dependencies import SessionDep, CurrentUser
+from app.dependencies import AsyncSessionDep, SessionDep, CurrentUser
 import app.crud as crud
 import app.models as models
+import app.services as services
+from app.services.executor import ejecutar as run_blocking
 from datetime import datetime
-from sqlalchemy import and_, exists
+from sqlalchemy import and_, exists, select
 from sqlalchemy.orm import aliased
 from app.api.ws import notify_new_session_to_patient
 
@@ -91,11 +97,11 @@ def update_session(session_id: int, session: schemas.SessionUpdate, db: SessionD
     return crud.session.update_session(db, session_id, session, current_user.id)
 
 @router.get('/my-sessions', response_model=schemas.SessionsOut)
-async def get_sessions_active_user(db: SessionDep, current_user: CurrentUser):
+async def get_sessions_active_user(db: AsyncSessionDep, current_user: CurrentUser):
     """Obtiene todas las sesiones del usuario actual (como paciente o terapeuta).
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
@@ -104,21 +110,21 @@ async def get_sessions_active_user(db: SessionDep, current_user: CurrentUser):
     Note:
         Finaliza automáticamente sesiones expiradas antes de retornar.
     """
-    crud.session.finalize_expired_sessions(db, current_user.id)
-    sessions = db.query(models.Session).filter(
+    await crud.session.finalize_expired_sessions_async(db, current_user.id)
+    sessions = (await db.scalars(select(models.Session).where(
         (models.Session.patient_id == current_user.id) | (models.Session.therapist_id == current_user.id)
-    ).all()
+    ))).all()
     return {"data": sessions, "count": len(sessions)}
 
 
 @router.get('/active', response_model=schemas.Session)
-def get_active_session(db: SessionDep, current_user: CurrentUser):
+async def get_active_session(db: AsyncSessionDep, current_user: CurrentUser):
     """Obtiene la sesión activa del usuario actual.
     
     Una sesión es activa si: now entre start_date y end_date, y ended_at es None.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
@@ -132,11 +138,11 @@ def get_active_session(db: SessionDep, current_user: CurrentUser):
         Si el terapeuta tiene múltiples sesiones activas, devuelve la más antigua.
     """
     now = datetime.utcnow()
-    crud.session.finalize_expired_sessions(db, current_user.id)
+    await crud.session.finalize_expired_sessions_async(db, current_user.id)
     # First try as patient
 
     S2 = aliased(models.Session)
-    session = db.query(models.Session).filter(
+    session = (await db.scalars(select(models.Session).where(
         models.Session.patient_id == current_user.id,
         models.Session.start_date <= now,
         models.Session.end_date >= now,
@@ -148,17 +154,17 @@ def get_active_session(db: SessionDep, current_user: CurrentUser):
             S2.ended_at == None,
             S2.start_date < models.Session.start_date
         ))
-    ).order_by(models.Session.start_date.asc()).first()
+    ).order_by(models.Session.start_date.asc()).limit(1))).first()
     if session:
         return session
 
     # Then try as therapist
-    session = db.query(models.Session).filter(
+    session = (await db.scalars(select(models.Session).where(
         models.Session.therapist_id == current_user.id,
         models.Session.start_date <= now,
         models.Session.end_date >= now,
         models.Session.ended_at == None,
-    ).order_by(models.Session.start_date.asc()).first()
+    ).order_by(models.Session.start_date.asc()).limit(1))).first()
     if session:
         return session
 
@@ -167,7 +173,7 @@ def get_active_session(db: SessionDep, current_user: CurrentUser):
 
 
 @router.get('/next', response_model=schemas.Session)
-def get_next_session(db: SessionDep, current_user: CurrentUser):
+async def get_next_session(db: AsyncSessionDep, current_user: CurrentUser):
     """Obtiene la próxima sesión del usuario (activa o futura).
     
     Lógica:
@@ -176,7 +182,7 @@ def get_next_session(db: SessionDep, current_user: CurrentUser):
     3. Si no hay ninguna: error 404.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
@@ -186,23 +192,23 @@ def get_next_session(db: SessionDep, current_user: CurrentUser):
         HTTPException: 404 si no hay sesiones programadas.
     """
     now = datetime.utcnow()
-    crud.session.finalize_expired_sessions(db, current_user.id)
+    await crud.session.finalize_expired_sessions_async(db, current_user.id)
 
-    base_query = db.query(models.Session).filter(
+    base_query = select(models.Session).where(
         ((models.Session.patient_id == current_user.id) | (models.Session.therapist_id == current_user.id)),
         models.Session.ended_at == None,
     )
 
     # Primero, la activa
-    active = base_query.filter(
+    active = (await db.scalars(base_query.where(
         models.Session.start_date <= now,
         models.Session.end_date >= now,
-    ).first()
+    ).limit(1))).first()
     if active:
         return active
 
     # Luego, la próxima futura ordenada por fecha de inicio
-    upcoming = base_query.filter(models.Session.start_date > now).order_by(models.Session.start_date.asc()).first()
+    upcoming = (await db.scalars(base_query.where(models.Session.start_date > now).order_by(models.Session.start_date.asc()).limit(1))).first()
     if upcoming:
         return upcoming
 
@@ -210,12 +216,12 @@ def get_next_session(db: SessionDep, current_user: CurrentUser):
 
 
 @router.get('/session/{session_id}', response_model=schemas.Session)
-def get_session_by_id(session_id: int, db: SessionDep, current_user: CurrentUser):
+async def get_session_by_id(session_id: int, db: AsyncSessionDep, current_user: CurrentUser):
     """Obtiene información de una sesión por ID.
     
     Args:
         session_id (int): ID de la sesión.
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
@@ -228,8 +234,8 @@ def get_session_by_id(session_id: int, db: SessionDep, current_user: CurrentUser
     Note:
         Retorna la sesión incluso si ha sido finalizada (ended_at establecido).
     """
-    crud.session.finalize_expired_sessions(db, current_user.id)
-    session = db.query(models.Session).filter(models.Session.id == session_id).first()
+    await crud.session.finalize_expired_sessions_async(db, current_user.id)
+    session = await db.get(models.Session, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
 
@@ -240,14 +246,15 @@ def get_session_by_id(session_id: int, db: SessionDep, current_user: CurrentUser
 
 
 @router.post('/end/{session_id}', response_model=schemas.Session)
-async def end_session_by_id(session_id: int, db: SessionDep, current_user: CurrentUser):
+async def end_session_by_id(session_id: int, db: AsyncSessionDep, current_user: CurrentUser):
     """Finaliza una sesión (solo terapeuta).
     
-    Establece ended_at al momento actual y notifica a clientes WebSocket conectados.
+    Establece ended_at al momento actual, cancela las generaciones pendientes de
+    la sesión y notifica a clientes WebSocket conectados.
     
     Args:
         session_id (int): ID de la sesión a finalizar.
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado (debe ser terapeuta de la sesión).
     
     Returns:
@@ -260,13 +267,14 @@ async def end_session_by_id(session_id: int, db: SessionDep, current_user: Curre
     Note:
         Intenta cerrar conexiones WebSocket activas para esta sesión.
     """
-    session = db.query(models.Session).filter(models.Session.id == session_id).first()
+    session = await db.get(models.Session, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
     if current_user.type != 'therapist' or current_user.id != session.therapist_id:
         raise HTTPException(status_code=403, detail="Solo el terapeuta de esta sesión puede finalizarla")
 
-    updated = crud.session.end_session(db, session_id)
+    updated = await crud.session.end_session_async(db, session_id)
+    await run_blocking(services.jobs.manager.cancelar_sesion, session_id, "la sesión ha finalizado")
 
     try:
         import app.api.ws as ws_module
@@ -286,12 +294,12 @@ async def end_session_by_id(session_id: int, db: SessionDep, current_user: Curre
     return updated
 
 @router.delete('/session/{session_id}')
-async def delete_session_by_id(session_id: int, db: SessionDep, current_user: CurrentUser):
+async def delete_session_by_id(session_id: int, db: AsyncSessionDep, current_user: CurrentUser):
     """Elimina una sesión (solo terapeuta).
     
     Args:
         session_id (int): ID de la sesión a eliminar.
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado (debe ser terapeuta).
     
     Returns:
@@ -301,20 +309,20 @@ async def delete_session_by_id(session_id: int, db: SessionDep, current_user: Cu
         HTTPException: 403 si el usuario no es terapeuta.
         HTTPException: 404 si la sesión no existe.
     """
-    return crud.session.delete_session(db, session_id, current_user.id, current_user.type)
+    return await crud.session.delete_session_async(db, session_id, current_user.id, current_user.type)
 
 
 
 @router.get('/sessions/{session_id}/images', response_model=schemas.ImagesOut)
-async def get_images_for_session(db: SessionDep, session_id: int, current_user: CurrentUser):
+async def get_images_for_session(db: AsyncSessionDep, session_id: int, current_user: CurrentUser):
     """Obtiene todas las imágenes generadas durante una sesión.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         session_id (int): ID de la sesión.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
         schemas.ImagesOut: Lista de imágenes de la sesión.
     """
-    return crud.session.get_images_for_session(db=db, session_id=session_id)
\ No newline at end of file
+    return await crud.session.get_images_for_session_async(db=db, session_id=session_id)
\ No newline at end of file
@@ -2,6 +2,9 @@
 
 Endpoints para autenticación, registro y gestión de usuarios.
 Incluye operaciones CRUD de usuarios e imágenes sin sesión asociada.
+
+Las lecturas usan la sesión asíncrona (``AsyncSessionDep``); el registro y el
+login (síncronos, con el hash de bcrypt) se ejecutan en el pool de ``services.executor``.
 """
 
 from fastapi import APIRouter, Depends, HTTPException
@@ -9,31 +12,31 @@ from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated, List
 import app.schemas as schemas
 from sqlalchemy.orm import Session
-from app.dependencies import SessionDep, CurrentUser
+from app.dependencies import AsyncSessionDep, SessionDep, CurrentUser
 import app.crud as crud
+from app.services.executor import ejecutar as run_blocking
 
 router = APIRouter()
 
 
 @router.get("/users/", response_model=List[schemas.User])
-async def read_users(db: SessionDep):
+async def read_users(db: AsyncSessionDep):
     """Obtiene lista de todos los usuarios.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
     
     Returns:
         List[schemas.User]: Lista de todos los usuarios registrados.
     """
-    users = crud.user.get_users(db)
-    return users
+    return await crud.user.get_users_async(db)
 
 @router.get("/users/me", response_model=schemas.User)
-def read_user_me(db: SessionDep, current_user: CurrentUser):
+async def read_user_me(db: AsyncSessionDep, current_user: CurrentUser):
     """Obtiene información del usuario actual autenticado.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         current_user (CurrentUser): Usuario autenticado desde token JWT.
     
     Returns:
@@ -43,11 +46,11 @@ def read_user_me(db: SessionDep, current_user: CurrentUser):
 
 
 @router.get("/users/{user_id}", response_model=schemas.User)
-async def read_user(db: SessionDep, user_id: int, current_user: CurrentUser):
+async def read_user(db: AsyncSessionDep, user_id: int, current_user: CurrentUser):
     """Obtiene información de un usuario por ID.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         user_id (int): ID del usuario a consultar.
         current_user (CurrentUser): Usuario autenticado.
     
@@ -57,7 +60,7 @@ async def read_user(db: SessionDep, user_id: int, current_user: CurrentUser):
     Raises:
         HTTPException: 404 si el usuario no existe.
     """
-    db_user = crud.user.get_user(db, user_id=user_id)
+    db_user = await crud.user.get_user_async(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return db_user
@@ -76,10 +79,10 @@ async def create_user(db: SessionDep, user: schemas.UserCreate):
     Raises:
         HTTPException: 400 si el email ya está registrado.
     """
-    db_user = crud.user.get_user_by_email(db, email=user.email)
+    db_user = await run_blocking(crud.user.get_user_by_email, db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="El correo ya está registrado")
-    return crud.user.create_user(db=db, user=user)
+    return await run_blocking(crud.user.create_user, db=db, user=user)
 
 @router.post("/login/")
 async def login_access_token(db: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
@@ -97,20 +100,20 @@ async def login_access_token(db: SessionDep, form_data: Annotated[OAuth2Password
     Raises:
         HTTPException: 401 si las credenciales son inválidas.
     """
-    return crud.user.login_user(db=db, email=form_data.username, password=form_data.password)
+    return await run_blocking(crud.user.login_user, db=db, email=form_data.username, password=form_data.password)
 
 
 
 @router.get('/users/{user_id}/free-images', response_model=schemas.ImagesOut)
-async def get_images_for_user_no_session(db: SessionDep, user_id: int, current_user: CurrentUser):
+async def get_images_for_user_no_session(db: AsyncSessionDep, user_id: int, current_user: CurrentUser):
     """Obtiene imágenes del usuario sin sesión asociada.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         user_id (int): ID del usuario.
         current_user (CurrentUser): Usuario autenticado.
     
     Returns:
         schemas.ImagesOut: Imágenes del usuario sin session_id.
     """
-    return crud.user.get_images_for_user_no_session(db=db, user_id=user_id)
\ No newline at end of file
+    return await crud.user.get_images_for_user_no_session_async(db=db, user_id=user_id)
\ No newline at end of file
@@ -4,6 +4,12 @@ Proporciona endpoints WebSocket para:
 - Comunicación bidireccional durante sesiones (chat, notificaciones de imágenes)
 - Notificaciones en Home/Calendar (nuevas sesiones creadas)
 
+Durante las generaciones de una sesión, paciente y terapeuta reciben el paso de
+muestreo y vistas previas reducidas (``notify_job_progress``).
+
+Si el paciente se desconecta de la sesión y no vuelve en
+``JOB_DISCONNECT_GRACE_SECONDS``, se cancelan sus generaciones pendientes de esa sesión.
+
 Attributes:
     active_sessions (Dict[int, Dict[str, WebSocket]]): Conexiones activas por sesión.
         Estructura: {session_id: {"patient": WebSocket, "therapist": WebSocket}}
@@ -12,10 +18,12 @@ Attributes:
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict
+from typing import Dict, Set
 from app.security import decode_access_token
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 import app.models as models
+import app.services as services
+from app.services.executor import ejecutar as run_blocking
 import json
 import asyncio
 
@@ -23,6 +31,10 @@ router = APIRouter()
 
 active_sessions: Dict[int, Dict[str, WebSocket]] = {}
 home_ws_connections: Dict[int, WebSocket] = {}
+# Referencias a las esperas tras una desconexión, para que no se recojan antes de tiempo
+_disconnect_tasks: Set[asyncio.Task] = set()
+# Sockets con un mensaje de progreso aún enviándose (los siguientes se descartan)
+_progress_in_flight: Set[int] = set()
 
 
 @router.websocket("/ws/{session_id}/{role}")
@@ -69,10 +81,10 @@ async def websocket_endpoint(websocket: WebSocket, session_id: int, role: str):
         return
 
     # 3. Verificar sesión y rol en la base de datos
-    db = SessionLocal()
+    db = AsyncSessionLocal()
     try:
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        session = db.query(models.Session).filter(models.Session.id == session_id).first()
+        user = await db.get(models.User, user_id)
+        session = await db.get(models.Session, session_id)
 
         if not user or not session:
             await websocket.close(code=1008)
@@ -92,7 +104,7 @@ async def websocket_endpoint(websocket: WebSocket, session_id: int, role: str):
             return
 
     finally:
-        db.close()
+        await db.close()
 
     # 4. Aceptar conexión
     await websocket.accept()
@@ -130,6 +142,34 @@ async def websocket_endpoint(websocket: WebSocket, session_id: int, role: str):
             del active_sessions[session_id][role]
         if session_id in active_sessions and not active_sessions[session_id]:
             del active_sessions[session_id]
+        if role == "patient":
+            tarea = asyncio.create_task(cancel_jobs_if_patient_left(session_id, user_id))
+            _disconnect_tasks.add(tarea)
+            tarea.add_done_callback(_disconnect_tasks.discard)
+
+
+async def cancel_jobs_if_patient_left(session_id: int, user_id: int):
+    """Cancela las generaciones del paciente si no vuelve a conectarse a la sesión.
+
+    Args:
+        session_id (int): ID de la sesión de la que se desconectó.
+        user_id (int): ID del paciente.
+
+    Note:
+        Espera ``JOB_DISCONNECT_GRACE_SECONDS`` para no cancelar nada por una
+        recarga de la página o un corte breve de red (0 = no cancelar nunca).
+    """
+    grace = services.jobs.JOB_DISCONNECT_GRACE_SECONDS
+    if grace <= 0:
+        return
+    await asyncio.sleep(grace)
+    if "patient" in active_sessions.get(session_id, {}):
+        return
+    canceladas = await run_blocking(
+        services.jobs.manager.cancelar_sesion, session_id, "el paciente se desconectó de la sesión", user_id=user_id
+    )
+    if canceladas:
+        print(f"{canceladas} generaciones canceladas en la sesión {session_id} tras desconectarse el paciente")
 
 @router.websocket("/ws/home")
 async def websocket_home(websocket: WebSocket):
@@ -223,4 +263,76 @@ def notify_new_session_to_patient(patient_id: int, session_id: int):
         try:
             asyncio.run(send_notification())
         except Exception as e2:
-            print(f"Error en fallback: {e2}")
\ No newline at end of file
+            print(f"Error en fallback: {e2}")
+
+async def notify_job_update(job: dict):
+    """Envía por WebSocket el nuevo estado de un trabajo de generación.
+
+    Se registra como oyente de ``services.jobs.manager`` y se ejecuta en el event
+    loop de la aplicación cada vez que un trabajo cambia de estado.
+
+    Args:
+        job (dict): Estado del trabajo (formato ``schemas.GenerationJob``).
+
+    Protocol:
+        - Server → Client: {"event": "generation_job", "job": {...}}
+
+    Note:
+        Se notifica al paciente en /ws/home y, si el trabajo pertenece a una sesión,
+        a los dos participantes conectados a /ws/{session_id}/{role}.
+    """
+    message = json.dumps({"event": "generation_job", "job": job})
+
+    targets = []
+    home_ws = home_ws_connections.get(job["user_id"])
+    if home_ws:
+        targets.append(home_ws)
+    if job.get("session_id") is not None:
+        targets.extend(active_sessions.get(job["session_id"], {}).values())
+
+    for websocket in targets:
+        try:
+            await websocket.send_text(message)
+        except Exception as e:
+            print(f"Error notificando el trabajo {job['id']}: {e}")
+
+
+async def notify_job_progress(progress: dict):
+    """Envía el progreso de una generación a los participantes de su sesión.
+
+    Se registra con ``services.jobs.manager.subscribe_progress``.
+
+    Args:
+        progress (dict): ``job_id``, ``user_id``, ``session_id`` y ``kind`` del trabajo
+            con ``step``/``steps``/``node`` o ``preview`` (data URL WebP o JPEG).
+
+    Protocol:
+        - Server → Client: {"event": "generation_progress", "jobId": str, "kind": str,
+          "step": int, "steps": int, "node": str} o {..., "preview": str}
+
+    Note:
+        Si el mensaje anterior a un socket aún no se ha terminado de enviar (cliente
+        lento), el nuevo se descarta: solo interesa el progreso más reciente.
+    """
+    message = {"event": "generation_progress", "jobId": progress["job_id"], "kind": progress["kind"]}
+    for key in ("step", "steps", "node", "preview"):
+        if key in progress:
+            message[key] = progress[key]
+    text = json.dumps(message)
+
+    # En paralelo: un cliente lento no retrasa al otro
+    await asyncio.gather(*(
+        _send_progress(websocket, text, progress["job_id"])
+        for websocket in list(active_sessions.get(progress["session_id"], {}).values())
+        if id(websocket) not in _progress_in_flight
+    ))
+
+
+async def _send_progress(websocket: WebSocket, text: str, job_id: str):
+    _progress_in_flight.add(id(websocket))
+    try:
+        await websocket.send_text(text)
+    except Exception as e:
+        print(f"Error enviando el progreso del trabajo {job_id}: {e}")
+    finally:
+        _progress_in_flight.discard(id(websocket))
@@ -1,47 +1,34 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import app.models as models
 import app.schemas as schemas
 import app.services as services
+import hashlib
+import json
+from datetime import datetime
 import os
 from pathlib import Path
 
-def create_user_image(db: Session, prompt: schemas.Prompt, user_id: int, session_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user.type != 'patient':
-        raise HTTPException(status_code=404, detail="Los terapeutas no pueden tener imágenes")
-    
-    # Validar que la sesión existe y pertenece al usuario
-    if session_id is not None:
-        db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
-        if not db_session:
-            raise HTTPException(status_code=404, detail="Sesión no encontrada")
-        if db_session.patient_id != user_id and db_session.therapist_id != user_id:
-            raise HTTPException(status_code=403, detail="El usuario no es parte de esta sesión")
-        if db_session.ended_at is not None:
-            raise HTTPException(status_code=400, detail="No se pueden agregar imágenes a una sesión finalizada")
-    
-    try:
-        image = services.image_generation.generar_imagen(prompt.promptText, user_id=user_id, prompt_seed=prompt.seed, input_img=prompt.inputImage)
-        gen_seed = image.get("seed") if isinstance(image, dict) else None
-        db_image = models.Image(fileName=image["file"], seed=gen_seed, owner_id=user_id, session_id=session_id)
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
-        return image
-    except HTTPException:
-        # Re-raise HTTP exceptions (from image generation service)
-        raise
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al crear imagen: {str(e)}"
-        )
+def _validar_generacion(db: Session, user_id: int, session_id: int | None):
+    """Comprueba que el usuario puede generar imágenes en la sesión indicada.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        user_id (int): ID del usuario que genera la imagen.
+        session_id (int | None): ID de la sesión a la que se asociará la imagen.
 
-def create_user_sketch_image(db: Session, prompt: schemas.SketchPrompt, user_id: int, session_id: int):
+    Returns:
+        models.Session | None: La sesión validada, o None si no se indica sesión.
+
+    Raises:
+        HTTPException: 404 si el usuario no es paciente o la sesión no existe.
+        HTTPException: 403 si el usuario no participa en la sesión.
+        HTTPException: 400 si la sesión ya ha finalizado.
+    """
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user.type != 'patient':
+    if not db_user or db_user.type != 'patient':
         raise HTTPException(status_code=404, detail="Los terapeutas no pueden tener imágenes")
     
     # Validar que la sesión existe y pertenece al usuario
@@ -53,23 +40,188 @@ def create_user_sketch_image(db: Session, prompt: schemas.SketchPrompt, user_id:
             raise HTTPException(status_code=403, detail="El usuario no es parte de esta sesión")
         if db_session.ended_at is not None:
             raise HTTPException(status_code=400, detail="No se pueden agregar imágenes a una sesión finalizada")
-    
+        return db_session
+    return None
+
+
+def _sesion_activa(db_session) -> bool:
+    """Indica si la sesión está en curso (mismo criterio que ``GET /sessions/active``).
+
+    Args:
+        db_session (models.Session | None): Sesión validada por ``_validar_generacion``.
+
+    Returns:
+        bool: True si ``start_date <= ahora <= end_date`` y no se ha finalizado.
+    """
+    if db_session is None or db_session.ended_at is not None:
+        return False
+    now = datetime.utcnow()
+    return db_session.start_date <= now <= db_session.end_date
+
+
+def _guardar_imagen_generada(db: Session, image: dict, user_id: int, session_id: int | None) -> dict:
+    """Registra en base de datos una imagen devuelta por el servicio de generación.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        image (dict): Resultado del servicio (message, file, fullPath, seed).
+        user_id (int): ID del paciente propietario.
+        session_id (int | None): ID de la sesión asociada.
+
+    Returns:
+        dict: El resultado del servicio más la clave ``image`` con la fila creada.
+    """
+    gen_seed = image.get("seed") if isinstance(image, dict) else None
+    db_image = models.Image(fileName=image["file"], seed=gen_seed, owner_id=user_id, session_id=session_id)
+    db.add(db_image)
+    db.commit()
+    db.refresh(db_image)
+    return {**image, "image": {"id": db_image.id, "fileName": db_image.fileName, "seed": db_image.seed}}
+
+
+def _guardar_imagenes_generadas(db: Session, images: list, user_id: int, session_id: int | None) -> list:
+    """Registra todas las imágenes de un lote en una sola transacción.
+
+    Args:
+        db (Session): Sesión de base de datos.
+        images (list[dict]): Resultados del servicio (message, file, fullPath, seed).
+        user_id (int): ID del paciente propietario.
+        session_id (int | None): ID de la sesión asociada.
+
+    Returns:
+        list[dict]: Cada resultado más la clave ``image`` con su fila creada.
+    """
+    db_images = [
+        models.Image(fileName=image["file"], seed=image.get("seed"), owner_id=user_id, session_id=session_id)
+        for image in images
+    ]
+    db.add_all(db_images)
+    db.commit()
+    return [
+        {**image, "image": {"id": db_image.id, "fileName": db_image.fileName, "seed": db_image.seed}}
+        for image, db_image in zip(images, db_images)
+    ]
+
+
+def _huella_peticion(kind: str, session_id: int | None, datos: dict) -> str:
+    """Hash canónico de una petición de generación.
+
+    Dos peticiones con el mismo tipo, sesión y parámetros (en cualquier orden de
+    claves) tienen la misma huella y, mientras la primera siga en curso, comparten trabajo.
+
+    Args:
+        kind (str): Tipo de generación.
+        session_id (int | None): ID de la sesión asociada.
+        datos (dict): Cuerpo de la petición.
+
+    Returns:
+        str: SHA-256 en hexadecimal.
+    """
+    canonico = json.dumps([kind, session_id, datos], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def _modelos_plantilla(nombre: str) -> frozenset:
+    """Modelos que carga una plantilla de workflow (vacío si no se puede leer)."""
     try:
-        image = services.image_generation.convertir_boceto_imagen(prompt.sketchImage, prompt.sketchText, user_id=user_id)
-        gen_seed = image.get("seed") if isinstance(image, dict) else None
-        db_image = models.Image(fileName=image["file"], seed=gen_seed, owner_id=user_id, session_id=session_id)
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
-        return image
-    except HTTPException:
-        raise
-    except Exception as e:
-        db.rollback()
+        return services.workflows.registro.get(nombre).modelos
+    except (OSError, ValueError) as e:
+        print(f"No se pudieron leer los modelos de la plantilla {nombre}: {e}")
+        return frozenset()
+
+
+def _encolar_generacion(kind: str, user_id: int, session_id: int | None, generar, error_msg: str, guardar=_guardar_imagen_generada,
+                        datos: dict | None = None, idempotency_key: str | None = None, plantilla: str | None = None,
+                        sesion_activa: bool = False) -> dict:
+    """Encola un trabajo que ejecuta ``generar`` y guarda la imagen resultante.
+
+    Si ya hay un trabajo equivalente (misma petición en curso o misma clave de
+    idempotencia) se devuelve ese trabajo en lugar de encolar otro.
+
+    Args:
+        kind (str): Tipo de generación.
+        user_id (int): ID del paciente propietario.
+        session_id (int | None): ID de la sesión asociada.
+        generar (Callable[[], dict]): Llamada al servicio de generación.
+        error_msg (str): Prefijo del mensaje para errores inesperados.
+        guardar (Callable): Función que registra el resultado en base de datos.
+        datos (dict, optional): Cuerpo de la petición, para detectar duplicados.
+        idempotency_key (str, optional): Valor de la cabecera ``Idempotency-Key``.
+        plantilla (str, optional): Plantilla de workflow que usará, para agrupar
+            en la cola los trabajos que cargan los mismos modelos.
+        sesion_activa (bool): Si la sesión está en curso; solo entonces el trabajo
+            tiene la prioridad de sesión.
+
+    Returns:
+        dict: Estado inicial del trabajo (``schemas.GenerationJob``).
+    """
+    def task(job_db: Session):
+        try:
+            image = generar()
+            return guardar(job_db, image, user_id, session_id)
+        except HTTPException:
+            # Re-raise HTTP exceptions (from image generation service)
+            raise
+        except Exception as e:
+            job_db.rollback()
+            raise HTTPException(
+                status_code=500,
+                detail=f"{error_msg}: {str(e)}"
+            )
+
+    huella = _huella_peticion(kind, session_id, datos) if datos is not None else None
+    prioridad = services.jobs.PRIORIDAD_SESION if sesion_activa else services.jobs.PRIORIDAD_LIBRE
+    modelos = _modelos_plantilla(plantilla) if plantilla else frozenset()
+    manager = services.jobs.manager
+    job = manager.submit(kind, user_id, session_id, task, huella=huella, idempotency_key=idempotency_key,
+                         prioridad=prioridad, modelos=modelos)
+    return manager.describir(job)
+
+
+def create_user_image(db: Session, prompt: schemas.Prompt, user_id: int, session_id: int, idempotency_key: str | None = None):
+    sesion_activa = _sesion_activa(_validar_generacion(db, user_id, session_id))
+    if prompt.count > 1 or prompt.seeds:
+        return _create_user_image_batch(prompt, user_id, session_id, idempotency_key, sesion_activa)
+    return _encolar_generacion(
+        "txt2img", user_id, session_id,
+        lambda: services.image_generation.generar_imagen(prompt.promptText, user_id=user_id, prompt_seed=prompt.seed, input_img=prompt.inputImage),
+        "Error al crear imagen",
+        datos=prompt.model_dump(), idempotency_key=idempotency_key,
+        plantilla="img2img" if prompt.inputImage else "txt2img", sesion_activa=sesion_activa,
+    )
+
+def _create_user_image_batch(prompt: schemas.Prompt, user_id: int, session_id: int, idempotency_key: str | None = None,
+                             sesion_activa: bool = False):
+    """Encola la generación de varias variaciones de un prompt en un solo envío.
+
+    Raises:
+        HTTPException: 422 si se piden más imágenes que ``GENERATION_MAX_BATCH``.
+    """
+    count = len(prompt.seeds) if prompt.seeds else prompt.count
+    if count > services.image_generation.GENERATION_MAX_BATCH:
         raise HTTPException(
-            status_code=500,
-            detail=f"Error al crear imagen desde boceto: {str(e)}"
+            status_code=422,
+            detail=f"Se pueden generar como máximo {services.image_generation.GENERATION_MAX_BATCH} imágenes por petición"
         )
+    seeds = services.image_generation.semillas_lote(count, seed=prompt.seed, seeds=prompt.seeds, stride=prompt.seedStride)
+    return _encolar_generacion(
+        "txt2img-batch", user_id, session_id,
+        lambda: services.image_generation.generar_imagenes(prompt.promptText, user_id=user_id, seeds=seeds, input_img=prompt.inputImage),
+        "Error al crear imágenes",
+        guardar=_guardar_imagenes_generadas,
+        datos=prompt.model_dump(), idempotency_key=idempotency_key,
+        plantilla="img2img" if prompt.inputImage else "txt2img", sesion_activa=sesion_activa,
+    )
+
+def create_user_sketch_image(db: Session, prompt: schemas.SketchPrompt, user_id: int, session_id: int, idempotency_key: str | None = None):
+    sesion_activa = _sesion_activa(_validar_generacion(db, user_id, session_id))
+    return _encolar_generacion(
+        "sketch2img", user_id, session_id,
+        lambda: services.image_generation.convertir_boceto_imagen(prompt.sketchImage, prompt.sketchText, user_id=user_id),
+        "Error al crear imagen desde boceto",
+        datos=prompt.model_dump(), idempotency_key=idempotency_key,
+        plantilla="sketch2img", sesion_activa=sesion_activa,
+    )
 
 
 def create_user_uploaded_image(db: Session, upload_file, user_id: int, isDrawn: bool = False):
@@ -148,37 +300,40 @@ def get_images_for_user(db: Session, user_id: int):
         "data": images,
         "count": len(images)
     }
-def create_user_img_by_mult_images(db: Session, images: schemas.TemplateImagesIn, user_id: int, session_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user.type != 'patient':
-        raise HTTPException(status_code=404, detail="Los terapeutas no pueden tener imágenes")
-    
-    # Validar que la sesión existe y pertenece al usuario
-    if session_id is not None:
-        db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
-        if not db_session:
-            raise HTTPException(status_code=404, detail="Sesión no encontrada")
-        if db_session.patient_id != user_id and db_session.therapist_id != user_id:
-            raise HTTPException(status_code=403, detail="El usuario no es parte de esta sesión")
-        if db_session.ended_at is not None:
-            raise HTTPException(status_code=400, detail="No se pueden agregar imágenes a una sesión finalizada")
-    
-    try:
-        image = services.image_generation.generate_image_by_mult_images(images.data, count=len(images.data), user_id=user_id)    
-        gen_seed = image.get("seed") if isinstance(image, dict) else None
-        db_image = models.Image(fileName=image["file"], seed=gen_seed, owner_id=user_id, session_id=session_id)
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
-        return image
-    except HTTPException:
-        raise
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al crear imagen desde múltiples imágenes: {str(e)}"
-        )
+
+async def get_images_for_user_async(db: AsyncSession, user_id: int):
+    """Versión asíncrona de ``get_images_for_user``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        user_id (int): ID del usuario.
+
+    Returns:
+        dict: Imágenes del usuario (``data``) y su número (``count``).
+
+    Raises:
+        HTTPException: 404 si el usuario no existe.
+    """
+    if await db.get(models.User, user_id) is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    images = (await db.scalars(select(models.Image).where(models.Image.owner_id == user_id))).all()
+    return {
+        "data": images,
+        "count": len(images)
+    }
+
+def create_user_img_by_mult_images(db: Session, images: schemas.TemplateImagesIn, user_id: int, session_id: int, idempotency_key: str | None = None):
+    sesion_activa = _sesion_activa(_validar_generacion(db, user_id, session_id))
+    if not 2 <= len(images.data) <= 4:
+        raise HTTPException(status_code=422, detail="Se necesitan entre 2 y 4 imágenes para combinarlas")
+    return _encolar_generacion(
+        "multimg", user_id, session_id,
+        lambda: services.image_generation.generate_image_by_mult_images(images.data, count=len(images.data), user_id=user_id),
+        "Error al crear imagen desde múltiples imágenes",
+        datos=images.model_dump(), idempotency_key=idempotency_key,
+        plantilla=f"multimg{len(images.data)}", sesion_activa=sesion_activa,
+    )
 
 def link_image_to_session(db: Session, image_file_name: str, user_id: int, session_id: int):
     """Crea un registro de imagen asociado a una sesión sin duplicar el archivo."""
@@ -255,3 +410,52 @@ def link_image_to_session(db: Session, image_file_name: str, user_id: int, sessi
                 status_code=500,
                 detail=f"Error al asociar imagen a la sesión: {str(e)}"
             )
+
+async def link_image_to_session_async(db: AsyncSession, image_file_name: str, user_id: int, session_id: int):
+    """Versión asíncrona de ``link_image_to_session``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        image_file_name (str): Nombre del archivo de imagen existente.
+        user_id (int): ID del paciente propietario.
+        session_id (int): ID de la sesión a la que se asocia.
+
+    Returns:
+        dict: Mensaje, archivo, ruta y semilla de la imagen asociada.
+
+    Raises:
+        HTTPException: 404 si el usuario no es paciente o la sesión no existe.
+        HTTPException: 403 si no es el paciente de la sesión, 400 si la sesión ha finalizado.
+        HTTPException: 500 si falla el registro en base de datos.
+    """
+    db_user = await db.get(models.User, user_id)
+    if not db_user or db_user.type != 'patient':
+        raise HTTPException(status_code=404, detail="Usuario no encontrado o no es paciente")
+
+    db_session = await db.get(models.Session, session_id)
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    if db_session.patient_id != user_id:
+        raise HTTPException(status_code=403, detail="El usuario no es paciente de esta sesión")
+    if db_session.ended_at is not None:
+        raise HTTPException(status_code=400, detail="No se pueden agregar imágenes a una sesión finalizada")
+
+    db_image = (await db.scalars(
+        select(models.Image).where(models.Image.fileName == image_file_name, models.Image.owner_id == user_id).limit(1)
+    )).first()
+    seed = db_image.seed if db_image else None
+    try:
+        db.add(models.Image(fileName=image_file_name, seed=seed, owner_id=user_id, session_id=session_id))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        detalle = "Error al asociar imagen a la sesión" if db_image else "Error al crear registro de imagen"
+        raise HTTPException(status_code=500, detail=f"{detalle}: {str(e)}")
+
+    image_path = f"generated/{image_file_name}" if not image_file_name.startswith("drawn_") else f"drawn/{image_file_name}"
+    return {
+        "message": "Imagen asociada a la sesión correctamente",
+        "file": image_file_name,
+        "fullPath": image_path,
+        "seed": seed
+    }
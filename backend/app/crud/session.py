@@ -1,3 +1,5 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import app.models as models
@@ -70,6 +72,38 @@ def finalize_expired_sessions(db: Session, user_id: int | None = None):
     return len(to_close)
 
 
+async def finalize_expired_sessions_async(db: AsyncSession, user_id: int | None = None):
+    """Versión asíncrona de ``finalize_expired_sessions``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        user_id (int | None): Si se indica, solo se finalizan las sesiones de ese usuario.
+
+    Returns:
+        int: Número de sesiones finalizadas.
+    """
+    query = select(models.Session).where(
+            models.Session.ended_at == None,
+            models.Session.end_date != None,
+            models.Session.end_date <= datetime.utcnow()
+    )
+
+    if user_id is not None:
+        query = query.where(
+            (models.Session.patient_id == user_id) | (models.Session.therapist_id == user_id)
+        )
+
+    to_close = (await db.scalars(query)).all()
+    if not to_close:
+        return 0
+
+    for session in to_close:
+        session.ended_at = session.end_date
+
+    await db.commit()
+    return len(to_close)
+
+
 def create_session_for_users(db: Session, patient_id: int, therapist_id: int, session: schemas.SessionCreate):
     patient = db.query(models.Patient).filter(models.Patient.id == patient_id).first()
     therapist = db.query(models.Therapist).filter(models.Therapist.id == therapist_id).first()
@@ -104,6 +138,29 @@ def end_session(db: Session, session_id: int):
     db.refresh(db_session)
     return db_session
 
+async def end_session_async(db: AsyncSession, session_id: int):
+    """Versión asíncrona de ``end_session``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        session_id (int): ID de la sesión a finalizar.
+
+    Returns:
+        models.Session: Sesión con ``ended_at`` establecido.
+
+    Raises:
+        HTTPException: 404 si la sesión no existe, 400 si ya estaba finalizada.
+    """
+    db_session = await db.get(models.Session, session_id)
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    if db_session.ended_at is not None:
+        raise HTTPException(status_code=400, detail="La sesión ya ha finalizado")
+    db_session.ended_at = datetime.utcnow()
+    await db.commit()
+    await db.refresh(db_session)
+    return db_session
+
 def get_images_for_session(db: Session, session_id: int):
     """Retrieve all images for a given session."""
     db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
@@ -114,3 +171,48 @@ def get_images_for_session(db: Session, session_id: int):
         "data": images,
         "count": len(images)
     }
+
+async def get_images_for_session_async(db: AsyncSession, session_id: int):
+    """Versión asíncrona de ``get_images_for_session``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        session_id (int): ID de la sesión.
+
+    Returns:
+        dict: Imágenes de la sesión (``data``) y su número (``count``).
+
+    Raises:
+        HTTPException: 404 si la sesión no existe.
+    """
+    if await db.get(models.Session, session_id) is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    images = (await db.scalars(select(models.Image).where(models.Image.session_id == session_id))).all()
+    return {
+        "data": images,
+        "count": len(images)
+    }
+
+async def delete_session_async(db: AsyncSession, session_id: int, user_id: int, user_type: str):
+    """Versión asíncrona de ``delete_session``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        session_id (int): ID de la sesión a eliminar.
+        user_id (int): ID del usuario que la elimina.
+        user_type (str): Tipo del usuario ('patient' o 'therapist').
+
+    Returns:
+        dict: Mensaje de confirmación.
+
+    Raises:
+        HTTPException: 404 si la sesión no existe, 403 si el usuario no es su terapeuta.
+    """
+    db_session = await db.get(models.Session, session_id)
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    if user_type != 'therapist' or user_id != db_session.therapist_id:
+        raise HTTPException(status_code=403, detail="Solo el terapeuta de esta sesión puede eliminarla")
+    await db.delete(db_session)
+    await db.commit()
+    return {"detail": "Session deleted successfully"}
@@ -2,8 +2,14 @@
 
 Funciones para crear, leer y autenticar usuarios.
 Incluye validación de contraseñas y generación de tokens JWT.
+
+Las lecturas frecuentes tienen una versión ``*_async`` para ``AsyncSession``
+que se usa desde los endpoints asíncronos; el registro y el login siguen
+siendo síncronos (el hash de bcrypt se ejecuta en el pool de hilos).
 """
 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import app.models as models
@@ -30,6 +36,24 @@ def get_user(db: Session, user_id: int):
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return user
 
+async def get_user_async(db: AsyncSession, user_id: int):
+    """Versión asíncrona de ``get_user``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        user_id (int): ID del usuario.
+
+    Returns:
+        models.User: Usuario encontrado (Patient o Therapist).
+
+    Raises:
+        HTTPException: 404 si el usuario no existe.
+    """
+    user = await db.get(models.User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return user
+
 def get_user_by_email(db: Session, email: str):
     """Busca un usuario por email.
     
@@ -53,6 +77,17 @@ def get_users(db: Session):
     """
     return db.query(models.User).all()
 
+async def get_users_async(db: AsyncSession):
+    """Versión asíncrona de ``get_users``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+
+    Returns:
+        List[models.User]: Lista de todos los usuarios.
+    """
+    return (await db.scalars(select(models.User))).all()
+
 def create_user(db: Session, user: schemas.UserCreate):
     """Crea un nuevo usuario (Patient o Therapist).
     
@@ -181,4 +216,28 @@ def get_images_for_user_no_session(db: Session, user_id: int):
     return {
         "data": images,
         "count": len(images)
-    }
\ No newline at end of file
+    }
+
+async def get_images_for_user_no_session_async(db: AsyncSession, user_id: int):
+    """Versión asíncrona de ``get_images_for_user_no_session``.
+
+    Args:
+        db (AsyncSession): Sesión asíncrona de base de datos.
+        user_id (int): ID del usuario.
+
+    Returns:
+        dict: Imágenes sin session_id.
+
+    Raises:
+        HTTPException: 404 si el usuario no existe.
+    """
+    if await db.get(models.User, user_id) is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    images = (await db.scalars(
+        select(models.Image).where(models.Image.owner_id == user_id, models.Image.session_id == None)
+    )).all()
+    return {
+        "data": images,
+        "count": len(images)
+    }
@@ -3,22 +3,31 @@
 Este módulo proporciona dependencias comunes utilizadas en los endpoints,
 incluyendo sesiones de base de datos y autenticación de usuarios.
 
+Los endpoints ``async def`` usan ``AsyncSessionDep`` y las funciones ``*_async``
+del CRUD; ``SessionDep`` queda para los endpoints síncronos y el CRUD que se
+ejecuta en el pool de ``services.executor``.
+
 Attributes:
     SessionDep (Annotated[Session, Depends(get_db)]): Tipo anotado para inyección de sesión DB.
+    AsyncSessionDep (Annotated[AsyncSession, Depends(get_async_db)]): Tipo anotado para la sesión DB asíncrona.
     AuthDep (Annotated[str, Depends(oauth2_scheme)]): Tipo anotado para token JWT.
     CurrentUser (Annotated[models.User, Depends(get_current_user)]): Tipo anotado para usuario autenticado.
     oauth2_scheme (OAuth2PasswordBearer): Esquema OAuth2 para autenticación.
+    ComfyClientDep (Annotated[ComfyClient, Depends(get_comfy_client)]): Tipo anotado para el cliente de ComfyUI.
 """
 
 from typing import Annotated
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .database import SessionLocal
+from .database import AsyncSessionLocal, SessionLocal
 from app.security import decode_access_token
 import app.crud as crud
 from fastapi import HTTPException, status
 import app.models as models
+from app.services.comfy_client import ComfyClient
+import app.services as services
 
 def get_db():
     """Generador de sesiones de base de datos.
@@ -37,18 +46,32 @@ def get_db():
 
 SessionDep = Annotated[Session, Depends(get_db)]
 
+async def get_async_db():
+    """Generador de sesiones asíncronas de base de datos.
+
+    Yields:
+        AsyncSession: Sesión asíncrona de SQLAlchemy.
+
+    Note:
+        La sesión se cierra automáticamente al finalizar la petición.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_db)]
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 AuthDep = Annotated[str, Depends(oauth2_scheme)]
 
-def get_current_user(
-    db: SessionDep,
+async def get_current_user(
+    db: AsyncSessionDep,
     token: AuthDep
 ):
     """Obtiene el usuario actual desde el token JWT.
     
     Args:
-        db (Session): Sesión de base de datos.
+        db (AsyncSession): Sesión asíncrona de base de datos.
         token (str): Token JWT del header Authorization.
     
     Returns:
@@ -58,9 +81,23 @@ def get_current_user(
         HTTPException: 401 si el token es inválido o el usuario no existe.
     """
     user_id = decode_access_token(token)
-    user = crud.user.get_user(db, user_id=user_id)
+    user = await crud.user.get_user_async(db, user_id=user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado")
     return user
 
 CurrentUser = Annotated[models.User, Depends(get_current_user)]
+
+
+def get_comfy_client() -> ComfyClient:
+    """Obtiene el cliente HTTP compartido de ComfyUI.
+
+    Returns:
+        ComfyClient: Cliente con pool de conexiones de la aplicación.
+
+    Note:
+        Los tests pueden sustituirlo con ``app.dependency_overrides``.
+    """
+    return services.comfy_client.get_client()
+
+ComfyClientDep = Annotated[ComfyClient, Depends(get_comfy_client)]
@@ -1,26 +1,59 @@
 """Módulo principal de la aplicación FastAPI de arteterapia.
 
 Este módulo configura la aplicación FastAPI principal, incluyendo:
-- Inicialización de la base de datos
+- Comprobación (y migración) del esquema de la base de datos
 - Configuración de CORS
 - Montaje de archivos estáticos
 - Registro de routers de API
+- Arranque y parada del pool de trabajadores de generación
 
 Attributes:
     app (FastAPI): Instancia principal de la aplicación FastAPI.
 """
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
 from pydantic import BaseModel, Field, EmailStr, HttpUrl, field_validator
 import re, os
-from app.api import users, comfy, ws, sessions
+from app.api import users, comfy, ws, sessions, metrics, images
 import app.models as models
-from .database import engine
+import app.migrations as migrations
+import app.services as services
+from .database import async_engine, engine
+
+services.jobs.manager.subscribe(ws.notify_job_update)
+services.jobs.manager.subscribe_progress(ws.notify_job_progress)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca los trabajadores de generación, los clientes HTTP de las instancias
+    de ComfyUI (con su comprobación de salud) y el vigilante de salidas de ComfyUI.
+
+    Todos se detienen al apagar la aplicación. Antes de aceptar peticiones se
+    comprueba (y migra) el esquema de la base de datos y se cargan y validan
+    las plantillas de workflow. La comprobación del esquema no se hace al
+    importar el módulo para no tocar la base de datos real desde los tests.
+    """
+    migrations.comprobar(engine)
+    services.workflows.registro.cargar()
+    services.comfy_pool.pool.iniciar()
+    services.jobs.manager.start(loop=asyncio.get_running_loop())
+    try:
+        services.image_generation.despachador.iniciar()
+    except OSError as e:
+        # Se reintentará al enviar el primer workflow
+        print(f"No se pudo vigilar la carpeta de salida de ComfyUI: {e}")
+    yield
+    services.jobs.manager.stop()
+    services.image_generation.despachador.detener()
+    services.comfy_pool.pool.cerrar()
+    services.executor.pool.cerrar()
+    await async_engine.dispose()
 
-models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="App ArtTerapia",
@@ -30,6 +63,7 @@ app = FastAPI(
         "name": "Diana Benito",
         "email": "dbenitre56@alumnes.ub.edu",
     },
+    lifespan=lifespan,
 )
 
 # Configuración de CORS
@@ -44,12 +78,14 @@ app.add_middleware(
 # Asegurar que la carpeta de imágenes existe
 images_path = os.path.abspath("../frontend/src/assets/images")
 os.makedirs(images_path, exist_ok=True)
-app.mount("/images", StaticFiles(directory=images_path), name="images")
+app.mount("/images", services.image_serving.ImagenesEstaticas(directory=images_path), name="images")
 
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(comfy.router, prefix="/comfy", tags=["comfy"])
 app.include_router(sessions.router, prefix="/sessions", tags=["sessions"])
 app.include_router(ws.router, tags=["websocket"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(images.router, tags=["images"])
 
 @app.get("/", tags=["root"])
 async def root():
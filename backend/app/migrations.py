@@ -0,0 +1,331 @@
+"""Migraciones versionadas del esquema de la base de datos.
+
+Cada ``Migracion`` tiene un número de versión y sabe subir (``subir``) y bajar
+(``bajar``) el esquema un paso. La tabla ``schema_migrations`` guarda las
+versiones aplicadas; la versión de la base de datos es la mayor de ellas.
+
+Al arrancar, la aplicación llama a ``comprobar``: si el esquema está al día no
+hace nada; si hay migraciones pendientes las aplica (``DB_AUTO_MIGRATE=true``)
+o se niega a arrancar e indica cómo aplicarlas con ``migrate.py``
+(``DB_AUTO_MIGRATE=false``, recomendado en producción). Una base de datos
+creada con ``create_all`` antes de existir las migraciones (tablas sin
+``schema_migrations``) se adopta como versión 1 y se sube desde ahí.
+
+Los índices se crean con ``Contexto.crear_indice``. En modo normal se crean en
+la misma transacción que el resto de la migración. En modo en línea
+(``migrate.py upgrade --online``) se crean después, cada uno por separado y sin
+transacción: en PostgreSQL con ``CREATE INDEX CONCURRENTLY`` (la tabla sigue
+aceptando escrituras) y en SQLite en una transacción corta por índice, de modo
+que la API solo espera a un índice cada vez y no a la migración entera. La
+versión se registra cuando todos los índices existen; si el proceso se corta,
+volver a lanzarlo continúa donde se quedó (``IF NOT EXISTS``).
+
+Con varios workers de uvicorn contra un mismo PostgreSQL, ``comprobar`` toma un
+bloqueo consultivo (``pg_advisory_lock``) mientras revisa y aplica las
+migraciones: el primer proceso migra y los demás esperan y encuentran el
+esquema al día.
+
+Attributes:
+    DB_AUTO_MIGRATE (bool): Aplicar las migraciones pendientes al arrancar.
+    MIGRACIONES (list[Migracion]): Migraciones en orden de versión.
+"""
+
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, inspect,
+                        text)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import func
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+TABLA_VERSIONES = "schema_migrations"
+CLAVE_BLOQUEO = 0x61727454  # identificador del bloqueo consultivo de PostgreSQL
+
+_versiones = Table(
+    TABLA_VERSIONES, MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Contexto:
+    """Lo que recibe una migración al aplicarse.
+
+    Attributes:
+        conexion (Connection): Conexión dentro de la transacción de la migración.
+        en_linea (bool): Si los índices se construyen fuera de la transacción.
+        indices (list[tuple]): Índices pendientes de crear en modo en línea.
+    """
+    conexion: Connection
+    en_linea: bool = False
+    indices: List[Tuple[str, str, Sequence[str]]] = field(default_factory=list)
+
+    def crear_indice(self, nombre: str, tabla: str, columnas: Sequence[str]):
+        """Crea un índice (o lo deja pendiente para construirlo en línea)."""
+        if self.en_linea:
+            self.indices.append((nombre, tabla, tuple(columnas)))
+        else:
+            self.conexion.exec_driver_sql(_sql_indice(self.conexion, nombre, tabla, columnas))
+
+    def borrar_indice(self, nombre: str):
+        self.conexion.exec_driver_sql(f"DROP INDEX IF EXISTS {self.conexion.dialect.identifier_preparer.quote(nombre)}")
+
+
+@dataclass(frozen=True)
+class Migracion:
+    """Un paso de versión del esquema.
+
+    Attributes:
+        version (int): Versión a la que lleva la migración.
+        nombre (str): Descripción corta.
+        subir (Callable[[Contexto], None]): Pasa de ``version - 1`` a ``version``.
+        bajar (Callable[[Contexto], None]): Deshace ``subir``.
+    """
+    version: int
+    nombre: str
+    subir: Callable[[Contexto], None]
+    bajar: Callable[[Contexto], None]
+
+
+def _sql_indice(conexion: Connection, nombre: str, tabla: str, columnas: Sequence[str], concurrente: bool = False) -> str:
+    quote = conexion.dialect.identifier_preparer.quote
+    concurrently = "CONCURRENTLY " if concurrente else ""
+    return (f"CREATE INDEX {concurrently}IF NOT EXISTS {quote(nombre)} "
+            f"ON {quote(tabla)} ({', '.join(quote(c) for c in columnas)})")
+
+
+# --- Versión 1: esquema inicial (users, sessions, images) ---
+
+def _tablas_iniciales() -> MetaData:
+    """Tablas tal como las creaba ``create_all`` antes de las migraciones."""
+    metadata = MetaData()
+    Table(
+        "users", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("email", String, unique=True, index=True, nullable=False),
+        Column("full_name", String, nullable=False),
+        Column("hashed_password", String, nullable=False),
+        Column("is_active", Boolean),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("type", String(50), nullable=False, server_default="user"),
+    )
+    Table(
+        "sessions", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("patient_id", Integer, ForeignKey("users.id"), nullable=False),
+        Column("therapist_id", Integer, ForeignKey("users.id"), nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("start_date", DateTime(timezone=True), nullable=False),
+        Column("end_date", DateTime(timezone=True), nullable=False),
+        Column("ended_at", DateTime(timezone=True), nullable=True),
+    )
+    Table(
+        "images", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("fileName", String, nullable=False),
+        Column("seed", Integer, nullable=True),
+        Column("owner_id", Integer, ForeignKey("users.id")),
+        Column("session_id", Integer, ForeignKey("sessions.id"), nullable=True),
+    )
+    return metadata
+
+
+def _subir_inicial(ctx: Contexto):
+    _tablas_iniciales().create_all(ctx.conexion)
+
+
+def _bajar_inicial(ctx: Contexto):
+    _tablas_iniciales().drop_all(ctx.conexion)
+
+
+# --- Versión 2: índices de las búsquedas de sesiones e imágenes ---
+
+_INDICES_BUSQUEDAS = (
+    ("ix_sessions_patient_open", "sessions", ("patient_id", "ended_at", "start_date")),
+    ("ix_sessions_therapist_open", "sessions", ("therapist_id", "ended_at", "start_date")),
+    ("ix_sessions_open_end", "sessions", ("ended_at", "end_date")),
+    ("ix_images_owner_session", "images", ("owner_id", "session_id")),
+    ("ix_images_owner_file", "images", ("owner_id", "fileName")),
+    ("ix_images_session", "images", ("session_id",)),
+)
+
+
+def _subir_indices_busquedas(ctx: Contexto):
+    for nombre, tabla, columnas in _INDICES_BUSQUEDAS:
+        ctx.crear_indice(nombre, tabla, columnas)
+
+
+def _bajar_indices_busquedas(ctx: Contexto):
+    for nombre, _, _ in _INDICES_BUSQUEDAS:
+        ctx.borrar_indice(nombre)
+
+
+# --- Versión 3: semillas de 64 bits ---
+
+def _tipo_seed(ctx: Contexto, tipo: str):
+    # En SQLite INTEGER ya es de 64 bits; PostgreSQL necesita BIGINT
+    if ctx.conexion.dialect.name == "sqlite":
+        return
+    ctx.conexion.exec_driver_sql(f"ALTER TABLE images ALTER COLUMN seed TYPE {tipo}")
+
+
+def _subir_seed_bigint(ctx: Contexto):
+    _tipo_seed(ctx, "BIGINT")
+
+
+def _bajar_seed_bigint(ctx: Contexto):
+    _tipo_seed(ctx, "INTEGER")
+
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, "esquema inicial", _subir_inicial, _bajar_inicial),
+    Migracion(2, "índices de sesiones e imágenes", _subir_indices_busquedas, _bajar_indices_busquedas),
+    Migracion(3, "semillas de 64 bits", _subir_seed_bigint, _bajar_seed_bigint),
+]
+
+
+def version_final() -> int:
+    """Versión a la que llevan todas las migraciones."""
+    return MIGRACIONES[-1].version if MIGRACIONES else 0
+
+
+def version_actual(engine: Engine) -> int:
+    """Versión del esquema de la base de datos (0 si está vacía).
+
+    Una base de datos con tablas pero sin ``schema_migrations`` se creó con
+    ``create_all`` antes de las migraciones y se registra como versión 1.
+    """
+    tablas = set(inspect(engine).get_table_names())
+    if TABLA_VERSIONES not in tablas:
+        if "users" not in tablas:
+            return 0
+        with engine.begin() as conexion:
+            _versiones.create(conexion)
+            _registrar(conexion, MIGRACIONES[0])
+        print("Base de datos existente registrada en la versión 1 del esquema")
+    with engine.connect() as conexion:
+        return conexion.execute(text(f"SELECT MAX(version) FROM {TABLA_VERSIONES}")).scalar() or 0
+
+
+def _registrar(conexion: Connection, migracion: Migracion):
+    conexion.execute(_versiones.insert().values(version=migracion.version, name=migracion.nombre, applied_at=datetime.utcnow()))
+
+
+def _construir_en_linea(engine: Engine, indices: List[Tuple[str, str, Sequence[str]]]):
+    """Construye cada índice por separado, sin una transacción que los englobe."""
+    concurrente = engine.dialect.name == "postgresql"
+    for nombre, tabla, columnas in indices:
+        print(f"Construyendo índice {nombre} en línea...")
+        if concurrente:
+            # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+                conexion.exec_driver_sql(_sql_indice(conexion, nombre, tabla, columnas, concurrente=True))
+        else:
+            with engine.begin() as conexion:
+                conexion.exec_driver_sql(_sql_indice(conexion, nombre, tabla, columnas))
+
+
+def actualizar(engine: Engine, hasta: Optional[int] = None, en_linea: bool = False) -> List[int]:
+    """Aplica las migraciones pendientes.
+
+    Args:
+        engine (Engine): Motor de la base de datos.
+        hasta (int | None): Versión final (por defecto la última).
+        en_linea (bool): Construir los índices sin bloquear la base de datos mientras dura la migración.
+
+    Returns:
+        list[int]: Versiones aplicadas.
+    """
+    hasta = version_final() if hasta is None else hasta
+    actual = version_actual(engine)
+    aplicadas = []
+    for migracion in MIGRACIONES:
+        if not actual < migracion.version <= hasta:
+            continue
+        print(f"Aplicando migración {migracion.version}: {migracion.nombre}")
+        with engine.begin() as conexion:
+            _versiones.create(conexion, checkfirst=True)
+            ctx = Contexto(conexion, en_linea=en_linea)
+            migracion.subir(ctx)
+            if not ctx.indices:
+                _registrar(conexion, migracion)
+        if ctx.indices:
+            _construir_en_linea(engine, ctx.indices)
+            with engine.begin() as conexion:
+                _registrar(conexion, migracion)
+        aplicadas.append(migracion.version)
+    return aplicadas
+
+
+def revertir(engine: Engine, hasta: int) -> List[int]:
+    """Deshace las migraciones posteriores a ``hasta``.
+
+    Args:
+        engine (Engine): Motor de la base de datos.
+        hasta (int): Versión a la que se quiere volver (0 = base de datos vacía).
+
+    Returns:
+        list[int]: Versiones deshechas, de la más reciente a la más antigua.
+    """
+    actual = version_actual(engine)
+    revertidas = []
+    for migracion in reversed(MIGRACIONES):
+        if not hasta < migracion.version <= actual:
+            continue
+        print(f"Deshaciendo migración {migracion.version}: {migracion.nombre}")
+        with engine.begin() as conexion:
+            migracion.bajar(Contexto(conexion))
+            conexion.execute(_versiones.delete().where(_versiones.c.version == migracion.version))
+        revertidas.append(migracion.version)
+    if hasta == 0 and revertidas:
+        with engine.begin() as conexion:
+            _versiones.drop(conexion, checkfirst=True)
+    return revertidas
+
+
+@contextmanager
+def bloqueo(engine: Engine):
+    """Serializa las migraciones entre procesos (solo PostgreSQL; en SQLite no hace nada)."""
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexion:
+        conexion.execute(text("SELECT pg_advisory_lock(:clave)"), {"clave": CLAVE_BLOQUEO})
+        try:
+            yield
+        finally:
+            conexion.execute(text("SELECT pg_advisory_unlock(:clave)"), {"clave": CLAVE_BLOQUEO})
+
+
+def comprobar(engine: Engine, auto: bool = DB_AUTO_MIGRATE):
+    """Comprueba al arrancar que el esquema está en la última versión.
+
+    Args:
+        engine (Engine): Motor de la base de datos.
+        auto (bool): Aplicar las migraciones pendientes en lugar de fallar.
+
+    Raises:
+        RuntimeError: Si hay migraciones pendientes y ``auto`` es False, o si la base de
+            datos tiene una versión más nueva que el código.
+    """
+    with bloqueo(engine):
+        actual, final = version_actual(engine), version_final()
+        if actual > final:
+            raise RuntimeError(f"La base de datos está en la versión {actual} del esquema y el código solo conoce hasta la {final}")
+        if actual == final:
+            return
+        if not auto:
+            raise RuntimeError(
+                f"La base de datos está en la versión {actual} del esquema y se necesita la {final}: "
+                "ejecuta `python migrate.py upgrade` (o `--online` para crear los índices sin bloquear la API)"
+            )
+        actualizar(engine)
@@ -9,13 +9,41 @@ Este módulo define todos los modelos de base de datos utilizando SQLAlchemy ORM
 
 Note:
     Se utiliza Single Table Inheritance (STI) para User/Patient/Therapist.
+    Los modelos no usan nada propio de un motor concreto: las fechas son
+    ``FechaUTC`` y los identificadores y semillas caben en los tipos enteros de
+    SQLite y de PostgreSQL.
 """
 
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text, DateTime
+from datetime import timezone
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, ForeignKey, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 from .database import Base
 
+
+class FechaUTC(TypeDecorator):
+    """Fecha y hora en UTC, sin zona horaria en Python, en cualquier base de datos.
+
+    La aplicación trabaja con fechas UTC sin zona (``datetime.utcnow()``) y el
+    frontend las interpreta como UTC. SQLite las devuelve tal cual, pero
+    PostgreSQL (``timestamp with time zone``) las devuelve con zona; este tipo
+    convierte a UTC y quita la zona al leer y al escribir, de modo que la API
+    devuelve lo mismo con los dos motores.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
 class User(Base):
     """Modelo base de usuario con herencia de tabla única (STI).
     
@@ -42,7 +70,7 @@ class User(Base):
     full_name = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(FechaUTC(), server_default=func.now())
 
     # discriminator column for single-table inheritance
     type = Column(String(50), nullable=False, server_default='user')
@@ -111,13 +139,20 @@ class Image(Base):
     
     Note:
         Las imágenes pueden existir sin estar asociadas a una sesión específica
-        (session_id puede ser NULL).
+        (session_id puede ser NULL). Los índices cubren las galerías del paciente
+        (owner_id, session_id), las imágenes de una sesión (session_id) y la
+        búsqueda por nombre al asociar una imagen a una sesión (owner_id, fileName).
     """
     __tablename__ = "images"
+    __table_args__ = (
+        Index("ix_images_owner_session", "owner_id", "session_id"),
+        Index("ix_images_owner_file", "owner_id", "fileName"),
+        Index("ix_images_session", "session_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     fileName = Column(String, nullable=False)
-    seed = Column(Integer, nullable=True)
+    seed = Column(BigInteger, nullable=True)  # 64-bit seeds (up to MAX_SQLITE_INT)
     owner_id = Column(Integer, ForeignKey("users.id"))
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
 
@@ -150,19 +185,26 @@ class Session(Base):
     
     Note:
         Una sesión se considera activa si ended_at es None. El terapeuta puede
-        finalizarla antes de end_date estableciendo ended_at.
+        finalizarla antes de end_date estableciendo ended_at. Las búsquedas de
+        sesiones activas y próximas filtran por participante, ended_at y fechas, y
+        la finalización automática por ended_at y end_date; cada una tiene su índice.
     """
     __tablename__ = "sessions"
-    
+    __table_args__ = (
+        Index("ix_sessions_patient_open", "patient_id", "ended_at", "start_date"),
+        Index("ix_sessions_therapist_open", "therapist_id", "ended_at", "start_date"),
+        Index("ix_sessions_open_end", "ended_at", "end_date"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     therapist_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(FechaUTC(), server_default=func.now())
     # Period during which the session is active
-    start_date = Column(DateTime(timezone=True), nullable=False)
-    end_date = Column(DateTime(timezone=True), nullable=False)
+    start_date = Column(FechaUTC(), nullable=False)
+    end_date = Column(FechaUTC(), nullable=False)
     # Real end timestamp set when the therapist finalizes the session
-    ended_at = Column(DateTime(timezone=True), nullable=True)
+    ended_at = Column(FechaUTC(), nullable=True)
 
     patient = relationship("Patient", foreign_keys=[patient_id])
     therapist = relationship("Therapist", foreign_keys=[therapist_id])
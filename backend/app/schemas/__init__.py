@@ -1,3 +1,4 @@
 from .user import *
 from .prompt import *
-from .session import *
\ No newline at end of file
+from .session import *
+from .job import *
\ No newline at end of file
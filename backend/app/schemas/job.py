@@ -0,0 +1,70 @@
+"""Schemas Pydantic para los trabajos de generación de imágenes.
+
+Define los modelos de datos para:
+- Estado de un trabajo (JobStatus)
+- Respuesta con el estado de un trabajo (GenerationJob)
+"""
+
+from enum import Enum
+from typing import List, Optional
+from datetime import datetime
+from pydantic import BaseModel
+from .prompt import ImageGenerationResponse, ImageOut
+
+
+class JobStatus(str, Enum):
+    """Estados posibles de un trabajo de generación.
+
+    Attributes:
+        queued: En cola, esperando un trabajador libre.
+        running: Un trabajador lo está ejecutando contra ComfyUI.
+        done: Terminado correctamente; la imagen ya está registrada.
+        failed: Terminado con error.
+        cancelled: Cancelado antes de terminar (por el paciente, el fin de la sesión o una desconexión).
+    """
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class GenerationJob(BaseModel):
+    """Schema de respuesta para un trabajo de generación.
+
+    Attributes:
+        id (str): Identificador único del trabajo.
+        kind (str): Tipo de generación ("txt2img", "sketch2img", "multimg").
+        status (JobStatus): Estado actual del trabajo.
+        user_id (int): ID del paciente propietario.
+        session_id (int, optional): ID de la sesión asociada.
+        priority (str): "session" (sesión de terapia activa) o "free" (práctica libre).
+        queue_position (int, optional): Posición estimada en la cola mientras está
+            en estado "queued" (1 = el siguiente en ejecutarse).
+        created_at (datetime): Momento en que se encoló.
+        started_at (datetime, optional): Momento en que empezó a ejecutarse.
+        finished_at (datetime, optional): Momento en que terminó.
+        result (ImageGenerationResponse, optional): Resultado de la generación.
+        image (ImageOut, optional): Registro de la imagen creada en base de datos.
+        results (list[ImageGenerationResponse]): Resultados de todas las imágenes
+            del trabajo (en lotes, ``result`` es el primero).
+        images (list[ImageOut]): Registros de todas las imágenes creadas.
+        error (str, optional): Detalle del error si el trabajo falló o se canceló.
+        status_code (int, optional): Código HTTP equivalente al error.
+    """
+    id: str
+    kind: str
+    status: JobStatus
+    user_id: int
+    session_id: Optional[int] = None
+    priority: str = "free"
+    queue_position: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[ImageGenerationResponse] = None
+    image: Optional[ImageOut] = None
+    results: List[ImageGenerationResponse] = []
+    images: List[ImageOut] = []
+    error: Optional[str] = None
+    status_code: Optional[int] = None
@@ -1,11 +1,35 @@
-from pydantic import BaseModel
-from typing import Optional
+import os
+from pydantic import BaseModel, Field, computed_field
+from typing import Annotated, Optional, List
+from urllib.parse import quote
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Ruta en la que la API sirve las versiones reducidas de las imágenes (services.derivatives)
+URL_DERIVADAS = "/derived"
+
+
+# Semillas válidas: enteros de 64 bits sin signo negativo (columna BIGINT y ComfyUI)
+MAX_SEED = 9223372036854775807
+# Imágenes como máximo por petición de generación (services.image_generation)
+GENERATION_MAX_BATCH = int(os.getenv("GENERATION_MAX_BATCH", "8"))
+
+Semilla = Annotated[int, Field(ge=0, le=MAX_SEED)]
+
+
+def url_derivada(file_name: str, size: str) -> str:
+    """URL de la versión reducida ``size`` ("thumb", "medium") de una imagen guardada."""
+    return f"{URL_DERIVADAS}/{size}/{quote(file_name)}"
 
 
 class Prompt(BaseModel):
     promptText: str
-    seed: Optional[int] = None
+    seed: Optional[Semilla] = None
     inputImage: Optional[str] = None
+    count: int = Field(1, ge=1)
+    seeds: Optional[List[Semilla]] = Field(None, max_length=GENERATION_MAX_BATCH)
+    seedStride: Optional[int] = None
 
 
 class ImageGenerationResponse(BaseModel):
@@ -13,6 +37,19 @@ class ImageGenerationResponse(BaseModel):
     file: str
     fullPath: str
     seed: Optional[int] = None
+    sha256: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @computed_field
+    @property
+    def thumbnailUrl(self) -> str:
+        return url_derivada(self.file, "thumb")
+
+    @computed_field
+    @property
+    def mediumUrl(self) -> str:
+        return url_derivada(self.file, "medium")
 
 
 class ImageGenerationError(BaseModel):
@@ -29,6 +66,16 @@ class ImageOut(BaseModel):
     seed: Optional[int] = None
     id: int
 
+    @computed_field
+    @property
+    def thumbnailUrl(self) -> str:
+        return url_derivada(self.fileName, "thumb")
+
+    @computed_field
+    @property
+    def mediumUrl(self) -> str:
+        return url_derivada(self.fileName, "medium")
+
 
 class ImagesOut(BaseModel):
     data: list[ImageOut]
@@ -43,4 +90,9 @@ class TemplateImagesIn(BaseModel):
 
 class SketchPrompt(BaseModel):
     sketchImage: str
-    sketchText: str
\ No newline at end of file
+    sketchText: str
+
+class ComfyStatus(BaseModel):
+    reachable: bool
+    running: int = 0
+    pending: int = 0
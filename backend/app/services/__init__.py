@@ -1 +1,12 @@
-from . import image_generation
\ No newline at end of file
+from . import cancellation
+from . import comfy_client
+from . import comfy_pool
+from . import derivatives
+from . import executor
+from . import image_generation
+from . import image_serving
+from . import jobs
+from . import progress
+from . import result_cache
+from . import translation
+from . import workflows
@@ -0,0 +1,128 @@
+"""Cancelación de generaciones en curso.
+
+Cada trabajo de generación tiene una ``Cancelacion``. Mientras el trabajador lo
+ejecuta, la cancelación queda activa en su hilo (``activa``) y las capas que
+esperan a ComfyUI registran en ella cómo deshacer lo que están haciendo: quitar
+el prompt de la cola de ComfyUI o interrumpirlo, liberar las esperas de archivos
+y cerrar el WebSocket de eventos. Al cancelar se ejecutan esas acciones al
+momento, de modo que el trabajador queda libre para el siguiente trabajo sin
+agotar el tiempo de espera.
+
+El código que no corre dentro de un trabajo (sin cancelación activa) funciona
+igual que antes: ``al_cancelar`` y ``comprobar`` no hacen nada.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from fastapi import HTTPException
+
+
+class GeneracionCancelada(HTTPException):
+    """La generación se canceló antes de terminar (409)."""
+
+    def __init__(self, motivo: str):
+        super().__init__(status_code=409, detail=f"Generación cancelada: {motivo}")
+
+
+class Cancelacion:
+    """Señal de cancelación de un trabajo con las acciones que la atienden.
+
+    Attributes:
+        motivo (str | None): Motivo de la cancelación, o None si no se ha cancelado.
+    """
+
+    def __init__(self):
+        self.motivo: Optional[str] = None
+        self._acciones: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelada(self) -> bool:
+        return self.motivo is not None
+
+    def cancelar(self, motivo: str) -> bool:
+        """Cancela y ejecuta las acciones registradas (en el hilo que cancela).
+
+        Args:
+            motivo (str): Motivo que se mostrará en el error del trabajo.
+
+        Returns:
+            bool: False si ya estaba cancelada.
+        """
+        with self._lock:
+            if self.motivo is not None:
+                return False
+            self.motivo = motivo
+            acciones, self._acciones = self._acciones, []
+        for accion in acciones:
+            _ejecutar(accion)
+        return True
+
+    def al_cancelar(self, accion: Callable[[], None]) -> Callable[[], None]:
+        """Registra una acción para cuando se cancele; si ya lo está, la ejecuta ya.
+
+        Args:
+            accion (Callable[[], None]): Acción sin argumentos.
+
+        Returns:
+            Callable[[], None]: Función que retira la acción (llamar al terminar).
+        """
+        with self._lock:
+            pendiente = self.motivo is None
+            if pendiente:
+                self._acciones.append(accion)
+        if not pendiente:
+            _ejecutar(accion)
+
+        def retirar():
+            with self._lock:
+                if accion in self._acciones:
+                    self._acciones.remove(accion)
+        return retirar
+
+    def comprobar(self):
+        """Lanza ``GeneracionCancelada`` si se ha cancelado."""
+        if self.motivo is not None:
+            raise GeneracionCancelada(self.motivo)
+
+
+def _ejecutar(accion: Callable[[], None]):
+    try:
+        accion()
+    except Exception as e:
+        print(f"Error al cancelar la generación: {e}")
+
+
+_hilo = threading.local()
+
+
+@contextmanager
+def activa(cancelacion: Cancelacion):
+    """Activa una cancelación en el hilo actual mientras dura el bloque."""
+    anterior = getattr(_hilo, "cancelacion", None)
+    _hilo.cancelacion = cancelacion
+    try:
+        yield cancelacion
+    finally:
+        _hilo.cancelacion = anterior
+
+
+def actual() -> Optional[Cancelacion]:
+    """Cancelación activa en el hilo actual, o None fuera de un trabajo."""
+    return getattr(_hilo, "cancelacion", None)
+
+
+def al_cancelar(accion: Callable[[], None]) -> Callable[[], None]:
+    """``Cancelacion.al_cancelar`` sobre la cancelación activa (sin efecto si no hay)."""
+    cancelacion = actual()
+    if cancelacion is None:
+        return lambda: None
+    return cancelacion.al_cancelar(accion)
+
+
+def comprobar():
+    """``Cancelacion.comprobar`` sobre la cancelación activa (sin efecto si no hay)."""
+    cancelacion = actual()
+    if cancelacion is not None:
+        cancelacion.comprobar()
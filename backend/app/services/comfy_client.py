@@ -0,0 +1,577 @@
+"""Cliente de la API HTTP/WebSocket de ComfyUI.
+
+Todas las peticiones HTTP a ComfyUI pasan por un único ``ComfyClient`` que vive
+lo mismo que la aplicación: mantiene un pool de conexiones keep-alive (httpx),
+separa el timeout de conexión del de lectura, limita las peticiones simultáneas
+y reintenta con espera exponencial los errores transitorios (5xx y fallos de
+conexión).
+
+El cliente usa un ``httpx.AsyncClient`` que corre en su propio event loop en un
+hilo de fondo, de modo que lo pueden usar tanto los trabajadores de generación
+(hilos síncronos, mediante ``ComfyClient.run``) como los endpoints asíncronos.
+
+Permite además saber cuándo termina un workflow sin vigilar la carpeta de salida
+de ComfyUI, de modo que el backend puede ejecutarse en una máquina distinta:
+
+1. ``POST /prompt`` devuelve el ``prompt_id`` del trabajo.
+2. Se escuchan los eventos de ``/ws?clientId=...`` hasta recibir el evento
+   ``executing`` con ``node = None`` para ese ``prompt_id`` (si el WebSocket no
+   está disponible se consulta ``/history/{prompt_id}`` periódicamente).
+3. Se leen las salidas en ``/history/{prompt_id}`` y se descargan con ``/view``.
+
+Los eventos de progreso y las vistas previas que llegan por el WebSocket se pasan
+al ``progress.Progreso`` del trabajo; en modo "filesystem" los escucha un
+``OyenteProgreso`` en un hilo aparte.
+
+Si el trabajo que ejecuta el workflow se cancela (ver ``cancellation``), el prompt
+se quita de la cola de ComfyUI o se interrumpe con ``/interrupt`` si ya se está
+ejecutando, y la espera termina en el acto.
+
+Attributes:
+    COMFYUI_BASE_URL (str): URL base de ComfyUI (variable de entorno COMFY_UI_URL).
+    COMFY_COMPLETION_MODE (str): "filesystem" (vigilar COMFY_OUTPUT_DIR) o "api" (este cliente).
+    COMFY_HISTORY_POLL_SECONDS (float): Intervalo de consulta de /history sin WebSocket.
+    COMFY_CONNECT_TIMEOUT (float): Segundos máximos para establecer una conexión.
+    COMFY_READ_TIMEOUT (float): Segundos máximos de espera de cada respuesta.
+    COMFY_MAX_CONNECTIONS (int): Tamaño del pool de conexiones keep-alive.
+    COMFY_MAX_IN_FLIGHT (int): Peticiones simultáneas máximas a ComfyUI.
+    COMFY_RETRIES (int): Reintentos ante errores transitorios.
+    COMFY_RETRY_BACKOFF (float): Espera base (segundos) entre reintentos; se duplica en cada uno.
+    client (ComfyClient): Cliente compartido de la aplicación.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional
+from urllib.parse import urlparse, urlunparse
+import httpx
+from fastapi import HTTPException
+from websockets.sync.client import connect as ws_connect
+from websockets.exceptions import WebSocketException
+from dotenv import load_dotenv
+from . import cancellation
+from . import progress
+from .ingestion import EscritorAtomico, ImagenIngerida, TAMANO_BLOQUE
+
+load_dotenv()
+
+COMFYUI_BASE_URL = os.getenv("COMFY_UI_URL", "http://localhost:8188")
+COMFY_COMPLETION_MODE = os.getenv("COMFY_COMPLETION_MODE", "filesystem").lower()
+COMFY_HISTORY_POLL_SECONDS = float(os.getenv("COMFY_HISTORY_POLL_SECONDS", "0.5"))
+COMFY_CONNECT_TIMEOUT = float(os.getenv("COMFY_CONNECT_TIMEOUT", "5"))
+COMFY_READ_TIMEOUT = float(os.getenv("COMFY_READ_TIMEOUT", "60"))
+COMFY_MAX_CONNECTIONS = int(os.getenv("COMFY_MAX_CONNECTIONS", "10"))
+COMFY_MAX_IN_FLIGHT = int(os.getenv("COMFY_MAX_IN_FLIGHT", "4"))
+COMFY_RETRIES = int(os.getenv("COMFY_RETRIES", "3"))
+COMFY_RETRY_BACKOFF = float(os.getenv("COMFY_RETRY_BACKOFF", "0.5"))
+
+# Respuestas de ComfyUI que indican un fallo transitorio
+ESTADOS_REINTENTABLES = {500, 502, 503, 504}
+
+
+class ComfyNoDisponible(HTTPException):
+    """ComfyUI no aceptó el workflow porque no responde o está fallando (5xx).
+
+    Se garantiza que el workflow no llegó a encolarse, así que puede enviarse a
+    otra instancia sin riesgo de generarlo dos veces.
+    """
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=503, detail=detail)
+
+
+class ComfyClient:
+    """Cliente HTTP asíncrono y compartido para una instancia de ComfyUI.
+
+    Args:
+        base_url (str): URL base de ComfyUI (p. ej. http://localhost:8188).
+        connect_timeout (float): Timeout de conexión en segundos.
+        read_timeout (float): Timeout de lectura en segundos.
+        max_connections (int): Conexiones máximas del pool.
+        max_in_flight (int): Peticiones simultáneas máximas.
+        retries (int): Reintentos ante errores transitorios.
+        backoff (float): Espera base entre reintentos en segundos.
+    """
+
+    def __init__(
+        self,
+        base_url: str = COMFYUI_BASE_URL,
+        connect_timeout: float = COMFY_CONNECT_TIMEOUT,
+        read_timeout: float = COMFY_READ_TIMEOUT,
+        max_connections: int = COMFY_MAX_CONNECTIONS,
+        max_in_flight: int = COMFY_MAX_IN_FLIGHT,
+        retries: int = COMFY_RETRIES,
+        backoff: float = COMFY_RETRY_BACKOFF,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def iniciar(self):
+        """Arranca el event loop del cliente y abre el pool de conexiones.
+
+        Se llama en el startup de la aplicación o, como muy tarde, en la primera petición.
+        """
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="comfy-http", daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(self._abrir(), loop).result()
+            self._loop, self._thread = loop, thread
+
+    async def _abrir(self):
+        self._http = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    def cerrar(self):
+        """Cierra las conexiones abiertas y detiene el event loop del cliente."""
+        with self._lock:
+            loop, thread, self._loop, self._thread = self._loop, self._thread, None, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._http.aclose(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Ejecuta una corrutina del cliente desde código síncrono.
+
+        Args:
+            coro (Awaitable): Corrutina de este cliente (p. ej. ``client.post_prompt(...)``).
+            timeout (float, optional): Segundos máximos de espera.
+
+        Returns:
+            Any: Resultado de la corrutina.
+        """
+        self.iniciar()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def _ejecutar(self, corrutina):
+        """Ejecuta una llamada en el loop del cliente aunque se espere desde otro loop."""
+        self.iniciar()
+        running = asyncio.get_running_loop()
+        if running is self._loop:
+            return await corrutina
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(corrutina, self._loop))
+
+    async def request(self, method: str, path: str, idempotent: bool = True, retries: Optional[int] = None, **kwargs) -> httpx.Response:
+        """Realiza una petición con reintentos y espera exponencial.
+
+        Se reintentan las respuestas 5xx y los fallos de conexión. Los errores de
+        lectura solo se reintentan en peticiones idempotentes, para no encolar dos
+        veces el mismo workflow.
+
+        Args:
+            method (str): Método HTTP.
+            path (str): Ruta relativa a ``base_url``.
+            idempotent (bool): Si la petición puede repetirse sin efectos secundarios.
+            retries (int, optional): Reintentos para esta petición (por defecto ``self.retries``).
+            **kwargs: Argumentos de ``httpx.AsyncClient.request``.
+
+        Returns:
+            httpx.Response: Respuesta con código 2xx.
+
+        Raises:
+            httpx.HTTPError: Si la petición falla tras agotar los reintentos.
+        """
+        retries = self.retries if retries is None else retries
+        return await self._ejecutar(self._request(method, path, idempotent, retries, **kwargs))
+
+    async def _request(self, method: str, path: str, idempotent: bool, retries: int, **kwargs) -> httpx.Response:
+        intento = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    response = await self._http.request(method, path, **kwargs)
+                if response.status_code not in ESTADOS_REINTENTABLES or intento >= retries:
+                    response.raise_for_status()
+                    return response
+                print(f"ComfyUI respondió {response.status_code} a {method} {path}, reintentando")
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                if intento >= retries:
+                    raise
+                print(f"No se pudo conectar con ComfyUI ({e}), reintentando")
+            except httpx.TransportError as e:
+                if not idempotent or intento >= retries:
+                    raise
+                print(f"Error de red con ComfyUI ({e}), reintentando")
+            await asyncio.sleep(self.backoff * (2 ** intento))
+            intento += 1
+
+    async def post_prompt(self, workflow: dict, client_id: Optional[str] = None) -> str:
+        """Encola un workflow en ComfyUI.
+
+        Args:
+            workflow (dict): Workflow en formato API.
+            client_id (str, optional): Cliente WebSocket que recibirá los eventos.
+
+        Returns:
+            str: ``prompt_id`` asignado por ComfyUI.
+
+        Raises:
+            ComfyNoDisponible: 503 si no se pudo conectar o ComfyUI respondió 5xx.
+            HTTPException: 503 si ComfyUI rechaza el workflow o la respuesta no es válida.
+        """
+        payload = {"prompt": workflow}
+        if client_id:
+            payload["client_id"] = client_id
+        try:
+            response = await self.request("POST", "/prompt", idempotent=False, json=payload)
+            return response.json()["prompt_id"]
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise ComfyNoDisponible(f"No se pudo conectar con ComfyUI en {self.base_url}: {str(e)}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in ESTADOS_REINTENTABLES:
+                raise ComfyNoDisponible(f"ComfyUI en {self.base_url} no está disponible: {str(e)}")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Error al comunicarse con ComfyUI: {str(e)}"
+            )
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Error al comunicarse con ComfyUI: {str(e)}"
+            )
+
+    async def history(self, prompt_id: str) -> Optional[dict]:
+        """Consulta el historial de un prompt.
+
+        Args:
+            prompt_id (str): ID devuelto por ``/prompt``.
+
+        Returns:
+            dict | None: Entrada del historial o None si el prompt aún no ha terminado.
+        """
+        response = await self.request("GET", f"/history/{prompt_id}")
+        return response.json().get(prompt_id)
+
+    async def queue(self, retries: Optional[int] = None) -> dict:
+        """Consulta la cola de ComfyUI.
+
+        Args:
+            retries (int, optional): Reintentos (por defecto los del cliente).
+
+        Returns:
+            dict: Respuesta de ``/queue`` con las listas ``queue_running`` y ``queue_pending``.
+        """
+        response = await self.request("GET", "/queue", retries=retries)
+        return response.json()
+
+    async def cancelar_prompt(self, prompt_id: str):
+        """Quita un prompt de la cola de ComfyUI o lo interrumpe si ya se está ejecutando.
+
+        Primero se borra de la cola pendiente (no hace nada si ya no está) y
+        después, si aparece en ejecución, se interrumpe solo ese prompt.
+
+        Args:
+            prompt_id (str): ID devuelto por ``/prompt``.
+
+        Raises:
+            httpx.HTTPError: Si ComfyUI no responde.
+        """
+        await self.request("POST", "/queue", retries=0, json={"delete": [prompt_id]})
+        cola = await self.queue(retries=0)
+        if any(len(item) > 1 and item[1] == prompt_id for item in cola.get("queue_running", [])):
+            await self.request("POST", "/interrupt", retries=0, json={"prompt_id": prompt_id})
+
+    async def download(self, image: dict, carpeta_destino: Path) -> ImagenIngerida:
+        """Descarga una imagen de salida con ``/view`` a la carpeta destino.
+
+        El hash y las dimensiones se calculan mientras se descarga, y la imagen
+        se escribe en un temporal que se renombra al terminar.
+
+        Args:
+            image (dict): Descriptor de imagen del historial.
+            carpeta_destino (Path): Carpeta donde guardar la imagen.
+
+        Returns:
+            ImagenIngerida: Imagen descargada.
+        """
+        return await self._ejecutar(self._download(image, carpeta_destino))
+
+    async def _download(self, image: dict, carpeta_destino: Path) -> ImagenIngerida:
+        params = {"filename": image["filename"], "subfolder": image.get("subfolder", ""), "type": image.get("type", "output")}
+
+        async with self._semaphore:
+            async with self._http.stream("GET", "/view", params=params) as response:
+                response.raise_for_status()
+                with EscritorAtomico(Path(carpeta_destino) / image["filename"]) as escritor:
+                    async for chunk in response.aiter_bytes(TAMANO_BLOQUE):
+                        escritor.write(chunk)
+                    imagen = escritor.cerrar()
+        print(f"Imagen descargada a: {imagen.ruta}")
+        return imagen
+
+
+client = ComfyClient()
+
+
+def get_client() -> ComfyClient:
+    """Devuelve el cliente de ComfyUI compartido por la aplicación.
+
+    Returns:
+        ComfyClient: Cliente global (sustituible en tests).
+    """
+    return client
+
+
+def cancelar_al_cancelar(comfy: ComfyClient, prompt_id: str, liberar: Optional[Callable[[], None]] = None) -> Callable[[], None]:
+    """Registra en la cancelación activa la retirada de un prompt ya encolado.
+
+    Args:
+        comfy (ComfyClient): Cliente de la instancia donde se encoló.
+        prompt_id (str): ID devuelto por ``/prompt``.
+        liberar (Callable, optional): Acción que despierta al hilo que espera el resultado.
+
+    Returns:
+        Callable[[], None]: Función que retira el registro (llamar al terminar la espera).
+    """
+    def cancelar():
+        if liberar is not None:
+            liberar()
+        try:
+            comfy.run(comfy.cancelar_prompt(prompt_id), timeout=comfy.timeout.read)
+            print(f"Prompt {prompt_id} cancelado en ComfyUI")
+        except Exception as e:
+            print(f"No se pudo cancelar el prompt {prompt_id} en ComfyUI: {e}")
+
+    return cancellation.al_cancelar(cancelar)
+
+
+def _ws_url(base_url: str, client_id: str) -> str:
+    """Construye la URL del WebSocket de ComfyUI a partir de su URL HTTP."""
+    parts = urlparse(base_url)
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    path = parts.path.rstrip("/") + "/ws"
+    return urlunparse((scheme, parts.netloc, path, "", f"clientId={client_id}", ""))
+
+
+def _esperar_por_websocket(ws, prompt_id: str, deadline: float, progreso: Optional[progress.Progreso] = None) -> bool:
+    """Espera el fin del prompt escuchando los eventos del WebSocket.
+
+    Los eventos de progreso y los frames binarios de vista previa se pasan a ``progreso``.
+
+    Returns:
+        bool: True si el prompt terminó, False si se agotó el tiempo.
+
+    Raises:
+        HTTPException: 500 si ComfyUI informa de un error de ejecución.
+    """
+    while time.time() < deadline:
+        try:
+            message = ws.recv(timeout=max(0.0, deadline - time.time()))
+        except TimeoutError:
+            return False
+        event = progress.atender_mensaje(progreso, message, prompt_id)
+        if event is None:
+            # Frames binarios de previsualización
+            continue
+        data = event.get("data", {})
+        if data.get("prompt_id") != prompt_id:
+            continue
+        if event.get("type") == "execution_error":
+            raise HTTPException(
+                status_code=500,
+                detail=f"ComfyUI no pudo ejecutar el workflow: {data.get('exception_message', 'error desconocido')}"
+            )
+        if event.get("type") == "executing" and data.get("node") is None:
+            return True
+        if event.get("type") == "execution_success":
+            return True
+    return False
+
+
+class OyenteProgreso:
+    """Escucha en un hilo aparte los eventos de progreso de un prompt.
+
+    Se usa en modo "filesystem", donde el fin del workflow lo detecta el
+    vigilante de archivos: abre el WebSocket antes de encolar (``client_id`` se
+    pasa a ``post_prompt``) y, con ``seguir``, reenvía al progreso los eventos
+    del prompt hasta que termina o se llama a ``cerrar``.
+
+    Args:
+        comfy (ComfyClient): Cliente de la instancia.
+        progreso (Progreso): Destino de los eventos.
+
+    Raises:
+        OSError, WebSocketException, TimeoutError: Si no se puede abrir el WebSocket.
+    """
+
+    def __init__(self, comfy: ComfyClient, progreso: progress.Progreso):
+        self.client_id = uuid.uuid4().hex
+        self.progreso = progreso
+        # La conexión vive entre ``__init__`` y ``cerrar``: se entra en su contexto con una pila
+        self._pila = ExitStack()
+        self._ws = self._pila.enter_context(
+            ws_connect(_ws_url(comfy.base_url, self.client_id), open_timeout=comfy.timeout.connect, max_size=None)
+        )
+        self._hilo: Optional[threading.Thread] = None
+
+    @classmethod
+    def abrir(cls, comfy: ComfyClient) -> Optional["OyenteProgreso"]:
+        """Crea un oyente para el progreso activo; None si no hay o no hay WebSocket."""
+        progreso = progress.actual()
+        if progreso is None:
+            return None
+        try:
+            return cls(comfy, progreso)
+        except (OSError, WebSocketException, TimeoutError) as e:
+            print(f"WebSocket de ComfyUI no disponible, no se enviará el progreso: {e}")
+            return None
+
+    def seguir(self, prompt_id: str):
+        """Empieza a reenviar los eventos de ``prompt_id``."""
+        def escuchar():
+            try:
+                # Termina con el prompt o al cerrar el WebSocket
+                _esperar_por_websocket(self._ws, prompt_id, time.time() + 24 * 3600, progreso=self.progreso)
+            except (OSError, WebSocketException, HTTPException, ValueError):
+                pass
+
+        self._hilo = threading.Thread(target=escuchar, name="comfy-progress", daemon=True)
+        self._hilo.start()
+
+    def cerrar(self):
+        """Cierra el WebSocket y espera al hilo."""
+        self._pila.close()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+
+
+def _esperar_por_historial(comfy: ComfyClient, prompt_id: str, deadline: float) -> Optional[dict]:
+    """Consulta ``/history/{prompt_id}`` hasta que aparezca la entrada del prompt."""
+    while time.time() < deadline:
+        cancellation.comprobar()
+        try:
+            entry = comfy.run(comfy.history(prompt_id))
+        except httpx.HTTPError as e:
+            print(f"Error consultando el historial de ComfyUI: {e}")
+            entry = None
+        if entry is not None:
+            return entry
+        time.sleep(COMFY_HISTORY_POLL_SECONDS)
+    return None
+
+
+def imagenes_de_salida(entry: dict) -> List[dict]:
+    """Extrae las imágenes de salida (nodos SaveImage) de una entrada del historial.
+
+    Args:
+        entry (dict): Entrada de ``/history/{prompt_id}``.
+
+    Returns:
+        list[dict]: Descriptores ``{"filename", "subfolder", "type"}`` de tipo "output".
+
+    Raises:
+        HTTPException: 500 si el historial indica que la ejecución falló.
+    """
+    status = entry.get("status") or {}
+    if status.get("status_str") == "error":
+        raise HTTPException(status_code=500, detail="ComfyUI no pudo ejecutar el workflow")
+
+    images = []
+    for output in entry.get("outputs", {}).values():
+        for image in output.get("images", []):
+            if image.get("type", "output") == "output":
+                images.append(image)
+    return images
+
+
+def ejecutar_workflow_lote(workflow: dict, carpeta_destino: Path, timeout: int = 500, comfy: Optional[ComfyClient] = None) -> Optional[List[ImagenIngerida]]:
+    """Ejecuta un workflow y descarga todas sus imágenes de salida.
+
+    Args:
+        workflow (dict): Workflow en formato API ya parametrizado.
+        carpeta_destino (Path): Carpeta donde guardar las imágenes generadas.
+        timeout (int): Tiempo máximo de espera en segundos.
+        comfy (ComfyClient, optional): Cliente a usar; por defecto el compartido.
+
+    Returns:
+        list[ImagenIngerida] | None: Imágenes descargadas o None si se agota el tiempo.
+
+    Raises:
+        HTTPException: 503 si falla la comunicación con ComfyUI, 500 si falla la ejecución.
+        GeneracionCancelada: 409 si se cancela el trabajo mientras espera.
+    """
+    comfy = comfy or get_client()
+    cancellation.comprobar()
+    client_id = uuid.uuid4().hex
+    deadline = time.time() + timeout
+
+    with ExitStack() as pila:
+        # Abrir el WebSocket antes de encolar para no perder eventos
+        ws = None
+        try:
+            ws = pila.enter_context(
+                ws_connect(_ws_url(comfy.base_url, client_id), open_timeout=comfy.timeout.connect, max_size=None)
+            )
+        except (OSError, WebSocketException, TimeoutError) as e:
+            print(f"WebSocket de ComfyUI no disponible, se consultará /history: {e}")
+
+        prompt_id = comfy.run(comfy.post_prompt(workflow, client_id))
+        print(f"Workflow encolado en ComfyUI con prompt_id {prompt_id}")
+
+        # Cerrar el WebSocket despierta a ``_esperar_por_websocket``
+        retirar = cancelar_al_cancelar(comfy, prompt_id, liberar=ws.close if ws is not None else None)
+        try:
+            if ws is not None:
+                try:
+                    _esperar_por_websocket(ws, prompt_id, deadline, progreso=progress.actual())
+                except (OSError, WebSocketException) as e:
+                    cancellation.comprobar()
+                    print(f"WebSocket de ComfyUI cerrado, se consultará /history: {e}")
+            # Tras el evento de fin la entrada ya está en el historial
+            entry = _esperar_por_historial(comfy, prompt_id, deadline)
+        finally:
+            retirar()
+
+    if entry is None:
+        print("Tiempo de espera agotado.")
+        return None
+
+    images = imagenes_de_salida(entry)
+    if not images:
+        raise HTTPException(status_code=500, detail="ComfyUI no devolvió ninguna imagen")
+    try:
+        return [comfy.run(comfy.download(image, carpeta_destino)) for image in images]
+    except (httpx.HTTPError, OSError) as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Error al descargar la imagen de ComfyUI: {str(e)}"
+        )
+
+
+def ejecutar_workflow(workflow: dict, carpeta_destino: Path, timeout: int = 500, comfy: Optional[ComfyClient] = None) -> Optional[ImagenIngerida]:
+    """Ejecuta un workflow y descarga su primera imagen de salida.
+
+    Args:
+        workflow (dict): Workflow en formato API ya parametrizado.
+        carpeta_destino (Path): Carpeta donde guardar la imagen generada.
+        timeout (int): Tiempo máximo de espera en segundos.
+        comfy (ComfyClient, optional): Cliente a usar; por defecto el compartido.
+
+    Returns:
+        ImagenIngerida | None: Imagen descargada o None si se agota el tiempo.
+
+    Raises:
+        HTTPException: 503 si falla la comunicación con ComfyUI, 500 si falla la ejecución.
+    """
+    imagenes = ejecutar_workflow_lote(workflow, carpeta_destino, timeout=timeout, comfy=comfy)
+    return imagenes[0] if imagenes else None
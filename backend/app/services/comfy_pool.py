@@ -0,0 +1,301 @@
+"""Reparto de generaciones entre varias instancias de ComfyUI.
+
+Con ``COMFY_UI_URLS`` (URLs separadas por comas) el backend puede repartir los
+workflows entre varias máquinas con GPU. Cada instancia (``NodoComfy``) tiene su
+propio ``ComfyClient``: el workflow se encola, se espera y sus salidas se
+descargan siempre en la misma instancia.
+
+Cada trabajo se envía a la instancia sana con menos trabajo pendiente (workflows
+que este backend le ha enviado y aún no han terminado). Si otra instancia con
+como mucho ``COMFY_MODEL_AFFINITY_SLACK`` trabajos más ya tiene cargado el
+checkpoint que pide el workflow, se prefiere esa. ComfyUI mantiene en memoria
+el último modelo usado, así que cambiar de checkpoint cuesta una recarga. El
+checkpoint cargado se deduce del último workflow que terminó en cada instancia.
+
+Las instancias que no aceptan un workflow (fallo de conexión o 5xx) salen de la
+rotación y el workflow se reenvía a otra. Un hilo comprueba ``/queue`` de cada
+instancia cada ``COMFY_HEALTH_INTERVAL`` segundos y las vuelve a incluir cuando
+responden. Si no queda ninguna sana se prueban igualmente las que no se han
+intentado todavía.
+
+En modo "filesystem" todas las instancias deben escribir en la carpeta
+``COMFY_OUTPUT_DIR`` que vigila el backend (p. ej. un volumen compartido); en
+modo "api" las salidas se descargan de cada instancia.
+
+Attributes:
+    COMFY_UI_URLS (list[str]): URLs de las instancias de ComfyUI (por defecto COMFY_UI_URL).
+    COMFY_HEALTH_INTERVAL (float): Segundos entre comprobaciones de salud (0 = sin comprobaciones).
+    COMFY_MODEL_AFFINITY_SLACK (int): Trabajos de más que se aceptan por reutilizar el modelo cargado.
+    pool (ComfyPool): Instancias de ComfyUI de la aplicación.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from . import comfy_client
+from .comfy_client import ComfyClient, ComfyNoDisponible
+from .ingestion import ImagenIngerida
+
+load_dotenv()
+
+COMFY_UI_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("COMFY_UI_URLS", comfy_client.COMFYUI_BASE_URL).split(",")
+    if url.strip()
+]
+COMFY_HEALTH_INTERVAL = float(os.getenv("COMFY_HEALTH_INTERVAL", "15"))
+COMFY_MODEL_AFFINITY_SLACK = int(os.getenv("COMFY_MODEL_AFFINITY_SLACK", "1"))
+
+
+def modelo_requerido(workflow: dict) -> Optional[str]:
+    """Checkpoint que carga un workflow.
+
+    Args:
+        workflow (dict): Workflow en formato API.
+
+    Returns:
+        str | None: Valor de ``ckpt_name`` del primer nodo que lo tenga.
+    """
+    for nodo in workflow.values():
+        modelo = nodo.get("inputs", {}).get("ckpt_name")
+        if isinstance(modelo, str):
+            return modelo
+    return None
+
+
+class NodoComfy:
+    """Estado de una instancia de ComfyUI.
+
+    Args:
+        client (ComfyClient): Cliente de la instancia.
+
+    Attributes:
+        sano (bool): Si está en la rotación.
+        pendientes (int): Workflows enviados por este backend que aún no han terminado.
+        modelo (str | None): Último checkpoint usado con éxito.
+        cola_remota (int): Trabajos en la cola de ComfyUI en la última comprobación.
+        enviados (int): Workflows completados.
+        fallos (int): Veces que se sacó de la rotación.
+        ultimo_error (str | None): Motivo del último fallo.
+    """
+
+    def __init__(self, client: ComfyClient):
+        self.client = client
+        self.sano = True
+        self.pendientes = 0
+        self.modelo: Optional[str] = None
+        self.cola_remota = 0
+        self.enviados = 0
+        self.fallos = 0
+        self.ultimo_error: Optional[str] = None
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+
+class ComfyPool:
+    """Conjunto de instancias de ComfyUI con reparto por carga y afinidad de modelo.
+
+    Args:
+        clientes (list[ComfyClient]): Un cliente por instancia.
+        health_interval (float): Segundos entre comprobaciones de salud (0 = ninguna).
+        afinidad (int): Trabajos de más aceptados para reutilizar el modelo cargado.
+    """
+
+    def __init__(self, clientes: List[ComfyClient], health_interval: float = COMFY_HEALTH_INTERVAL,
+                 afinidad: int = COMFY_MODEL_AFFINITY_SLACK):
+        if not clientes:
+            raise ValueError("Se necesita al menos una instancia de ComfyUI")
+        self.nodos = [NodoComfy(c) for c in clientes]
+        self.health_interval = health_interval
+        self.afinidad = max(0, afinidad)
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        """Abre los clientes y arranca las comprobaciones de salud."""
+        for nodo in self.nodos:
+            nodo.client.iniciar()
+        with self._lock:
+            if self._hilo is not None or self.health_interval <= 0:
+                return
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._vigilar, name="comfy-health", daemon=True)
+            self._hilo.start()
+
+    def cerrar(self):
+        """Detiene las comprobaciones de salud y cierra los clientes."""
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        self._parar.set()
+        if hilo is not None:
+            hilo.join(timeout=5)
+        for nodo in self.nodos:
+            nodo.client.cerrar()
+
+    def _vigilar(self):
+        while not self._parar.wait(self.health_interval):
+            self.comprobar()
+
+    def comprobar(self):
+        """Consulta ``/queue`` de cada instancia y actualiza si está en la rotación."""
+        for nodo in self.nodos:
+            try:
+                cola = nodo.client.run(nodo.client.queue(retries=0), timeout=nodo.client.timeout.read)
+                error = None
+            except Exception as e:
+                cola, error = None, str(e) or type(e).__name__
+            with self._lock:
+                if error is None:
+                    if not nodo.sano:
+                        print(f"ComfyUI en {nodo.url} vuelve a estar disponible")
+                    nodo.sano = True
+                    nodo.cola_remota = len(cola.get("queue_running", [])) + len(cola.get("queue_pending", []))
+                elif nodo.sano:
+                    self._retirar(nodo, error)
+
+    def _retirar(self, nodo: NodoComfy, motivo: str):
+        """Saca una instancia de la rotación (con ``_lock`` adquirido)."""
+        print(f"ComfyUI en {nodo.url} fuera de servicio: {motivo}")
+        nodo.sano = False
+        nodo.fallos += 1
+        nodo.ultimo_error = motivo
+
+    def elegir(self, workflow: dict, excluir: Iterable[NodoComfy] = ()) -> NodoComfy:
+        """Elige la instancia para un workflow y le suma un trabajo pendiente.
+
+        Args:
+            workflow (dict): Workflow a enviar.
+            excluir (Iterable[NodoComfy]): Instancias ya intentadas.
+
+        Returns:
+            NodoComfy: Instancia elegida (hay que llamar a ``liberar`` al terminar).
+
+        Raises:
+            HTTPException: 503 si no queda ninguna instancia por intentar.
+        """
+        modelo = modelo_requerido(workflow)
+        with self._lock:
+            candidatos = [n for n in self.nodos if n not in excluir]
+            if not candidatos:
+                raise HTTPException(status_code=503, detail="Ningún servidor de ComfyUI está disponible")
+            sanos = [n for n in candidatos if n.sano] or candidatos
+            minimo = min(n.pendientes for n in sanos)
+            afines = [
+                n for n in sanos
+                if modelo is not None and n.modelo == modelo and n.pendientes <= minimo + self.afinidad
+            ]
+            nodo = min(afines or sanos, key=lambda n: n.pendientes)
+            nodo.pendientes += 1
+            return nodo
+
+    def liberar(self, nodo: NodoComfy, completado: bool = False, modelo: Optional[str] = None, error: Optional[str] = None):
+        """Resta el trabajo pendiente de una instancia y registra el resultado.
+
+        Args:
+            nodo (NodoComfy): Instancia devuelta por ``elegir``.
+            completado (bool): Si el workflow se ejecutó en la instancia.
+            modelo (str, optional): Checkpoint que usó el workflow completado.
+            error (str, optional): Motivo si la instancia no aceptó el workflow.
+        """
+        with self._lock:
+            nodo.pendientes -= 1
+            if error is not None:
+                self._retirar(nodo, error)
+            elif completado:
+                nodo.enviados += 1
+                if modelo is not None:
+                    nodo.modelo = modelo
+
+    def ejecutar(self, workflow: dict, funcion: Callable[[ComfyClient], Any]) -> Any:
+        """Ejecuta un workflow en la mejor instancia, pasando a otra si no lo acepta.
+
+        Args:
+            workflow (dict): Workflow a ejecutar (para elegir instancia).
+            funcion (Callable[[ComfyClient], Any]): Envía el workflow con el cliente
+                recibido y espera su resultado.
+
+        Returns:
+            Any: Resultado de ``funcion``.
+
+        Raises:
+            HTTPException: 503 si ninguna instancia acepta el workflow; cualquier
+            otro error de ``funcion`` se propaga sin reintentar.
+        """
+        intentados: List[NodoComfy] = []
+        ultimo: Optional[ComfyNoDisponible] = None
+        while True:
+            try:
+                nodo = self.elegir(workflow, excluir=intentados)
+            except HTTPException:
+                if ultimo is not None:
+                    raise ultimo
+                raise
+            intentados.append(nodo)
+            try:
+                resultado = funcion(nodo.client)
+            except ComfyNoDisponible as e:
+                self.liberar(nodo, error=str(e.detail))
+                ultimo = e
+                continue
+            except BaseException:
+                self.liberar(nodo)
+                raise
+            self.liberar(nodo, completado=True, modelo=modelo_requerido(workflow))
+            return resultado
+
+    def metricas(self) -> List[dict]:
+        """Estado de cada instancia.
+
+        Returns:
+            list[dict]: URL, si está sana, trabajos pendientes, cola remota, modelo
+            cargado, workflows completados, fallos y último error.
+        """
+        with self._lock:
+            return [
+                {
+                    "url": n.url,
+                    "healthy": n.sano,
+                    "outstanding": n.pendientes,
+                    "remote_queue": n.cola_remota,
+                    "model": n.modelo,
+                    "completed": n.enviados,
+                    "failures": n.fallos,
+                    "last_error": n.ultimo_error,
+                }
+                for n in self.nodos
+            ]
+
+
+def _crear_pool(urls: List[str]) -> ComfyPool:
+    """Crea el pool reutilizando el cliente compartido para su misma URL."""
+    clientes = [
+        comfy_client.client if url == comfy_client.client.base_url else ComfyClient(url)
+        for url in urls
+    ]
+    return ComfyPool(clientes)
+
+
+pool = _crear_pool(COMFY_UI_URLS)
+
+
+def ejecutar_workflow_lote(workflow: dict, carpeta_destino: Path, timeout: int = 500) -> Optional[List[ImagenIngerida]]:
+    """Ejecuta un workflow en alguna instancia y descarga sus imágenes de ella.
+
+    Args:
+        workflow (dict): Workflow en formato API ya parametrizado.
+        carpeta_destino (Path): Carpeta donde guardar las imágenes generadas.
+        timeout (int): Tiempo máximo de espera en segundos.
+
+    Returns:
+        list[ImagenIngerida] | None: Imágenes descargadas o None si se agota el tiempo.
+    """
+    return pool.ejecutar(
+        workflow,
+        lambda comfy: comfy_client.ejecutar_workflow_lote(workflow, carpeta_destino, timeout=timeout, comfy=comfy),
+    )
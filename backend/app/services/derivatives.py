@@ -0,0 +1,274 @@
+"""Miniaturas y tamaños intermedios de las imágenes guardadas.
+
+Las galerías no necesitan el PNG original (varios MB) para mostrar una
+cuadrícula de imágenes. Cada imagen generada, subida o dibujada se reduce en
+segundo plano a los tamaños de ``IMAGE_DERIVATIVE_SIZES`` y se recodifica en
+WebP o AVIF. Las versiones reducidas se guardan aparte de los originales, en
+``{CARPETA_DERIVADAS}/{tamaño}/{carpeta}/{nombre}.{formato}``, y se sirven en
+``/derived/{tamaño}/{archivo original}``; si una versión aún no existe (imagen
+anterior a este servicio o todavía en cola) se genera al pedirla.
+
+Las imágenes que ya existían se procesan con ``backfill_derivatives.py`` (``rellenar``).
+
+Attributes:
+    IMAGE_DERIVATIVE_SIZES (dict[str, int]): Lado máximo en píxeles de cada tamaño derivado.
+    IMAGE_DERIVATIVE_FORMAT (str): "avif", "webp" o "jpeg" (se usa el primero que soporte Pillow).
+    IMAGE_DERIVATIVE_QUALITY (int): Calidad de compresión (1-100).
+    IMAGE_DERIVATIVE_WORKERS (int): Hilos que generan las versiones en segundo plano.
+    CARPETA_IMAGENES (Path): Carpeta de las imágenes originales (servida en ``/images``).
+    CARPETA_DERIVADAS (Path): Carpeta de las versiones reducidas.
+    URL_DERIVADAS (str): Ruta base en la que se sirven las versiones reducidas (``url`` da la de cada imagen).
+    FORMATO (str): Formato efectivo de las versiones reducidas.
+"""
+
+import os
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from PIL import Image, ImageOps, features
+from dotenv import load_dotenv
+from app.schemas.prompt import URL_DERIVADAS, url_derivada as url
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).parent.parent.parent
+CARPETA_IMAGENES = BASE_DIR.parent / "frontend" / "src" / "assets" / "images"
+CARPETA_DERIVADAS = Path(os.getenv("IMAGE_DERIVATIVES_DIR", str(BASE_DIR.parent / "frontend" / "src" / "assets" / "derived_images")))
+
+
+def _parsear_tamanos(texto: str) -> Dict[str, int]:
+    """Convierte ``"thumb:256,medium:1024"`` en ``{"thumb": 256, "medium": 1024}``."""
+    tamanos = {}
+    for parte in texto.split(","):
+        nombre, _, lado = parte.strip().partition(":")
+        if nombre and lado.strip().isdigit() and int(lado) > 0:
+            tamanos[nombre.strip()] = int(lado)
+    return tamanos
+
+
+IMAGE_DERIVATIVE_SIZES = _parsear_tamanos(os.getenv("IMAGE_DERIVATIVE_SIZES", "thumb:256,medium:1024"))
+IMAGE_DERIVATIVE_FORMAT = os.getenv("IMAGE_DERIVATIVE_FORMAT", "webp").lower()
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "75"))
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2"))
+
+# Carpeta de cada imagen según el prefijo de su nombre (igual que en el frontend)
+_CARPETAS = (
+    ("uploaded", "uploaded_images"),
+    ("generated", "generated_images"),
+    ("drawn", "drawn_images"),
+)
+_CARPETA_PLANTILLAS = "template_images"
+_EXTENSIONES_ORIGEN = (".png", ".jpg", ".jpeg", ".webp")
+_EXTENSIONES = {"avif": "avif", "webp": "webp", "jpeg": "jpg"}
+TIPOS_MIME = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def formato_soportado(formato: str) -> str:
+    """Devuelve ``formato`` si Pillow puede escribirlo, o el siguiente de AVIF → WebP → JPEG."""
+    orden = ["avif", "webp", "jpeg"]
+    inicio = orden.index(formato) if formato in orden else 1
+    for candidato in orden[inicio:]:
+        if candidato == "jpeg" or features.check(candidato):
+            return candidato
+    return "jpeg"
+
+
+FORMATO = formato_soportado(IMAGE_DERIVATIVE_FORMAT)
+
+
+def carpeta_de(nombre: str) -> str:
+    """Carpeta de ``CARPETA_IMAGENES`` en la que se guarda una imagen.
+
+    Args:
+        nombre (str): Nombre del archivo original.
+
+    Returns:
+        str: "uploaded_images", "generated_images", "drawn_images" o "template_images".
+    """
+    for prefijo, carpeta in _CARPETAS:
+        if nombre.startswith(prefijo):
+            return carpeta
+    return _CARPETA_PLANTILLAS
+
+
+def _validar_nombre(nombre: str) -> str:
+    if not nombre or nombre != Path(nombre).name or nombre.startswith("."):
+        raise ValueError(f"Nombre de imagen no válido: {nombre}")
+    return nombre
+
+
+def ruta_original(nombre: str) -> Path:
+    """Ruta del archivo original de una imagen.
+
+    Raises:
+        ValueError: Si el nombre no es un nombre de archivo simple.
+    """
+    nombre = _validar_nombre(nombre)
+    return CARPETA_IMAGENES / carpeta_de(nombre) / nombre
+
+
+def ruta_derivada(nombre: str, tamano: str, formato: str = None) -> Path:
+    """Ruta de la versión reducida de una imagen.
+
+    Args:
+        nombre (str): Nombre del archivo original.
+        tamano (str): Nombre del tamaño ("thumb", "medium"...).
+        formato (str | None): Formato de la versión (por defecto ``FORMATO``).
+
+    Raises:
+        ValueError: Si el nombre no es un nombre de archivo simple.
+    """
+    nombre = _validar_nombre(nombre)
+    extension = _EXTENSIONES[formato or FORMATO]
+    return CARPETA_DERIVADAS / tamano / carpeta_de(nombre) / f"{Path(nombre).stem}.{extension}"
+
+
+def _vigente(derivada: Path, origen: Path) -> bool:
+    try:
+        return derivada.stat().st_mtime >= origen.stat().st_mtime
+    except OSError:
+        return False
+
+
+def _guardar(imagen: Image.Image, destino: Path, formato: str, calidad: int):
+    """Guarda en un temporal de la misma carpeta y lo renombra al terminar."""
+    os.makedirs(destino.parent, exist_ok=True)
+    temporal = destino.with_name(f".{destino.name}.{uuid.uuid4().hex}.part")
+    try:
+        imagen.save(temporal, format=formato.upper(), quality=calidad)
+        os.replace(temporal, destino)
+    except BaseException:
+        try:
+            os.unlink(temporal)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def generar(origen: Path, tamanos: Optional[Iterable[str]] = None, formato: str = None,
+            calidad: int = IMAGE_DERIVATIVE_QUALITY) -> Dict[str, Path]:
+    """Crea las versiones reducidas que falten de una imagen.
+
+    La imagen se decodifica una sola vez y se reduce de mayor a menor tamaño,
+    partiendo cada versión de la anterior. Las versiones más recientes que el
+    original no se vuelven a generar.
+
+    Args:
+        origen (Path): Archivo original (en su carpeta de ``CARPETA_IMAGENES``).
+        tamanos (Iterable[str] | None): Tamaños a crear (por defecto todos).
+        formato (str | None): Formato de salida (por defecto ``FORMATO``).
+        calidad (int): Calidad de compresión.
+
+    Returns:
+        dict[str, Path]: Ruta de cada versión pedida.
+
+    Raises:
+        OSError: Si el original no se puede leer o la versión no se puede escribir.
+        KeyError: Si se pide un tamaño no configurado.
+    """
+    origen = Path(origen)
+    formato = formato or FORMATO
+    nombres = list(IMAGE_DERIVATIVE_SIZES) if tamanos is None else list(tamanos)
+    rutas = {tamano: ruta_derivada(origen.name, tamano, formato) for tamano in nombres}
+    pendientes = sorted(
+        (tamano for tamano in nombres if not _vigente(rutas[tamano], origen)),
+        key=lambda tamano: IMAGE_DERIVATIVE_SIZES[tamano], reverse=True,
+    )
+    if not pendientes:
+        return rutas
+
+    with Image.open(origen) as original:
+        imagen = ImageOps.exif_transpose(original)
+        modo = "RGBA" if "A" in imagen.getbands() and formato != "jpeg" else "RGB"
+        imagen = imagen.convert(modo)
+        for tamano in pendientes:
+            lado = IMAGE_DERIVATIVE_SIZES[tamano]
+            imagen.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+            _guardar(imagen, rutas[tamano], formato, calidad)
+    return rutas
+
+
+def obtener(nombre: str, tamano: str) -> Path:
+    """Devuelve la versión reducida de una imagen, creándola si aún no existe.
+
+    Args:
+        nombre (str): Nombre del archivo original.
+        tamano (str): Nombre del tamaño.
+
+    Returns:
+        Path: Archivo de la versión reducida.
+
+    Raises:
+        KeyError: Si el tamaño no está configurado.
+        ValueError: Si el nombre no es un nombre de archivo simple.
+        FileNotFoundError: Si la imagen original no existe.
+        OSError: Si la imagen no se puede procesar.
+    """
+    if tamano not in IMAGE_DERIVATIVE_SIZES:
+        raise KeyError(tamano)
+    origen = ruta_original(nombre)
+    derivada = ruta_derivada(nombre, tamano)
+    if _vigente(derivada, origen):
+        return derivada
+    if not origen.is_file():
+        raise FileNotFoundError(str(origen))
+    return generar(origen, [tamano])[tamano]
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _generar_en_segundo_plano(origen: Path) -> Dict[str, Path]:
+    try:
+        return generar(origen)
+    except Exception as e:
+        print(f"No se pudieron crear las miniaturas de {Path(origen).name}: {e}")
+        raise
+
+
+def programar(origen) -> Optional[Future]:
+    """Encola la creación de las versiones reducidas de una imagen recién guardada.
+
+    Args:
+        origen (str | Path): Archivo original.
+
+    Returns:
+        Future | None: Resultado de ``generar``, o None si no hay tamaños configurados.
+    """
+    global _pool
+    if not IMAGE_DERIVATIVE_SIZES:
+        return None
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, IMAGE_DERIVATIVE_WORKERS), thread_name_prefix="derivatives")
+    return _pool.submit(_generar_en_segundo_plano, Path(origen))
+
+
+def rellenar(carpetas: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+    """Crea las versiones reducidas que falten de todas las imágenes guardadas.
+
+    Args:
+        carpetas (Iterable[str] | None): Carpetas de ``CARPETA_IMAGENES`` a recorrer
+            (por defecto las de imágenes generadas, subidas, dibujadas y plantillas).
+
+    Returns:
+        tuple[int, int]: Imágenes procesadas y las que no se pudieron leer.
+    """
+    carpetas = carpetas or [carpeta for _, carpeta in _CARPETAS] + [_CARPETA_PLANTILLAS]
+    procesadas = errores = 0
+    for carpeta in carpetas:
+        directorio = CARPETA_IMAGENES / carpeta
+        if not directorio.is_dir():
+            continue
+        for origen in sorted(directorio.iterdir()):
+            if (not origen.is_file() or origen.name.startswith(".") or origen.suffix.lower() not in _EXTENSIONES_ORIGEN
+                    or carpeta_de(origen.name) != carpeta):
+                continue
+            try:
+                generar(origen)
+                procesadas += 1
+            except OSError as e:
+                errores += 1
+                print(f"No se pudieron crear las miniaturas de {origen.name}: {e}")
+    return procesadas, errores
+
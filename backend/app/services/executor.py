@@ -0,0 +1,157 @@
+"""Pool de hilos para el trabajo bloqueante de los endpoints.
+
+Los endpoints son ``async def`` pero la capa CRUD y los servicios son síncronos
+(consultas SQLAlchemy, lectura de archivos subidos, copias a disco). Ejecutarlos
+directamente en el event loop bloquea todas las demás peticiones mientras duran,
+así que los routers los delegan en este pool con ``await ejecutar(func, ...)``.
+
+El pool tiene un número fijo de hilos y una cola acotada: si hay más peticiones
+esperando que ``BLOCKING_QUEUE_LIMIT`` se responde 503 en lugar de acumular
+trabajo. Las métricas de saturación se exponen en ``GET /metrics``.
+
+Attributes:
+    BLOCKING_WORKERS (int): Hilos del pool.
+    BLOCKING_QUEUE_LIMIT (int): Tareas en espera máximas (0 = sin límite).
+    pool (BlockingExecutor): Pool global de la aplicación.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+BLOCKING_QUEUE_LIMIT = int(os.getenv("BLOCKING_QUEUE_LIMIT", "200"))
+
+
+class BlockingExecutor:
+    """Pool de hilos acotado con métricas de saturación.
+
+    Args:
+        workers (int): Número de hilos.
+        queue_limit (int): Tareas en espera máximas (0 = sin límite).
+    """
+
+    def __init__(self, workers: int = BLOCKING_WORKERS, queue_limit: int = BLOCKING_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="blocking")
+        self._lock = threading.Lock()
+        self._activos = 0
+        self._en_cola = 0
+        self._pico_activos = 0
+        self._pico_en_cola = 0
+        self._completados = 0
+        self._rechazados = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+
+    async def ejecutar(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta una función bloqueante en el pool sin bloquear el event loop.
+
+        Args:
+            func (Callable): Función síncrona.
+            *args: Argumentos posicionales.
+            **kwargs: Argumentos con nombre.
+
+        Returns:
+            Any: Resultado de la función (sus excepciones se propagan).
+
+        Raises:
+            HTTPException: 503 si la cola de espera está llena.
+        """
+        with self._lock:
+            if self.queue_limit and self._en_cola >= self.queue_limit:
+                self._rechazados += 1
+                raise HTTPException(status_code=503, detail="Servidor saturado, inténtalo de nuevo en unos segundos")
+            self._en_cola += 1
+            self._pico_en_cola = max(self._pico_en_cola, self._en_cola)
+
+        # Quien primero marque la tarea (el hilo al empezar o ``ejecutar`` al
+        # cancelarse la espera) es quien la saca de la cola
+        salida = {"fuera_de_cola": False}
+        encolado = time.monotonic()
+        contexto = contextvars.copy_context()
+        tarea = functools.partial(self._medir, salida, encolado, func, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, contexto.run, tarea)
+        finally:
+            # Si la petición se cancela con la tarea aún en cola, el hilo nunca la descuenta
+            with self._lock:
+                if not salida["fuera_de_cola"]:
+                    salida["fuera_de_cola"] = True
+                    self._en_cola -= 1
+
+    def _medir(self, salida: dict, encolado: float, func: Callable[..., Any], *args, **kwargs) -> Any:
+        espera = time.monotonic() - encolado
+        with self._lock:
+            if not salida["fuera_de_cola"]:
+                salida["fuera_de_cola"] = True
+                self._en_cola -= 1
+            self._activos += 1
+            self._pico_activos = max(self._pico_activos, self._activos)
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._activos -= 1
+                self._completados += 1
+
+    def metricas(self) -> dict:
+        """Estado y saturación del pool.
+
+        Returns:
+            dict: Hilos, tareas activas y en espera, picos, completadas, rechazadas,
+            saturación (activas / hilos) y espera media y máxima en cola (ms).
+        """
+        with self._lock:
+            iniciados = self._completados + self._activos
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "active": self._activos,
+                "queued": self._en_cola,
+                "peak_active": self._pico_activos,
+                "peak_queued": self._pico_en_cola,
+                "completed": self._completados,
+                "rejected": self._rechazados,
+                "saturation": round(self._activos / self.workers, 3),
+                "avg_wait_ms": round(1000 * self._espera_total / iniciados, 3) if iniciados else 0.0,
+                "max_wait_ms": round(1000 * self._espera_max, 3),
+            }
+
+    def cerrar(self):
+        """Espera a que terminen las tareas en curso y cierra el pool.
+
+        Se deja preparado un pool nuevo por si la aplicación vuelve a arrancar.
+        """
+        pool, self._pool = self._pool, ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="blocking")
+        pool.shutdown(wait=True)
+
+
+pool = BlockingExecutor()
+
+
+async def ejecutar(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Ejecuta una función bloqueante en el pool de la aplicación.
+
+    Args:
+        func (Callable): Función síncrona.
+        *args: Argumentos posicionales.
+        **kwargs: Argumentos con nombre.
+
+    Returns:
+        Any: Resultado de la función.
+    """
+    return await pool.ejecutar(func, *args, **kwargs)
@@ -11,28 +11,40 @@ Attributes:
     CARPETA_TEMPLATES (Path): Carpeta con imágenes plantilla.
     CARPETA_DESTINO_DRAWN (Path): Carpeta destino para dibujos de canvas.
     CARPETA_COMFY_INPUT (Path): Carpeta input de ComfyUI.
-    WORKFLOW_*_PATH (Path): Rutas a archivos de workflow JSON.
-    COMFYUI_URL (str): URL de la API de ComfyUI.
+    entradas (StagingArea): Entradas preparadas (por hash) en CARPETA_COMFY_INPUT.
+        Los resultados ya generados se reutilizan mediante ``result_cache.cache``.
+    COMFYUI_URL (str): URL de la API de ComfyUI (los workflows se reparten con ``comfy_pool.pool``).
     MAX_SQLITE_INT (int): Valor máximo para seeds de SQLite.
+    GENERATION_MAX_BATCH (int): Número máximo de variaciones por petición.
+    despachador (DespachadorImagenes): Vigilante único de CARPETA_ORIGEN.
 """
 
 from fileinput import filename
 import random
 from urllib.parse import urlparse
-import requests
-import json
 import time
 import os
 import shutil
-from typing import Optional
+import threading
+from concurrent.futures import Future, CancelledError, TimeoutError as FuturesTimeoutError
+from typing import Dict, List, Optional
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from pathlib import Path
 from fastapi import HTTPException
 import uuid
 from pathlib import Path
-from translate import Translator
 from dotenv import load_dotenv
+from . import comfy_client
+from . import comfy_pool
+from . import workflows
+from . import translation
+from . import result_cache
+from . import cancellation
+from . import derivatives
+from .staging import StagingArea
+from .ingestion import ImagenIngerida, imagen_completa, ingerir
+from app.schemas.prompt import GENERATION_MAX_BATCH, MAX_SEED
 
 # Cargar variables de entorno
 load_dotenv()
@@ -47,96 +59,393 @@ CARPETA_DESTINO_UPL = BASE_DIR.parent / "frontend" / "src" / "assets" / "images"
 CARPETA_TEMPLATES = BASE_DIR.parent / "frontend" / "src" / "assets" / "images" / "template_images"
 CARPETA_DESTINO_DRAWN = BASE_DIR.parent / "frontend" / "src" / "assets" / "images" / "drawn_images"
 
-WORKFLOW_TXT2IMG_PATH = BASE_DIR / "workflows" / "sdxl txt2img api workflow.json"
-WORKFLOW_IMG2IMG_PATH = BASE_DIR / "workflows" / "sdxl img2img api workflow.json"
-WORKFLOW_MULTIMG2_PATH = BASE_DIR / "workflows" / "sdxl twoimgs2img api workflow.json"
-WORKFLOW_MULTIMG3_PATH = BASE_DIR / "workflows" / "sdxl threeimgs2img api workflow.json"
-WORKFLOW_MULTIMG4_PATH = BASE_DIR / "workflows" / "sdxl fourimgs2img api workflow.json"
-WORKFLOW_SKETCH2IMG_PATH = BASE_DIR / "workflows" / "sdxl sketch2img api workflow.json"
-
 # Leer URL de ComfyUI desde variable de entorno
-COMFYUI_BASE_URL = os.getenv("COMFY_UI_URL", "http://localhost:8188")
+COMFYUI_BASE_URL = comfy_client.COMFYUI_BASE_URL
 COMFYUI_URL = f"{COMFYUI_BASE_URL}/prompt"
 
-MAX_SQLITE_INT = 9223372036854775807
+# Los límites se definen en app.schemas.prompt, que también los valida en las peticiones
+MAX_SQLITE_INT = MAX_SEED
 
-class ImagenHandler(FileSystemEventHandler):
-    """Handler de watchdog para detectar imágenes generadas por ComfyUI.
-    
-    Attributes:
-        prefijo (str): Prefijo del nombre de archivo a detectar.
-        archivo_encontrado (str | None): Nombre del archivo detectado.
+entradas = StagingArea(CARPETA_COMFY_INPUT)
+
+class DespachadorImagenes(FileSystemEventHandler):
+    """Vigilante único de la carpeta de salida de ComfyUI.
+
+    Un solo ``Observer`` de watchdog, arrancado en el startup de la aplicación,
+    vigila ``CARPETA_ORIGEN``. Cada petición de generación registra un ``Future``
+    asociado al prefijo de nombre de archivo que usará el nodo SaveImage, y el
+    despachador resuelve ese ``Future`` cuando el archivo está escrito por
+    completo, sin que el trabajador tenga que hacer polling.
+
+    Note:
+        ComfyUI guarda los archivos como ``{prefijo}_{contador:05}_.png``, por lo
+        que el prefijo se obtiene directamente del nombre del archivo creado.
+        Cada evento de creación, modificación o cierre comprueba si el archivo ya
+        termina con el marcador de fin de PNG/JPEG (ver ``ingestion.imagen_completa``).
     """
-    def __init__(self, prefijo):
-        """Inicializa el handler.
-        
+
+    EXTENSIONES = (".png", ".jpg", ".jpeg")
+
+    def __init__(self):
+        self._esperas: Dict[str, List[Future]] = {}
+        self._lock = threading.Lock()
+        self._observer: Optional[Observer] = None
+
+    def iniciar(self, carpeta: str = CARPETA_ORIGEN):
+        """Arranca el observer si no estaba en marcha.
+
+        Args:
+            carpeta (str): Carpeta de salida de ComfyUI a vigilar.
+
+        Raises:
+            OSError: Si la carpeta no existe o no se puede vigilar.
+        """
+        with self._lock:
+            if self._observer is not None:
+                return
+            observer = Observer()
+            observer.schedule(self, carpeta, recursive=False)
+            observer.start()
+            self._observer = observer
+        print(f"Vigilando la carpeta de salida de ComfyUI: {carpeta}")
+
+    def detener(self):
+        """Detiene el observer y libera las esperas pendientes."""
+        with self._lock:
+            observer, self._observer = self._observer, None
+            esperas, self._esperas = self._esperas, {}
+        for futuros in esperas.values():
+            for futuro in futuros:
+                futuro.cancel()
+        if observer is not None:
+            observer.stop()
+            observer.join()
+
+    def registrar(self, prefijo: str) -> Future:
+        """Registra una espera para el próximo archivo con el prefijo dado.
+
+        Debe llamarse antes de enviar el workflow a ComfyUI para no perder el evento.
+
         Args:
-            prefijo (str): Prefijo del nombre de archivo a monitorear.
+            prefijo (str): Prefijo configurado en el nodo SaveImage.
+
+        Returns:
+            Future: Se resuelve con la ruta del archivo creado.
+        """
+        futuro = Future()
+        with self._lock:
+            self._esperas.setdefault(prefijo, []).append(futuro)
+        return futuro
+
+    def cancelar(self, prefijo: str, futuro: Future):
+        """Elimina una espera (tras resolverse, agotar el tiempo o fallar el envío).
+
+        Args:
+            prefijo (str): Prefijo con el que se registró la espera.
+            futuro (Future): Espera devuelta por ``registrar``.
         """
-        self.prefijo = prefijo
-        self.archivo_encontrado = None
+        with self._lock:
+            futuros = self._esperas.get(prefijo)
+            if futuros and futuro in futuros:
+                futuros.remove(futuro)
+                if not futuros:
+                    del self._esperas[prefijo]
+
+    @property
+    def pendientes(self) -> int:
+        """int: Número de esperas registradas sin resolver."""
+        with self._lock:
+            return sum(len(futuros) for futuros in self._esperas.values())
+
+    def _procesar(self, ruta: str):
+        nombre = os.path.basename(ruta)
+        if not nombre.lower().endswith(self.EXTENSIONES):
+            return
+
+        prefijo = nombre.rsplit("_", 2)[0]
+        with self._lock:
+            if not self._esperas.get(prefijo):
+                return
+        # Fuera del lock: lee la cola del archivo
+        if not imagen_completa(ruta):
+            return
+        with self._lock:
+            futuros = self._esperas.get(prefijo)
+            if not futuros:
+                return
+            futuro = futuros.pop(0)
+            if not futuros:
+                del self._esperas[prefijo]
+
+        print(f"Imagen detectada: {nombre}")
+        futuro.set_result(ruta)
 
     def on_created(self, event):
-        nombre = os.path.basename(event.src_path)
-        if nombre.startswith(self.prefijo) and nombre.lower().endswith((".png", ".jpg", ".jpeg")):
-            print(f"Imagen detectada: {nombre}")
-            origen = event.src_path
+        if not event.is_directory:
+            self._procesar(event.src_path)
 
-            # Esperar a que el archivo esté completamente escrito
-            max_wait = 10  # segundos
-            wait_time = 0.1
-            elapsed = 0
-            last_size = -1
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._procesar(event.src_path)
 
-            while elapsed < max_wait:
-                current_size = os.path.getsize(origen)
-                if current_size == last_size:
-                    break  # el archivo dejó de crecer
-                last_size = current_size
-                time.sleep(wait_time)
-                elapsed += wait_time
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._procesar(event.src_path)
 
-            # Asegurar que la carpeta de destino existe
-            os.makedirs(str(CARPETA_DESTINO_GEN), exist_ok=True)
-            destino = os.path.join(str(CARPETA_DESTINO_GEN), nombre)
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._procesar(event.dest_path)
 
-            # Copiar la imagen
-            shutil.copyfile(origen, destino)
-            print(f"Imagen copiada a: {destino}")
-            self.archivo_encontrado = destino
 
+despachador = DespachadorImagenes()
 
 
-def esperar_imagen(prefijo: str, timeout: int = 500) -> Optional[str]:
+def esperar_imagen(prefijo: str, timeout: int = 500, espera: Optional[Future] = None) -> Optional[ImagenIngerida]:
     """
     Espera a que se genere una imagen con el prefijo especificado.
     
     Args:
         prefijo: Prefijo del nombre de archivo a buscar
         timeout: Tiempo máximo de espera en segundos
+        espera: Espera registrada previamente con ``despachador.registrar``
     
     Returns:
-        Ruta completa de la imagen generada o None si se agota el tiempo
+        Imagen ya guardada en CARPETA_DESTINO_GEN o None si se agota el tiempo
+
+    Raises:
+        HTTPException: 500 si no se puede guardar la imagen generada
     """
-    handler = ImagenHandler(prefijo)
-    observer = Observer()
-    observer.schedule(handler, CARPETA_ORIGEN, recursive=False)
-    observer.start()
+    futuro = espera or despachador.registrar(prefijo)
+    print(f"Esperando imagen con prefijo '{prefijo}' en {CARPETA_ORIGEN}...")
 
-    print(f"Esperando imagen con prefijo '{prefijo}' en {CARPETA_ORIGEN}...")  # Ya está en español
+    try:
+        origen = futuro.result(timeout=timeout)
+    except FuturesTimeoutError:
+        print("Tiempo de espera agotado.")
+        return None
+    except CancelledError:
+        print(f"Espera de la imagen '{prefijo}' cancelada.")
+        return None
+    finally:
+        despachador.cancelar(prefijo, futuro)
 
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if handler.archivo_encontrado:
-            observer.stop()
-            observer.join()
-            return handler.archivo_encontrado
-        time.sleep(0.5)
+    try:
+        return ingerir(origen, CARPETA_DESTINO_GEN)
+    except OSError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al guardar la imagen generada: {str(e)}"
+        )
+
+
+def _prefijo_unico(user_id: int) -> str:
+    """Genera un prefijo de archivo único para un trabajo de generación.
+
+    Dos generaciones simultáneas del mismo paciente deben escribir archivos con
+    prefijos distintos para que cada espera reciba su propia imagen.
+
+    Args:
+        user_id (int): ID del paciente que genera la imagen.
+
+    Returns:
+        str: Prefijo ``generated{user_id}-{id_trabajo}`` para el nodo SaveImage.
+    """
+    return f"generated{user_id}-{uuid.uuid4().hex}"
+
+
+def _preparar_entrada(origin_path: Path, filename: str, tipo: str = "entrada") -> str:
+    """Deja una imagen de origen en la carpeta input de ComfyUI.
+
+    Args:
+        origin_path (Path): Ruta de la imagen de origen.
+        filename (str): Nombre mostrado en los mensajes de error.
+        tipo (str): Tipo de imagen para los mensajes ("entrada", "boceto").
+
+    Returns:
+        str: Nombre del archivo preparado para el nodo LoadImage. Debe liberarse
+        con ``entradas.liberar`` al terminar el trabajo.
+
+    Raises:
+        HTTPException: 404 si el origen no existe, 500 si no se puede preparar.
+    """
+    if not origin_path.exists():
+        raise HTTPException(
+            status_code=404,
+            detail=f"La imagen de {tipo} no existe: {filename}"
+        )
+    try:
+        return entradas.preparar(origin_path)
+    except OSError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al copiar la imagen de {tipo}: {str(e)}"
+        )
 
-    observer.stop()
-    observer.join()
-    print("Tiempo de espera agotado.")
-    return None
+
+def _enviar_workflow_lote(workflow: dict, prefijos: List[str]) -> List[Optional[ImagenIngerida]]:
+    """Obtiene las imágenes de un workflow, generando solo las que no están en caché.
+
+    Cada nodo SaveImage se busca en ``result_cache.cache``; si todas sus imágenes
+    ya existen no se contacta con ComfyUI. Si solo faltan algunas, se envía el
+    workflow sin los SaveImage resueltos (ComfyUI solo ejecuta las ramas que
+    llevan a un nodo de salida).
+
+    Args:
+        workflow (dict): Workflow de ComfyUI ya parametrizado.
+        prefijos (list[str]): Prefijo de cada nodo SaveImage del workflow.
+
+    Returns:
+        list[ImagenIngerida | None]: Imagen de cada prefijo (None si no llegó a tiempo).
+
+    Raises:
+        HTTPException: 503 si no se puede vigilar la carpeta de salida o falla ComfyUI.
+    """
+    salidas = {
+        nodo["inputs"].get("filename_prefix"): node_id
+        for node_id, nodo in workflow.items()
+        if nodo.get("class_type") == "SaveImage"
+    }
+    claves = [
+        result_cache.clave_resultado(workflow, salidas[prefijo]) if result_cache.cache.activa and prefijo in salidas else None
+        for prefijo in prefijos
+    ]
+    imagenes = [result_cache.cache.buscar(clave) if clave else None for clave in claves]
+    pendientes = [i for i, imagen in enumerate(imagenes) if imagen is None]
+    resueltas = len(prefijos) - len(pendientes)
+    if resueltas:
+        print(f"{resueltas} de {len(prefijos)} imágenes servidas desde la caché de generaciones")
+    if not pendientes:
+        return imagenes
+
+    if resueltas:
+        omitir = {salidas[prefijos[i]] for i, imagen in enumerate(imagenes) if imagen is not None}
+        workflow = {node_id: nodo for node_id, nodo in workflow.items() if node_id not in omitir}
+
+    generadas = _renderizar_lote(workflow, [prefijos[i] for i in pendientes])
+    for i, imagen in zip(pendientes, generadas):
+        imagenes[i] = imagen
+        if imagen is not None:
+            derivatives.programar(imagen.ruta)
+            if claves[i]:
+                result_cache.cache.guardar(claves[i], imagen)
+    return imagenes
+
+
+def _renderizar_lote(workflow: dict, prefijos: List[str]) -> List[Optional[ImagenIngerida]]:
+    """Envía un workflow con uno o varios nodos SaveImage y espera todas sus imágenes.
+
+    Args:
+        workflow (dict): Workflow de ComfyUI ya parametrizado.
+        prefijos (list[str]): Prefijo de cada nodo SaveImage del workflow.
+
+    Returns:
+        list[ImagenIngerida | None]: Imagen de cada prefijo (None si no llegó a tiempo).
+
+    Raises:
+        HTTPException: 503 si no se puede vigilar la carpeta de salida o falla ComfyUI.
+        GeneracionCancelada: 409 si se cancela el trabajo mientras espera.
+
+    Note:
+        Con ``COMFY_COMPLETION_MODE=api`` no se vigila ninguna carpeta: el fin del
+        workflow se detecta con la API de ComfyUI y las imágenes se descargan con ``/view``.
+    """
+    if comfy_client.COMFY_COMPLETION_MODE == "api":
+        imagenes = comfy_pool.ejecutar_workflow_lote(workflow, CARPETA_DESTINO_GEN) or []
+        return [next((img for img in imagenes if img.nombre.startswith(f"{prefijo}_")), None) for prefijo in prefijos]
+
+    try:
+        despachador.iniciar()
+    except OSError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"No se puede vigilar la carpeta de salida de ComfyUI: {str(e)}"
+        )
+
+    # Registrar las esperas antes de enviar para no perder ningún archivo
+    esperas = [despachador.registrar(prefijo) for prefijo in prefijos]
+
+    def enviar_y_esperar(comfy: comfy_client.ComfyClient) -> List[Optional[ImagenIngerida]]:
+        # Enviar petición a ComfyUI
+        cancellation.comprobar()
+        oyente = comfy_client.OyenteProgreso.abrir(comfy)
+        try:
+            prompt_id = comfy.run(comfy.post_prompt(workflow, oyente.client_id if oyente else None))
+        except BaseException:
+            if oyente is not None:
+                oyente.cerrar()
+            raise
+        if oyente is not None:
+            oyente.seguir(prompt_id)
+
+        # Si se cancela el trabajo, las esperas se liberan al momento
+        retirar = comfy_client.cancelar_al_cancelar(comfy, prompt_id, liberar=lambda: [e.cancel() for e in esperas])
+        try:
+            # Esperar a que se generen las imágenes (plazo común para todo el lote)
+            limite = time.time() + 500
+            imagenes = [
+                esperar_imagen(prefijo, timeout=max(0.0, limite - time.time()), espera=espera)
+                for prefijo, espera in zip(prefijos, esperas)
+            ]
+        finally:
+            retirar()
+            if oyente is not None:
+                oyente.cerrar()
+        cancellation.comprobar()
+        return imagenes
+
+    try:
+        # La instancia sigue contando como ocupada hasta que llegan las imágenes
+        return comfy_pool.pool.ejecutar(workflow, enviar_y_esperar)
+    finally:
+        for prefijo, espera in zip(prefijos, esperas):
+            despachador.cancelar(prefijo, espera)
+
+
+def _enviar_workflow(workflow: dict, prefix: str) -> Optional[ImagenIngerida]:
+    """Envía un workflow a ComfyUI y espera la imagen que genera.
+
+    Args:
+        workflow (dict): Workflow de ComfyUI ya parametrizado.
+        prefix (str): Prefijo configurado en el nodo SaveImage del workflow.
+
+    Returns:
+        ImagenIngerida | None: Imagen guardada en CARPETA_DESTINO_GEN o None si se agota el tiempo.
+
+    Raises:
+        HTTPException: 503 si no se puede vigilar la carpeta de salida o falla ComfyUI.
+    """
+    return _enviar_workflow_lote(workflow, [prefix])[0]
+
+
+def _preparar_txt2img(prompt_text: str, input_img: Optional[str]):
+    """Elige la plantilla txt2img o img2img y prepara el texto y la imagen de entrada.
+
+    Args:
+        prompt_text (str): Prompt ya traducido.
+        input_img (str | None): Imagen de entrada (ruta relativa a assets) para img2img.
+
+    Returns:
+        tuple: Plantilla, cambios comunes a todas las variantes y entradas preparadas
+        (a liberar con ``entradas.liberar``).
+    """
+    if(input_img):
+        plantilla = workflows.registro.get("img2img")
+        nodo_texto = "17"
+    else:
+        plantilla = workflows.registro.get("txt2img")
+        nodo_texto = "11"
+    cambios = {nodo_texto: {"text_positive": prompt_text + ", " + plantilla.input(nodo_texto, "text_positive")}}
+
+    preparadas = []
+    if(input_img):
+        filename = input_img.rpartition('/')[-1]
+        print(f"Usando imagen de entrada: {filename}")
+
+        origin_path = BASE_DIR.parent / "frontend" / "src" / "assets" / urlparse(input_img).path.lstrip("/")
+        preparada = _preparar_entrada(origin_path, filename)
+        preparadas.append(preparada)
+        cambios["10"] = {"image": preparada}
+    return plantilla, cambios, preparadas
 
 
 def generar_imagen(prompt_text: str, user_id: int, prompt_seed: Optional[int] = None, input_img: Optional[str] = None) -> dict:
@@ -153,89 +462,119 @@ def generar_imagen(prompt_text: str, user_id: int, prompt_seed: Optional[int] =
         HTTPException: Si hay un error al generar la imagen
     """
 
-    translator= Translator(from_lang="es", to_lang="en")
-    prompt_text = translator.translate(prompt_text)
-    
-    if(input_img):
-        with open(WORKFLOW_IMG2IMG_PATH, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-            workflow["17"]["inputs"]["text_positive"] = prompt_text + ", " +  workflow["17"]["inputs"]["text_positive"]
-    else:
-        with open(WORKFLOW_TXT2IMG_PATH, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-            workflow["11"]["inputs"]["text_positive"] = prompt_text + ", " +  workflow["11"]["inputs"]["text_positive"] 
+    prompt_text = translation.traducir(prompt_text)
+    plantilla, cambios, preparadas = _preparar_txt2img(prompt_text, input_img)
 
     if(prompt_seed):
         seed = prompt_seed
     else:
         seed = random.randint(0, MAX_SQLITE_INT)
 
-    if(input_img):
-        filename = input_img.rpartition('/')[-1]
-        print(f"Usando imagen de entrada: {filename}")
+    prefix = _prefijo_unico(user_id)
+    cambios["3"] = {"seed": seed}
+    cambios["9"] = {"filename_prefix": prefix}
+    workflow = plantilla.parchear(cambios)
 
-        origin_path = BASE_DIR.parent / "frontend" / "src" / "assets" / urlparse(input_img).path.lstrip("/")
+    try:
+        imagen = _enviar_workflow(workflow, prefix)
+    finally:
+        entradas.liberar(preparadas)
+    
+    if imagen:
+        print(f"Devolviendo ruta de imagen: assets/{imagen.nombre}")
+        return {
+            "message": "Imagen generada correctamente",
+            "file": imagen.nombre,
+            "fullPath": imagen.ruta,
+            "seed": seed,
+            **imagen.metadatos()
+        }
+    else:
+        raise HTTPException(
+            status_code=408,
+            detail="No se encontró la imagen generada. Tiempo de espera agotado."
+        )
 
-        # Validar que el archivo de origen exista
-        if not origin_path.exists():
-            raise HTTPException(
-                status_code=404,
-                detail=f"La imagen de entrada no existe: {filename}"
-            )
 
-        print(f"Copiando de {origin_path} a {CARPETA_COMFY_INPUT}")
-        destino_path = CARPETA_COMFY_INPUT / filename
-        
-        try:
-            shutil.copy(origin_path, destino_path)
-        except (IOError, OSError) as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al copiar la imagen de entrada: {str(e)}"
-            )
-            
-        workflow["10"]["inputs"]["image"] = filename
+def semillas_lote(count: int = 1, seed: Optional[int] = None, seeds: Optional[List[int]] = None, stride: Optional[int] = None) -> List[int]:
+    """Calcula las semillas de un lote de variaciones.
 
-    workflow["3"]["inputs"]["seed"] = seed
+    Args:
+        count (int): Número de imágenes.
+        seed (int, optional): Semilla de la primera imagen (aleatoria si no se indica).
+        seeds (list[int], optional): Semillas explícitas; tienen prioridad sobre el resto.
+        stride (int, optional): Incremento entre semillas consecutivas. Sin él, cada
+            imagen recibe una semilla aleatoria.
 
-    prefix = "generated" + str(user_id)    
-    workflow["9"]["inputs"]["filename_prefix"] = prefix
+    Returns:
+        list[int]: Una semilla por imagen.
+    """
+    if seeds:
+        return list(seeds)
+    base = seed if seed else random.randint(0, MAX_SQLITE_INT)
+    if stride:
+        return [(base + i * stride) % (MAX_SQLITE_INT + 1) for i in range(count)]
+    return [base] + [random.randint(0, MAX_SQLITE_INT) for _ in range(count - 1)]
+
+
+def generar_imagenes(prompt_text: str, user_id: int, seeds: List[int], input_img: Optional[str] = None) -> List[dict]:
+    """Genera varias variaciones de un prompt en un único envío a ComfyUI.
+
+    El texto se traduce y la imagen de entrada se prepara una sola vez; el workflow
+    replica la rama KSampler → VAEDecode → SaveImage por cada semilla, de modo que
+    ComfyUI carga el modelo y codifica el prompt una única vez.
+
+    Args:
+        prompt_text (str): Texto del prompt.
+        user_id (int): ID del paciente.
+        seeds (list[int]): Semilla de cada imagen.
+        input_img (str, optional): Imagen de entrada para img2img.
+
+    Returns:
+        list[dict]: Información de cada imagen generada, en el orden de ``seeds``.
+        Las imágenes que no lleguen a tiempo se omiten.
+
+    Raises:
+        HTTPException: 408 si no se generó ninguna imagen a tiempo.
+    """
+    prompt_text = translation.traducir(prompt_text)
+    plantilla, cambios, preparadas = _preparar_txt2img(prompt_text, input_img)
+    workflow = plantilla.parchear(cambios)
+
+    base = _prefijo_unico(user_id)
+    prefijos = [f"{base}-{i}" for i in range(len(seeds))]
+    workflow = workflows.ramificar(workflow, "3", [
+        {"3": {"seed": seed}, "9": {"filename_prefix": prefijo}}
+        for seed, prefijo in zip(seeds, prefijos)
+    ])
 
-    # Enviar petición a ComfyUI
-    payload = {"prompt": workflow}
-    
     try:
-        response = requests.post(COMFYUI_URL, json=payload, timeout=300)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=503,
-            detail=f"Error al comunicarse con ComfyUI: {str(e)}"
-        )
+        imagenes = _enviar_workflow_lote(workflow, prefijos)
+    finally:
+        entradas.liberar(preparadas)
 
-    # Esperar a que se genere la imagen
-    ruta_imagen = esperar_imagen(prefix)
-    
-    if ruta_imagen:
-        nombre_archivo = os.path.basename(ruta_imagen)
-        print(f"Devolviendo ruta de imagen: assets/{nombre_archivo}")
-        return {
+    resultados = [
+        {
             "message": "Imagen generada correctamente",
-            "file": nombre_archivo,
-            "fullPath": ruta_imagen,
-            "seed": seed
+            "file": imagen.nombre,
+            "fullPath": imagen.ruta,
+            "seed": seed,
+            **imagen.metadatos()
         }
-    else:
+        for imagen, seed in zip(imagenes, seeds) if imagen
+    ]
+    if not resultados:
         raise HTTPException(
             status_code=408,
-            detail="No se encontró la imagen generada. Tiempo de espera agotado."
+            detail="No se encontró ninguna imagen generada. Tiempo de espera agotado."
         )
-    
+    if len(resultados) < len(seeds):
+        print(f"Lote incompleto: {len(resultados)} de {len(seeds)} imágenes generadas a tiempo")
+    return resultados
 
 
 def convertir_boceto_imagen(input_img: str, input_text: str, user_id: int) -> dict:
-    with open(WORKFLOW_SKETCH2IMG_PATH, "r",encoding="utf-8") as f:
-            workflow = json.load(f)
+    plantilla = workflows.registro.get("sketch2img")
 
     seed = random.randint(0, MAX_SQLITE_INT)
 
@@ -243,58 +582,31 @@ def convertir_boceto_imagen(input_img: str, input_text: str, user_id: int) -> di
     print(f"Usando imagen de entrada: {filename}")
 
     origin_path = BASE_DIR.parent / "frontend" / "src" / "assets" / urlparse(input_img).path.lstrip("/")
+    preparada = _preparar_entrada(origin_path, filename, tipo="boceto")
 
-    # Validar que el archivo de origen exista
-    if not origin_path.exists():
-        raise HTTPException(
-            status_code=404,
-            detail=f"La imagen de boceto no existe: {filename}"
-        )
-
-    print(f"Copiando de {origin_path} a {CARPETA_COMFY_INPUT}")
-    destino_path = CARPETA_COMFY_INPUT / filename
-    
-    try:
-        shutil.copy(origin_path, destino_path)
-    except (IOError, OSError) as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al copiar la imagen de boceto: {str(e)}"
-        )
+    input_text = translation.traducir(input_text)
 
-    translator= Translator(from_lang="es", to_lang="en")
-    input_text = translator.translate(input_text)
+    prefix = _prefijo_unico(user_id)
+    workflow = plantilla.parchear({
+        "199": {"text_positive": input_text + ", " + plantilla.input("199", "text_positive")},
+        "138": {"image": preparada},
+        "128": {"seed": seed},
+        "132": {"filename_prefix": prefix},
+    })
 
-    workflow["199"]["inputs"]["text_positive"] = input_text + ", " + workflow["199"]["inputs"]["text_positive"]
-    workflow["138"]["inputs"]["image"] = filename
-    workflow["128"]["inputs"]["seed"] = seed
-
-    prefix = "generated" + str(user_id)
-    workflow["132"]["inputs"]["filename_prefix"] = prefix
-
-    # Enviar petición a ComfyUI
-    payload = {"prompt": workflow}
-    
     try:
-        response = requests.post(COMFYUI_URL, json=payload, timeout=300)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=503,
-            detail=f"Error al comunicarse con ComfyUI: {str(e)}"
-        )
-
-    # Esperar a que se genere la imagen
-    ruta_imagen = esperar_imagen(prefix)
+        imagen = _enviar_workflow(workflow, prefix)
+    finally:
+        entradas.liberar([preparada])
     
-    if ruta_imagen:
-        nombre_archivo = os.path.basename(ruta_imagen)
-        print(f"Devolviendo ruta de imagen: assets/{nombre_archivo}")
+    if imagen:
+        print(f"Devolviendo ruta de imagen: assets/{imagen.nombre}")
         return {
             "message": "Imagen generada correctamente",
-            "file": nombre_archivo,
-            "fullPath": ruta_imagen,
-            "seed": seed
+            "file": imagen.nombre,
+            "fullPath": imagen.ruta,
+            "seed": seed,
+            **imagen.metadatos()
         }
     else:
         raise HTTPException(
@@ -359,6 +671,7 @@ def publicar_imagen(upload_file, isDrawn):
             status_code=500,
             detail=f"Error al guardar la imagen: {str(e)}"
         )
+    derivatives.programar(destino_path)
 
     return {"message": "Imagen subida correctamente", "file": filename, "fullPath": str(destino_path), "seed": None}
 
@@ -415,6 +728,7 @@ def publicar_dibujo(upload_file):
             status_code=500,
             detail=f"Error al guardar el dibujo: {str(e)}"
         )
+    derivatives.programar(destino_path)
 
     return {"message": "Dibujo guardado correctamente", "file": filename, "fullPath": str(destino_path), "seed": None}
 
@@ -458,23 +772,10 @@ def generate_image_by_mult_images(images: list, count: int, user_id: int) -> dic
     Raises:
         HTTPException: Si hay un error al generar la imagen
     """
-    imgs_idx = []
-
-    if (count == 2):
-        with open(WORKFLOW_MULTIMG2_PATH, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-        imgs_idx  = [1, 2]
-
-    elif (count == 3):
-        with open(WORKFLOW_MULTIMG3_PATH, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-        imgs_idx  = [1, 2, 5]
-
-    elif (count == 4):
-        with open(WORKFLOW_MULTIMG4_PATH, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
-        imgs_idx  = [1, 2, 28, 29]
-    
+    plantilla = workflows.registro.get(f"multimg{count}")
+    imgs_idx = workflows.NODOS_IMAGENES_MULTIPLES[count]
+    cambios = {}
+    preparadas = []
 
     for i in range(count):
         filename = images[i].fileName
@@ -490,43 +791,34 @@ def generate_image_by_mult_images(images: list, count: int, user_id: int) -> dic
             folder = BASE_DIR.parent / "frontend" / "src" / "assets" / "images" / "template_images"
 
         origin_path = folder / file_name
-
-        print(f"Copiando de {origin_path} a {CARPETA_COMFY_INPUT}")
-        destino_path = CARPETA_COMFY_INPUT / filename
-        shutil.copy(origin_path, destino_path)
-        
-        workflow[f"{imgs_idx[i]}"]["inputs"]["image"] = filename
+        try:
+            preparada = _preparar_entrada(origin_path, filename)
+        except HTTPException:
+            entradas.liberar(preparadas)
+            raise
+        preparadas.append(preparada)
+        cambios[imgs_idx[i]] = {"image": preparada}
 
     seed = random.randint(0, MAX_SQLITE_INT)
 
-    workflow["16"]["inputs"]["seed"] = seed
-
-    prefix = "generated" + str(user_id)
-    workflow["17"]["inputs"]["filename_prefix"] = prefix
+    prefix = _prefijo_unico(user_id)
+    cambios["16"] = {"seed": seed}
+    cambios["17"] = {"filename_prefix": prefix}
+    workflow = plantilla.parchear(cambios)
 
-    # Enviar petición a ComfyUI
-    payload = {"prompt": workflow}
-    
     try:
-        response = requests.post(COMFYUI_URL, json=payload, timeout=300)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=503,
-            detail=f"Error al comunicarse con ComfyUI: {str(e)}"
-        )
-
-    # Esperar a que se genere la imagen
-    ruta_imagen = esperar_imagen(prefix)
+        imagen = _enviar_workflow(workflow, prefix)
+    finally:
+        entradas.liberar(preparadas)
     
-    if ruta_imagen:
-        nombre_archivo = os.path.basename(ruta_imagen)
-        print(f"Devolviendo ruta de imagen: assets/{nombre_archivo}")
+    if imagen:
+        print(f"Devolviendo ruta de imagen: assets/{imagen.nombre}")
         return {
             "message": "Imagen generada correctamente",
-            "file": nombre_archivo,
-            "fullPath": ruta_imagen,
-            "seed": seed
+            "file": imagen.nombre,
+            "fullPath": imagen.ruta,
+            "seed": seed,
+            **imagen.metadatos()
         }
     else:
         raise HTTPException(
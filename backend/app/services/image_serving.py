@@ -0,0 +1,209 @@
+"""Envío de las imágenes guardadas con caché HTTP.
+
+Las imágenes de la app no cambian una vez escritas: sus nombres llevan un uuid
+o un contador, así que un nombre nuevo es siempre un archivo nuevo. Por eso:
+
+- El ETag es un hash SHA-256 del contenido (no de la fecha y el tamaño), que se
+  calcula una vez por archivo y se guarda en memoria mientras no cambie su
+  ``stat``.
+- Las imágenes de las carpetas de ``IMAGE_IMMUTABLE_FOLDERS`` se envían con
+  ``Cache-Control: immutable`` y el navegador no vuelve a pedirlas al reabrir
+  una galería. Las demás (plantillas) se revalidan con ``If-None-Match`` y se
+  responde 304 sin cuerpo si no han cambiado.
+- Las peticiones ``Range`` se responden con 206 (``FileResponse`` de Starlette).
+- Si el servidor ASGI ofrece la extensión ``http.response.pathsend`` el cuerpo
+  lo envía el propio servidor (sendfile); si no, se lee en bloques de
+  ``IMAGE_CHUNK_SIZE`` para que una imagen típica salga en una sola lectura.
+
+Attributes:
+    IMAGE_IMMUTABLE_FOLDERS (frozenset[str]): Carpetas de imágenes que no cambian nunca.
+    IMAGE_CHUNK_SIZE (int): Tamaño de bloque de lectura al enviar una imagen.
+    IMAGE_ETAG_CACHE_SIZE (int): Hashes de archivos que se recuerdan.
+    CACHE_INMUTABLE (str): ``Cache-Control`` de las imágenes que no cambian.
+    CACHE_REVALIDAR (str): ``Cache-Control`` de las que pueden cambiar.
+    huellas (HuellasContenido): Hashes de contenido de los archivos servidos.
+"""
+
+import hashlib
+import os
+import stat
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMAGE_IMMUTABLE_FOLDERS = frozenset(
+    carpeta.strip()
+    for carpeta in os.getenv("IMAGE_IMMUTABLE_FOLDERS", "generated_images,uploaded_images,drawn_images").split(",")
+    if carpeta.strip()
+)
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(1024 * 1024)))
+IMAGE_ETAG_CACHE_SIZE = int(os.getenv("IMAGE_ETAG_CACHE_SIZE", "10000"))
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "public, no-cache"
+
+_BLOQUE_HASH = 1024 * 1024
+
+
+class HuellasContenido:
+    """Hashes de contenido de archivos, recordados mientras no cambia su ``stat``.
+
+    Args:
+        capacidad (int): Archivos que se recuerdan (los menos usados se olvidan).
+
+    Attributes:
+        aciertos (int): ETags servidos sin leer el archivo.
+        calculados (int): Archivos leídos para calcular su hash.
+    """
+
+    def __init__(self, capacidad: int = IMAGE_ETAG_CACHE_SIZE):
+        self.capacidad = max(1, capacidad)
+        self.aciertos = 0
+        self.calculados = 0
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _firma(estado: os.stat_result) -> tuple:
+        return estado.st_mtime_ns, estado.st_size, estado.st_ino
+
+    def buscar(self, ruta: str, estado: os.stat_result) -> Optional[str]:
+        """ETag recordado de un archivo, o None si no se conoce o ha cambiado."""
+        with self._lock:
+            entrada = self._entradas.get(ruta)
+            if entrada is None or entrada[0] != self._firma(estado):
+                return None
+            self._entradas.move_to_end(ruta)
+            self.aciertos += 1
+            return entrada[1]
+
+    def calcular(self, ruta: str, estado: os.stat_result) -> str:
+        """Lee el archivo, calcula su ETag y lo recuerda.
+
+        Args:
+            ruta (str): Archivo.
+            estado (os.stat_result): ``stat`` del archivo al buscarlo.
+
+        Returns:
+            str: ETag (hash SHA-256 del contenido entre comillas).
+        """
+        sha = hashlib.sha256()
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(_BLOQUE_HASH), b""):
+                sha.update(bloque)
+        etag = f'"{sha.hexdigest()}"'
+        with self._lock:
+            self.calculados += 1
+            self._entradas[ruta] = (self._firma(estado), etag)
+            self._entradas.move_to_end(ruta)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+        return etag
+
+    async def etag(self, ruta: str, estado: os.stat_result) -> str:
+        """ETag de un archivo; solo lo lee (en un hilo) si no se conocía."""
+        etag = self.buscar(ruta, estado)
+        if etag is None:
+            etag = await anyio.to_thread.run_sync(self.calcular, ruta, estado)
+        return etag
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entradas), "hits": self.aciertos, "hashed": self.calculados}
+
+
+huellas = HuellasContenido()
+
+
+class RespuestaImagen(FileResponse):
+    """``FileResponse`` que delega el envío en el servidor cuando puede.
+
+    Con la extensión ASGI ``http.response.pathsend`` el servidor envía el archivo
+    por su cuenta (sendfile). Si no, se lee en bloques de ``IMAGE_CHUNK_SIZE``.
+    Las respuestas parciales (``Range``) siguen el camino normal de Starlette.
+    """
+
+    chunk_size = IMAGE_CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._pathsend = "http.response.pathsend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        if send_header_only or not self._pathsend:
+            return await super()._handle_simple(send, send_header_only)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+
+
+def _no_modificado(etag: str, cabeceras: Headers) -> bool:
+    """Indica si ``If-None-Match`` de la petición incluye el ETag."""
+    if_none_match = cabeceras.get("if-none-match")
+    if if_none_match is None:
+        return False
+    etiquetas = [etiqueta.strip().removeprefix("W/") for etiqueta in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
+
+
+async def respuesta_imagen(scope: Scope, ruta, estado: os.stat_result, cache_control: str,
+                           media_type: Optional[str] = None) -> Response:
+    """Respuesta para enviar una imagen con ETag de contenido y ``Cache-Control``.
+
+    Args:
+        scope (Scope): Scope ASGI de la petición.
+        ruta (str | Path): Archivo a enviar.
+        estado (os.stat_result): ``stat`` del archivo.
+        cache_control (str): Valor de ``Cache-Control``.
+        media_type (str | None): Tipo MIME (por defecto según la extensión).
+
+    Returns:
+        Response: 304 sin cuerpo si el cliente ya tiene esa versión; si no, la imagen
+        (completa o el rango pedido).
+    """
+    ruta = os.fspath(ruta)
+    etag = await huellas.etag(ruta, estado)
+    cabeceras = {"etag": etag, "cache-control": cache_control}
+    if _no_modificado(etag, Headers(scope=scope)):
+        return NotModifiedResponse(Headers(cabeceras))
+    return RespuestaImagen(ruta, stat_result=estado, headers=cabeceras, media_type=media_type)
+
+
+class ImagenesEstaticas(StaticFiles):
+    """``StaticFiles`` para la carpeta de imágenes con la política de caché del módulo.
+
+    Args:
+        directory (str): Carpeta de imágenes (``assets/images``).
+        inmutables (frozenset[str]): Subcarpetas cuyas imágenes no cambian nunca.
+    """
+
+    def __init__(self, directory: str, inmutables: frozenset = IMAGE_IMMUTABLE_FOLDERS):
+        super().__init__(directory=directory)
+        self.inmutables = inmutables
+
+    def politica(self, path: str) -> str:
+        """``Cache-Control`` de una ruta relativa a la carpeta de imágenes."""
+        carpeta = Path(path).parts[0] if Path(path).parts else ""
+        return CACHE_INMUTABLE if carpeta in self.inmutables else CACHE_REVALIDAR
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        try:
+            ruta, estado = await anyio.to_thread.run_sync(self.lookup_path, path)
+        except PermissionError:
+            raise HTTPException(status_code=401)
+        except OSError:
+            raise HTTPException(status_code=404)
+        if estado is None or not stat.S_ISREG(estado.st_mode):
+            raise HTTPException(status_code=404)
+        return await respuesta_imagen(scope, ruta, estado, self.politica(path))
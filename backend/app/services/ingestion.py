@@ -0,0 +1,201 @@
+"""Ingesta de las imágenes generadas por ComfyUI en el almacenamiento de la app.
+
+Una imagen terminada se mueve (``os.replace``) a la carpeta destino cuando ambas
+carpetas están en el mismo sistema de archivos; si no, o si se prefiere conservar
+la salida de ComfyUI, se copia en una sola pasada. En ambos casos el hash SHA-256
+y las dimensiones se obtienen durante esa misma lectura, y el archivo solo
+aparece en el destino con su nombre final cuando está completo (se escribe en un
+temporal de la misma carpeta y se renombra).
+
+Para saber si ComfyUI ha terminado de escribir un archivo no se espera a que deje
+de crecer: se comprueba que termina con el marcador de fin de su formato
+(chunk ``IEND`` en PNG, ``FFD9`` en JPEG).
+
+Attributes:
+    COMFY_OUTPUT_MOVE (bool): Mover las salidas de ComfyUI en lugar de copiarlas.
+    TAMANO_BLOQUE (int): Tamaño de los bloques de lectura y escritura.
+"""
+
+import hashlib
+import io
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COMFY_OUTPUT_MOVE = os.getenv("COMFY_OUTPUT_MOVE", "true").lower() in ("1", "true", "yes")
+TAMANO_BLOQUE = 256 * 1024
+
+# Bytes iniciales que se conservan para leer las dimensiones de la cabecera
+_TAMANO_CABECERA = 64 * 1024
+_FIN_PNG = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+_FIN_JPEG = b"\xff\xd9"
+
+
+@dataclass(frozen=True)
+class ImagenIngerida:
+    """Imagen ya guardada en su ubicación final.
+
+    Attributes:
+        ruta (str): Ruta completa del archivo.
+        nombre (str): Nombre del archivo.
+        sha256 (str): Hash del contenido.
+        tamano (int): Tamaño en bytes.
+        ancho (int | None): Ancho en píxeles (None si no se pudo leer).
+        alto (int | None): Alto en píxeles (None si no se pudo leer).
+    """
+    ruta: str
+    nombre: str
+    sha256: str
+    tamano: int
+    ancho: Optional[int] = None
+    alto: Optional[int] = None
+
+    def metadatos(self) -> dict:
+        """Datos de la imagen para incluir en la respuesta de una generación."""
+        return {"sha256": self.sha256, "width": self.ancho, "height": self.alto}
+
+
+def imagen_completa(ruta: str) -> bool:
+    """Indica si un PNG o JPEG está escrito por completo.
+
+    Args:
+        ruta (str): Archivo a comprobar.
+
+    Returns:
+        bool: True si el archivo termina con el marcador de fin de su formato.
+    """
+    try:
+        with open(ruta, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            tamano = f.tell()
+            if tamano < len(_FIN_PNG):
+                return False
+            f.seek(tamano - len(_FIN_PNG))
+            cola = f.read()
+    except OSError:
+        return False
+    if cola.endswith(_FIN_PNG):
+        return True
+    return cola.endswith(_FIN_JPEG) and str(ruta).lower().endswith((".jpg", ".jpeg"))
+
+
+def _dimensiones(cabecera: bytes, ruta: str) -> Tuple[Optional[int], Optional[int]]:
+    """Lee las dimensiones de la cabecera ya leída (o del archivo si no basta)."""
+    for fuente in (io.BytesIO(cabecera), ruta):
+        try:
+            with Image.open(fuente) as img:
+                return img.size
+        except (OSError, SyntaxError, ValueError):
+            continue
+    return None, None
+
+
+class EscritorAtomico:
+    """Escribe un archivo por bloques calculando su hash y lo publica al cerrar.
+
+    Los bloques se escriben en un temporal oculto de la carpeta destino, que se
+    renombra a ``destino`` en ``cerrar``; si se descarta, el temporal se borra.
+
+    Args:
+        destino (Path): Ruta final del archivo.
+    """
+
+    def __init__(self, destino: Path):
+        self.destino = Path(destino)
+        os.makedirs(self.destino.parent, exist_ok=True)
+        self.temporal = self.destino.with_name(f".{self.destino.name}.{uuid.uuid4().hex}.part")
+        self._archivo = open(self.temporal, "wb")
+        self._sha = hashlib.sha256()
+        self._cabecera = bytearray()
+        self._tamano = 0
+
+    def write(self, bloque: bytes):
+        self._archivo.write(bloque)
+        self._sha.update(bloque)
+        self._tamano += len(bloque)
+        if len(self._cabecera) < _TAMANO_CABECERA:
+            self._cabecera += bloque[:_TAMANO_CABECERA - len(self._cabecera)]
+
+    def cerrar(self) -> ImagenIngerida:
+        """Publica el archivo con su nombre final.
+
+        Returns:
+            ImagenIngerida: Imagen guardada con su hash y dimensiones.
+        """
+        self._archivo.close()
+        ancho, alto = _dimensiones(bytes(self._cabecera), str(self.temporal))
+        os.replace(self.temporal, self.destino)
+        return ImagenIngerida(str(self.destino), self.destino.name, self._sha.hexdigest(), self._tamano, ancho, alto)
+
+    def descartar(self):
+        """Cierra y borra el temporal sin publicar nada."""
+        self._archivo.close()
+        try:
+            os.unlink(self.temporal)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.descartar()
+
+
+def _analizar(ruta: Path) -> ImagenIngerida:
+    """Calcula hash y dimensiones de un archivo ya en su sitio leyéndolo una vez."""
+    sha = hashlib.sha256()
+    cabecera = b""
+    tamano = 0
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            if not cabecera:
+                cabecera = bloque[:_TAMANO_CABECERA]
+            sha.update(bloque)
+            tamano += len(bloque)
+    ancho, alto = _dimensiones(cabecera, str(ruta))
+    return ImagenIngerida(str(ruta), ruta.name, sha.hexdigest(), tamano, ancho, alto)
+
+
+def ingerir(origen: str, carpeta_destino: Path, mover: bool = COMFY_OUTPUT_MOVE) -> ImagenIngerida:
+    """Lleva una imagen terminada de ComfyUI a la carpeta destino.
+
+    Args:
+        origen (str): Archivo generado por ComfyUI.
+        carpeta_destino (Path): Carpeta de almacenamiento de la app.
+        mover (bool): Si se mueve el archivo (rename) en lugar de copiarlo.
+
+    Returns:
+        ImagenIngerida: Imagen guardada con su hash y dimensiones.
+
+    Raises:
+        OSError: Si no se puede leer el origen o escribir el destino.
+    """
+    origen = Path(origen)
+    destino = Path(carpeta_destino) / origen.name
+    os.makedirs(str(carpeta_destino), exist_ok=True)
+
+    if mover:
+        try:
+            os.replace(origen, destino)
+            print(f"Imagen movida a: {destino}")
+            return _analizar(destino)
+        except OSError as e:
+            # Distinto sistema de archivos (EXDEV): se copia en una pasada
+            print(f"No se puede mover {origen.name}, se copiará: {e}")
+
+    with EscritorAtomico(destino) as escritor, open(origen, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            escritor.write(bloque)
+        imagen = escritor.cerrar()
+    if mover:
+        os.unlink(origen)
+    print(f"Imagen copiada a: {destino}")
+    return imagen
@@ -0,0 +1,653 @@
+"""Cola de trabajos de generación de imágenes.
+
+Las generaciones con ComfyUI (txt2img, boceto, múltiples imágenes) pueden tardar
+varios minutos. En lugar de ejecutarlas dentro del endpoint, se encolan como
+trabajos y un pool de hilos trabajadores las ejecuta en segundo plano. El cliente
+recibe el identificador del trabajo al instante y consulta su estado con
+``GET /comfy/jobs/{id}`` o recibe las actualizaciones por WebSocket.
+
+Los trabajos no se atienden por orden de llegada sino con ``ColaJusta``: primero
+los de pacientes en una sesión de terapia activa y después los de práctica libre;
+dentro de cada nivel se alterna entre usuarios (turno rotatorio) y ningún usuario
+puede tener más de ``COMFY_MAX_JOBS_PER_USER`` trabajos en ejecución a la vez.
+Así un paciente que encola muchas generaciones no retrasa al resto.
+
+Cambiar de modelo en ComfyUI (checkpoint, ControlNet, IPAdapter...) obliga a
+recargarlo en la GPU. Por eso, dentro de un nivel, si el usuario al que le toca
+pide otros modelos que los del último trabajo entregado y otro usuario en espera
+pide los mismos, se adelanta a este. Un trabajo solo puede ser adelantado
+``COMFY_AFFINITY_WINDOW`` veces; después se atiende aunque suponga cambiar de
+modelo, así que la espera extra de cada usuario está acotada.
+
+Las peticiones repetidas no generan trabajo duplicado: si llega una petición
+idéntica (mismo usuario y misma huella de la petición) mientras otra sigue en cola
+o en ejecución, se devuelve el trabajo existente. Con la cabecera
+``Idempotency-Key`` el cliente controla explícitamente la deduplicación: la misma
+clave devuelve siempre el mismo trabajo mientras se conserve, aunque ya haya
+terminado, y claves distintas crean trabajos distintos.
+
+Un trabajo en cola o en ejecución se puede cancelar (``JobManager.cancelar``):
+si aún no ha empezado sale de la cola; si ya se está ejecutando, su
+``cancellation.Cancelacion`` retira el prompt de ComfyUI y libera la espera, de
+modo que el trabajador pasa enseguida al siguiente. Se cancela a petición del
+paciente, al finalizar la sesión del trabajo y cuando el paciente se desconecta
+del WebSocket de la sesión durante más de ``JOB_DISCONNECT_GRACE_SECONDS``.
+
+Mientras se ejecuta un trabajo de una sesión, su progreso (paso de muestreo y
+vistas previas, ver ``progress``) se publica a los oyentes registrados con
+``JobManager.subscribe_progress``.
+
+Attributes:
+    COMFY_WORKERS (int): Número de hilos trabajadores (variable de entorno COMFY_WORKERS).
+    JOB_RETENTION_SECONDS (int): Segundos que se conservan en memoria los trabajos terminados.
+    COMFY_MAX_JOBS_PER_USER (int): Trabajos en ejecución simultáneos por usuario (0 = sin límite).
+    COMFY_AFFINITY_WINDOW (int): Veces que un trabajo puede ser adelantado por otro que
+        reutiliza los modelos cargados (0 = sin agrupar por modelo).
+    JOB_LATENCY_SAMPLES (int): Trabajos terminados por tipo con los que se calculan las latencias.
+    JOB_DISCONNECT_GRACE_SECONDS (float): Segundos que se espera a que el paciente vuelva a
+        conectarse a la sesión antes de cancelar sus trabajos (0 = no cancelar al desconectar).
+    PRIORIDAD_SESION (int): Prioridad de los trabajos de una sesión activa.
+    PRIORIDAD_LIBRE (int): Prioridad de los trabajos sin sesión.
+    manager (JobManager): Gestor global de trabajos de la aplicación.
+"""
+
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from app.database import SessionLocal
+from app.schemas import JobStatus
+from . import progress
+from .cancellation import Cancelacion, activa
+
+load_dotenv()
+
+COMFY_WORKERS = int(os.getenv("COMFY_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+COMFY_MAX_JOBS_PER_USER = int(os.getenv("COMFY_MAX_JOBS_PER_USER", "1"))
+COMFY_AFFINITY_WINDOW = int(os.getenv("COMFY_AFFINITY_WINDOW", "3"))
+JOB_LATENCY_SAMPLES = int(os.getenv("JOB_LATENCY_SAMPLES", "500"))
+JOB_DISCONNECT_GRACE_SECONDS = float(os.getenv("JOB_DISCONNECT_GRACE_SECONDS", "30"))
+
+PRIORIDAD_SESION = 0
+PRIORIDAD_LIBRE = 1
+NOMBRES_PRIORIDAD = {PRIORIDAD_SESION: "session", PRIORIDAD_LIBRE: "free"}
+
+
+@dataclass
+class GenerationJob:
+    """Trabajo de generación encolado.
+
+    Attributes:
+        id (str): Identificador único del trabajo.
+        kind (str): Tipo de generación ("txt2img", "sketch2img", "multimg").
+        user_id (int): ID del paciente propietario.
+        session_id (int | None): ID de la sesión asociada.
+        task (Callable[[Session], dict]): Función que ejecuta la generación. Recibe
+            una sesión de base de datos propia del trabajador y devuelve el resultado.
+        status (JobStatus): Estado actual.
+        result (dict | list[dict] | None): Resultado devuelto por ``task`` (una lista en los lotes).
+        error (str | None): Detalle del error si falló.
+        status_code (int | None): Código HTTP equivalente al error.
+        huella (str | None): Hash canónico de la petición, para agrupar duplicados.
+        idempotency_key (str | None): Clave de idempotencia enviada por el cliente.
+        prioridad (int): ``PRIORIDAD_SESION`` o ``PRIORIDAD_LIBRE``.
+        modelos (frozenset[str]): Modelos que carga su workflow.
+        adelantado (int): Veces que otro trabajo pasó antes por afinidad de modelo.
+        cancelacion (Cancelacion): Señal para cancelar el trabajo.
+    """
+    id: str
+    kind: str
+    user_id: int
+    session_id: Optional[int]
+    task: Callable[[Session], dict]
+    status: JobStatus = JobStatus.queued
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[Union[dict, List[dict]]] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    huella: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    prioridad: int = PRIORIDAD_LIBRE
+    modelos: FrozenSet[str] = frozenset()
+    adelantado: int = 0
+    cancelacion: Cancelacion = field(default_factory=Cancelacion, repr=False)
+    finished: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self, posicion: Optional[int] = None) -> dict:
+        """Serializa el trabajo con el formato de ``schemas.GenerationJob``.
+
+        Args:
+            posicion (int, optional): Posición estimada en la cola (1 = el siguiente).
+
+        Returns:
+            dict: Estado del trabajo listo para devolver o enviar por WebSocket.
+        """
+        if isinstance(self.result, list):
+            results = [dict(r) for r in self.result]
+        else:
+            results = [dict(self.result)] if self.result else []
+        images = [r.pop("image") for r in results if r.get("image")]
+        result = results[0] if results else None
+        image = images[0] if images else None
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status.value,
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "priority": NOMBRES_PRIORIDAD[self.prioridad],
+            "queue_position": posicion,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": result,
+            "image": image,
+            "results": results,
+            "images": images,
+            "error": self.error,
+            "status_code": self.status_code,
+        }
+
+
+class ColaJusta:
+    """Cola de trabajos por prioridad con turno rotatorio entre usuarios.
+
+    ``siguiente`` entrega el primer trabajo del nivel de prioridad más alto que
+    tenga alguno disponible; dentro de un nivel, los usuarios se van turnando (el
+    usuario atendido pasa al final) y se saltan los que ya tienen el máximo de
+    trabajos en ejecución. Entre los usuarios disponibles se prefiere el primero
+    cuyo trabajo usa los mismos modelos que el último entregado, salvo que el
+    trabajo del usuario al que le toca ya haya sido adelantado ``ventana`` veces.
+
+    Args:
+        max_por_usuario (int): Trabajos en ejecución simultáneos por usuario (0 = sin límite).
+        ventana (int): Veces que un trabajo puede ser adelantado por afinidad de modelo (0 = nunca).
+
+    Attributes:
+        cambios_modelo (int): Trabajos entregados con modelos distintos a los del anterior.
+        por_afinidad (int): Trabajos entregados antes de su turno por reutilizar los modelos.
+    """
+
+    def __init__(self, max_por_usuario: int = COMFY_MAX_JOBS_PER_USER, ventana: int = COMFY_AFFINITY_WINDOW):
+        self.max_por_usuario = max(0, max_por_usuario)
+        self.ventana = max(0, ventana)
+        self.cambios_modelo = 0
+        self.por_afinidad = 0
+        self._modelos: Optional[FrozenSet[str]] = None
+        self._niveles: Dict[int, "OrderedDict[int, deque]"] = {p: OrderedDict() for p in NOMBRES_PRIORIDAD}
+        self._en_curso: Dict[int, int] = {}
+        self._paradas = 0
+        self._cond = threading.Condition()
+
+    def poner(self, job: GenerationJob):
+        """Añade un trabajo al final de la cola de su usuario."""
+        with self._cond:
+            self._niveles[job.prioridad].setdefault(job.user_id, deque()).append(job)
+            self._cond.notify()
+
+    def siguiente(self) -> Optional[GenerationJob]:
+        """Espera y extrae el siguiente trabajo que se puede ejecutar.
+
+        Returns:
+            GenerationJob | None: Trabajo a ejecutar, o None si se pidió detener al trabajador.
+        """
+        with self._cond:
+            while True:
+                if self._paradas:
+                    self._paradas -= 1
+                    return None
+                job = self._extraer()
+                if job is not None:
+                    self._en_curso[job.user_id] = self._en_curso.get(job.user_id, 0) + 1
+                    return job
+                self._cond.wait()
+
+    def _extraer(self) -> Optional[GenerationJob]:
+        for usuarios in self._niveles.values():
+            disponibles = [
+                user_id for user_id in usuarios
+                if not self.max_por_usuario or self._en_curso.get(user_id, 0) < self.max_por_usuario
+            ]
+            if not disponibles:
+                continue
+            elegido = self._elegir_por_modelo([usuarios[u][0] for u in disponibles])
+            for user_id in disponibles[:elegido]:
+                usuarios[user_id][0].adelantado += 1
+            user_id = disponibles[elegido]
+            trabajos = usuarios[user_id]
+            job = trabajos.popleft()
+            if trabajos:
+                usuarios.move_to_end(user_id)
+            else:
+                del usuarios[user_id]
+            if job.modelos != self._modelos:
+                if self._modelos is not None:
+                    self.cambios_modelo += 1
+                self._modelos = job.modelos
+            return job
+        return None
+
+    def _elegir_por_modelo(self, candidatos: List[GenerationJob]) -> int:
+        """Índice del trabajo a entregar entre los primeros de cada usuario, por turno."""
+        primero = candidatos[0]
+        if not self.ventana or primero.modelos == self._modelos or primero.adelantado >= self.ventana:
+            return 0
+        for indice, job in enumerate(candidatos[1:], start=1):
+            if job.modelos == self._modelos:
+                self.por_afinidad += 1
+                return indice
+        return 0
+
+    def quitar(self, job: GenerationJob) -> bool:
+        """Saca un trabajo de la cola.
+
+        Returns:
+            bool: False si ya no estaba en cola (un trabajador lo ha extraído).
+        """
+        with self._cond:
+            usuarios = self._niveles[job.prioridad]
+            trabajos = usuarios.get(job.user_id)
+            if not trabajos or job not in trabajos:
+                return False
+            trabajos.remove(job)
+            if not trabajos:
+                del usuarios[job.user_id]
+            return True
+
+    def terminar(self, job: GenerationJob):
+        """Libera el hueco de ejecución del usuario de un trabajo terminado."""
+        with self._cond:
+            restantes = self._en_curso.get(job.user_id, 0) - 1
+            if restantes > 0:
+                self._en_curso[job.user_id] = restantes
+            else:
+                self._en_curso.pop(job.user_id, None)
+            self._cond.notify_all()
+
+    def detener(self, trabajadores: int):
+        """Hace que ``siguiente`` devuelva None a ese número de trabajadores."""
+        with self._cond:
+            self._paradas += trabajadores
+            self._cond.notify_all()
+
+    def posicion(self, job: GenerationJob) -> Optional[int]:
+        """Posición estimada de un trabajo en la cola.
+
+        Se simula el reparto por niveles y turnos sin tener en cuenta el límite
+        por usuario, que solo puede retrasar trabajos de usuarios con otros en
+        ejecución, ni la afinidad de modelo, que retrasa cada trabajo como mucho
+        ``ventana`` puestos.
+
+        Returns:
+            int | None: 1 para el siguiente trabajo, o None si no está en cola.
+        """
+        with self._cond:
+            posicion = 0
+            for usuarios in self._niveles.values():
+                colas = list(usuarios.values())
+                ronda = 0
+                while colas:
+                    for trabajos in colas:
+                        posicion += 1
+                        if trabajos[ronda] is job:
+                            return posicion
+                    ronda += 1
+                    colas = [trabajos for trabajos in colas if len(trabajos) > ronda]
+            return None
+
+    def metricas(self) -> dict:
+        """Trabajos en cola por prioridad, usuarios esperando, trabajos en ejecución
+        por usuario y cambios de modelo evitados y producidos."""
+        with self._cond:
+            return {
+                "queued_by_priority": {
+                    NOMBRES_PRIORIDAD[p]: sum(len(t) for t in usuarios.values())
+                    for p, usuarios in self._niveles.items()
+                },
+                "waiting_users": len({u for usuarios in self._niveles.values() for u in usuarios}),
+                "running_by_user": dict(self._en_curso),
+                "max_per_user": self.max_por_usuario,
+                "affinity_window": self.ventana,
+                "affinity_picks": self.por_afinidad,
+                "model_switches": self.cambios_modelo,
+            }
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    """Percentil por el método del rango más cercano de una lista ordenada."""
+    return valores[min(len(valores) - 1, max(0, int(round(p * len(valores))) - 1))]
+
+
+def _resumir_latencias(muestras: List[Tuple[float, float]]) -> dict:
+    """Resume las esperas en cola y las ejecuciones (segundos) en milisegundos."""
+    esperas = sorted(e for e, _ in muestras)
+    totales = sorted(e + r for e, r in muestras)
+    return {
+        "count": len(muestras),
+        "wait_ms_avg": round(1000 * sum(esperas) / len(esperas), 1),
+        "wait_ms_p95": round(1000 * _percentil(esperas, 0.95), 1),
+        "run_ms_avg": round(1000 * sum(r for _, r in muestras) / len(muestras), 1),
+        "total_ms_p50": round(1000 * _percentil(totales, 0.5), 1),
+        "total_ms_p95": round(1000 * _percentil(totales, 0.95), 1),
+    }
+
+
+class JobManager:
+    """Gestor de la cola de trabajos y del pool de trabajadores.
+
+    Los trabajadores se arrancan en el startup de la aplicación o, como muy tarde,
+    al encolar el primer trabajo.
+
+    Attributes:
+        workers (int): Número de hilos trabajadores.
+        agrupados (int): Peticiones resueltas con un trabajo ya existente.
+    """
+
+    def __init__(self, workers: int = COMFY_WORKERS, cola: Optional[ColaJusta] = None):
+        self.workers = max(1, workers)
+        self.agrupados = 0
+        self._jobs: Dict[str, GenerationJob] = {}
+        self._en_vuelo: Dict[Tuple[int, str], GenerationJob] = {}
+        self._idempotentes: Dict[Tuple[int, str], GenerationJob] = {}
+        self._latencias: Dict[str, deque] = {}
+        self._cola = cola or ColaJusta()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[dict], Awaitable[Any]]] = []
+        self._progress_listeners: List[Callable[[dict], Awaitable[Any]]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Arranca los hilos trabajadores si no estaban en marcha.
+
+        Args:
+            loop (AbstractEventLoop, optional): Event loop de la aplicación, usado
+                para enviar las notificaciones WebSocket.
+        """
+        if loop is not None:
+            self._loop = loop
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker_loop, name=f"comfy-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        """Detiene los trabajadores tras terminar el trabajo en curso."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._cola.detener(len(threads))
+        for t in threads:
+            t.join(timeout=5)
+
+    def subscribe(self, listener: Callable[[dict], Awaitable[Any]]):
+        """Registra una corrutina que recibe cada cambio de estado de un trabajo.
+
+        Args:
+            listener (Callable[[dict], Awaitable]): Corrutina que recibe ``GenerationJob.to_dict()``.
+        """
+        self._listeners.append(listener)
+
+    def subscribe_progress(self, listener: Callable[[dict], Awaitable[Any]]):
+        """Registra una corrutina que recibe el progreso de los trabajos de sesión en curso.
+
+        Args:
+            listener (Callable[[dict], Awaitable]): Corrutina que recibe ``{"job_id",
+                "user_id", "session_id", "kind"}`` junto con ``{"step", "steps", "node"}``
+                o ``{"preview"}`` (data URL de la vista previa).
+        """
+        self._progress_listeners.append(listener)
+
+    def submit(self, kind: str, user_id: int, session_id: Optional[int], task: Callable[[Session], dict],
+               huella: Optional[str] = None, idempotency_key: Optional[str] = None,
+               prioridad: int = PRIORIDAD_LIBRE, modelos: FrozenSet[str] = frozenset()) -> GenerationJob:
+        """Encola un trabajo de generación o devuelve el trabajo equivalente ya existente.
+
+        Args:
+            kind (str): Tipo de generación.
+            user_id (int): ID del paciente propietario.
+            session_id (int | None): ID de la sesión asociada.
+            task (Callable[[Session], dict]): Función que realiza la generación.
+            huella (str, optional): Hash canónico de la petición. Una petición con la
+                misma huella y el mismo usuario que otra en cola o en ejecución se une a ella.
+            idempotency_key (str, optional): Clave de idempotencia del cliente. Si se
+                indica, sustituye a la agrupación por huella.
+            prioridad (int): ``PRIORIDAD_SESION`` para trabajos de una sesión activa.
+            modelos (frozenset[str]): Modelos que carga el workflow, para agrupar
+                trabajos que los comparten.
+
+        Returns:
+            GenerationJob: Trabajo encolado (estado "queued") o el trabajo existente.
+
+        Raises:
+            HTTPException: 422 si la clave de idempotencia ya se usó con otra petición.
+        """
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        self.start()
+        self._purge()
+
+        with self._lock:
+            existente = self._buscar_equivalente(user_id, huella, idempotency_key)
+            if existente is not None:
+                self.agrupados += 1
+                return existente
+            job = GenerationJob(id=uuid.uuid4().hex, kind=kind, user_id=user_id, session_id=session_id, task=task,
+                                huella=huella, idempotency_key=idempotency_key, prioridad=prioridad,
+                                modelos=modelos)
+            self._jobs[job.id] = job
+            if idempotency_key:
+                self._idempotentes[(user_id, idempotency_key)] = job
+            elif huella:
+                self._en_vuelo[(user_id, huella)] = job
+        self._cola.poner(job)
+        self._notify(job)
+        return job
+
+    def _buscar_equivalente(self, user_id: int, huella: Optional[str], idempotency_key: Optional[str]) -> Optional[GenerationJob]:
+        """Trabajo que ya atiende esta petición (con ``_lock`` adquirido)."""
+        if idempotency_key:
+            job = self._idempotentes.get((user_id, idempotency_key))
+            if job is not None and job.huella != huella:
+                raise HTTPException(status_code=422, detail="La clave de idempotencia ya se usó con otra petición")
+            return job
+        if huella:
+            return self._en_vuelo.get((user_id, huella))
+        return None
+
+    def cancelar(self, job: GenerationJob, motivo: str) -> bool:
+        """Cancela un trabajo en cola o en ejecución.
+
+        Un trabajo en cola sale de ella y termina en el acto; uno en ejecución
+        retira su prompt de ComfyUI y el trabajador lo da por cancelado al volver.
+        Las acciones de cancelación se ejecutan en este hilo, que se bloquea
+        mientras ComfyUI responde.
+
+        Args:
+            job (GenerationJob): Trabajo a cancelar.
+            motivo (str): Motivo que queda en el error del trabajo.
+
+        Returns:
+            bool: False si el trabajo ya había terminado o estaba cancelado.
+        """
+        if job.status not in (JobStatus.queued, JobStatus.running) or not job.cancelacion.cancelar(motivo):
+            return False
+        print(f"Cancelando el trabajo {job.id}: {motivo}")
+        if self._cola.quitar(job):
+            job.status = JobStatus.cancelled
+            job.status_code = 409
+            job.error = f"Generación cancelada: {motivo}"
+            self._finalizar(job)
+        return True
+
+    def cancelar_sesion(self, session_id: int, motivo: str, user_id: Optional[int] = None) -> int:
+        """Cancela los trabajos pendientes de una sesión.
+
+        Args:
+            session_id (int): ID de la sesión.
+            motivo (str): Motivo que queda en el error de cada trabajo.
+            user_id (int, optional): Cancelar solo los de este usuario.
+
+        Returns:
+            int: Trabajos cancelados.
+        """
+        with self._lock:
+            pendientes = [
+                job for job in self._jobs.values()
+                if job.session_id == session_id and (user_id is None or job.user_id == user_id)
+                and job.status in (JobStatus.queued, JobStatus.running)
+            ]
+        return sum(self.cancelar(job, motivo) for job in pendientes)
+
+    def describir(self, job: GenerationJob) -> dict:
+        """Serializa un trabajo incluyendo su posición en la cola.
+
+        Args:
+            job (GenerationJob): Trabajo.
+
+        Returns:
+            dict: ``GenerationJob.to_dict`` con ``queue_position`` si está en cola.
+        """
+        posicion = self._cola.posicion(job) if job.status == JobStatus.queued else None
+        return job.to_dict(posicion=posicion)
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        """Obtiene un trabajo por ID.
+
+        Args:
+            job_id (str): ID del trabajo.
+
+        Returns:
+            GenerationJob | None: Trabajo si existe (y no ha sido purgado).
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def metricas(self) -> dict:
+        """Estado de la cola de trabajos.
+
+        Returns:
+            dict: Trabajadores, trabajos en cola, en ejecución, cancelados y conservados,
+            peticiones agrupadas con un trabajo existente, reparto de la cola
+            por prioridad y usuario, cambios de modelo y latencias por tipo de trabajo.
+        """
+        with self._lock:
+            estados = [job.status for job in self._jobs.values()]
+            latencias = {kind: _resumir_latencias(list(muestras)) for kind, muestras in self._latencias.items()}
+            return {
+                "workers": self.workers,
+                "queued": estados.count(JobStatus.queued),
+                "running": estados.count(JobStatus.running),
+                "cancelled": estados.count(JobStatus.cancelled),
+                "retained": len(estados),
+                "coalesced": self.agrupados,
+                **self._cola.metricas(),
+                "latency_by_kind": latencias,
+            }
+
+    def _worker_loop(self):
+        while True:
+            job = self._cola.siguiente()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            finally:
+                self._cola.terminar(job)
+
+    def _run(self, job: GenerationJob):
+        job.status = JobStatus.running
+        job.started_at = datetime.utcnow()
+        self._notify(job)
+
+        db = SessionLocal()
+        try:
+            with activa(job.cancelacion), progress.activo(self._progreso(job)):
+                # Cancelado entre salir de la cola y empezar
+                job.cancelacion.comprobar()
+                job.result = job.task(db)
+            job.status = JobStatus.done
+        except HTTPException as e:
+            db.rollback()
+            job.status = JobStatus.failed
+            job.status_code = e.status_code
+            job.error = str(e.detail)
+        except Exception as e:
+            db.rollback()
+            job.status = JobStatus.failed
+            job.status_code = 500
+            job.error = f"Error al generar imagen: {str(e)}"
+        finally:
+            db.close()
+
+        if job.status == JobStatus.failed and job.cancelacion.cancelada:
+            # Un timeout o error de ComfyUI provocado por la propia cancelación
+            job.status = JobStatus.cancelled
+            job.status_code = 409
+            job.error = f"Generación cancelada: {job.cancelacion.motivo}"
+        self._finalizar(job)
+
+    def _finalizar(self, job: GenerationJob):
+        """Marca el fin de un trabajo, registra su latencia y lo notifica."""
+        job.finished_at = datetime.utcnow()
+        with self._lock:
+            if job.huella and not job.idempotency_key and self._en_vuelo.get((job.user_id, job.huella)) is job:
+                del self._en_vuelo[(job.user_id, job.huella)]
+            if job.started_at is not None:
+                self._latencias.setdefault(job.kind, deque(maxlen=max(1, JOB_LATENCY_SAMPLES))).append((
+                    (job.started_at - job.created_at).total_seconds(),
+                    (job.finished_at - job.started_at).total_seconds(),
+                ))
+        job.finished.set()
+        self._notify(job)
+
+    def _progreso(self, job: GenerationJob) -> Optional[progress.Progreso]:
+        """Progreso a publicar para un trabajo (solo los de sesión y si hay oyentes)."""
+        if job.session_id is None or not self._progress_listeners:
+            return None
+        cabecera = {"job_id": job.id, "user_id": job.user_id, "session_id": job.session_id, "kind": job.kind}
+        return progress.Progreso(lambda mensaje: self._emitir(self._progress_listeners, {**cabecera, **mensaje}))
+
+    def _emitir(self, listeners: List[Callable[[dict], Awaitable[Any]]], data: dict):
+        """Programa la entrega de ``data`` a cada oyente en el event loop de la aplicación."""
+        loop = self._loop
+        if not listeners or loop is None or loop.is_closed():
+            return
+        for listener in listeners:
+            try:
+                asyncio.run_coroutine_threadsafe(listener(data), loop)
+            except RuntimeError as e:
+                print(f"No se pudo notificar el trabajo {data.get('id', data.get('job_id'))}: {e}")
+
+    def _notify(self, job: GenerationJob):
+        if self._listeners:
+            self._emitir(self._listeners, job.to_dict())
+
+    def _purge(self):
+        limit = datetime.utcnow() - timedelta(seconds=JOB_RETENTION_SECONDS)
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < limit
+            ]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                if job.idempotency_key:
+                    self._idempotentes.pop((job.user_id, job.idempotency_key), None)
+
+
+manager = JobManager()
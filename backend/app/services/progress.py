@@ -0,0 +1,202 @@
+"""Progreso y vistas previas de las generaciones en curso.
+
+ComfyUI informa por su WebSocket del paso de muestreo en el que va cada nodo
+(evento ``progress``) y, si se arranca con ``--preview-method``, envía en frames
+binarios una vista previa del latente. Mientras un trabajo se ejecuta, su
+``Progreso`` queda activo en el hilo del trabajador (``activo``) y el cliente de
+ComfyUI le pasa esos eventos.
+
+Para no inundar a los clientes lentos, ``Progreso`` limita la frecuencia: como
+mucho un mensaje de paso cada ``GENERATION_PROGRESS_INTERVAL`` segundos (el
+último paso siempre se envía) y una vista previa cada
+``GENERATION_PREVIEW_INTERVAL`` segundos, reducida a ``GENERATION_PREVIEW_SIZE``
+píxeles de lado y recodificada en WebP o JPEG.
+
+Attributes:
+    GENERATION_PROGRESS_INTERVAL (float): Segundos mínimos entre mensajes de paso.
+    GENERATION_PREVIEW_INTERVAL (float): Segundos mínimos entre vistas previas.
+    GENERATION_PREVIEW_SIZE (int): Lado máximo de la vista previa en píxeles (0 = sin vistas previas).
+    GENERATION_PREVIEW_FORMAT (str): "webp" o "jpeg" (WebP solo si Pillow lo soporta).
+    GENERATION_PREVIEW_QUALITY (int): Calidad de compresión de la vista previa (1-100).
+"""
+
+import base64
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+from PIL import Image, features
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GENERATION_PROGRESS_INTERVAL = float(os.getenv("GENERATION_PROGRESS_INTERVAL", "0.5"))
+GENERATION_PREVIEW_INTERVAL = float(os.getenv("GENERATION_PREVIEW_INTERVAL", "1.5"))
+GENERATION_PREVIEW_SIZE = int(os.getenv("GENERATION_PREVIEW_SIZE", "256"))
+GENERATION_PREVIEW_FORMAT = os.getenv("GENERATION_PREVIEW_FORMAT", "webp").lower()
+GENERATION_PREVIEW_QUALITY = int(os.getenv("GENERATION_PREVIEW_QUALITY", "60"))
+
+# Tipos de frame binario del WebSocket de ComfyUI
+_FRAME_VISTA_PREVIA = 1
+_FRAME_VISTA_PREVIA_CON_METADATOS = 4
+
+
+def imagen_de_frame(frame: bytes) -> Optional[bytes]:
+    """Extrae la imagen de un frame binario de vista previa de ComfyUI.
+
+    Args:
+        frame (bytes): Frame recibido por el WebSocket de ComfyUI.
+
+    Returns:
+        bytes | None: Imagen codificada (JPEG o PNG), o None si el frame no es una vista previa.
+    """
+    if len(frame) < 8:
+        return None
+    tipo = int.from_bytes(frame[:4], "big")
+    if tipo == _FRAME_VISTA_PREVIA:
+        # 4 bytes de tipo de evento + 4 de formato de imagen
+        return frame[8:]
+    if tipo == _FRAME_VISTA_PREVIA_CON_METADATOS:
+        longitud = int.from_bytes(frame[4:8], "big")
+        return frame[8 + longitud:]
+    return None
+
+
+def reducir_vista_previa(datos: bytes, tamano: int = GENERATION_PREVIEW_SIZE, formato: str = GENERATION_PREVIEW_FORMAT,
+                         calidad: int = GENERATION_PREVIEW_QUALITY) -> str:
+    """Reduce y recodifica una vista previa.
+
+    Args:
+        datos (bytes): Imagen de ComfyUI.
+        tamano (int): Lado máximo en píxeles.
+        formato (str): "webp" o "jpeg".
+        calidad (int): Calidad de compresión.
+
+    Returns:
+        str: Data URL (``data:image/...;base64,...``) lista para un ``<img>``.
+
+    Raises:
+        OSError: Si los datos no son una imagen válida.
+    """
+    if formato == "webp" and not features.check("webp"):
+        formato = "jpeg"
+    with Image.open(io.BytesIO(datos)) as imagen:
+        imagen = imagen.convert("RGB")
+        imagen.thumbnail((tamano, tamano))
+        salida = io.BytesIO()
+        imagen.save(salida, format=formato.upper(), quality=calidad)
+    return f"data:image/{formato};base64,{base64.b64encode(salida.getvalue()).decode('ascii')}"
+
+
+class Progreso:
+    """Reenvía con frecuencia limitada el progreso de un trabajo.
+
+    Args:
+        publicar (Callable[[dict], None]): Recibe cada mensaje: ``{"step", "steps", "node"}``
+            o ``{"preview"}`` con la vista previa como data URL.
+        intervalo (float): Segundos mínimos entre mensajes de paso.
+        intervalo_vista (float): Segundos mínimos entre vistas previas.
+        tamano (int): Lado máximo de la vista previa (0 = no enviarlas).
+
+    Attributes:
+        enviados (int): Mensajes publicados.
+        descartados (int): Eventos omitidos por la limitación de frecuencia.
+    """
+
+    def __init__(self, publicar: Callable[[dict], None], intervalo: float = GENERATION_PROGRESS_INTERVAL,
+                 intervalo_vista: float = GENERATION_PREVIEW_INTERVAL, tamano: int = GENERATION_PREVIEW_SIZE):
+        self.publicar = publicar
+        self.intervalo = intervalo
+        self.intervalo_vista = intervalo_vista
+        self.tamano = max(0, tamano)
+        self.enviados = 0
+        self.descartados = 0
+        self._ultimo_paso = float("-inf")
+        self._ultima_vista = float("-inf")
+        self._lock = threading.Lock()
+
+    def evento(self, mensaje: dict, prompt_id: str):
+        """Atiende un evento JSON del WebSocket de ComfyUI si es de progreso de ``prompt_id``."""
+        datos = mensaje.get("data") or {}
+        if mensaje.get("type") == "progress" and datos.get("prompt_id") in (None, prompt_id):
+            self.paso(datos.get("value", 0), datos.get("max", 0), datos.get("node"))
+
+    def paso(self, valor: int, maximo: int, nodo: Optional[str] = None):
+        """Publica el paso actual si ha pasado el intervalo o es el último."""
+        ahora = time.monotonic()
+        with self._lock:
+            if valor < maximo and ahora - self._ultimo_paso < self.intervalo:
+                self.descartados += 1
+                return
+            self._ultimo_paso = ahora
+        self._enviar({"step": valor, "steps": maximo, "node": nodo})
+
+    def frame(self, frame: bytes):
+        """Publica una vista previa reducida a partir de un frame binario de ComfyUI."""
+        if not self.tamano:
+            return
+        datos = imagen_de_frame(frame)
+        if datos is None:
+            return
+        ahora = time.monotonic()
+        with self._lock:
+            if ahora - self._ultima_vista < self.intervalo_vista:
+                self.descartados += 1
+                return
+            self._ultima_vista = ahora
+        try:
+            vista = reducir_vista_previa(datos, self.tamano)
+        except OSError as e:
+            print(f"Vista previa de ComfyUI no válida: {e}")
+            return
+        self._enviar({"preview": vista})
+
+    def _enviar(self, mensaje: dict):
+        self.enviados += 1
+        try:
+            self.publicar(mensaje)
+        except Exception as e:
+            print(f"No se pudo publicar el progreso: {e}")
+
+
+def atender_mensaje(progreso: Optional[Progreso], mensaje, prompt_id: str) -> Optional[dict]:
+    """Pasa un mensaje del WebSocket de ComfyUI al progreso y devuelve el evento JSON.
+
+    Args:
+        progreso (Progreso | None): Progreso activo.
+        mensaje (str | bytes): Mensaje recibido.
+        prompt_id (str): Prompt que se está esperando.
+
+    Returns:
+        dict | None: Evento JSON, o None si era un frame binario.
+    """
+    if not isinstance(mensaje, str):
+        if progreso is not None:
+            progreso.frame(mensaje)
+        return None
+    evento = json.loads(mensaje)
+    if progreso is not None:
+        progreso.evento(evento, prompt_id)
+    return evento
+
+
+_hilo = threading.local()
+
+
+@contextmanager
+def activo(progreso: Optional[Progreso]):
+    """Activa un progreso en el hilo actual mientras dura el bloque."""
+    anterior = getattr(_hilo, "progreso", None)
+    _hilo.progreso = progreso
+    try:
+        yield progreso
+    finally:
+        _hilo.progreso = anterior
+
+
+def actual() -> Optional[Progreso]:
+    """Progreso activo en el hilo actual, o None fuera de un trabajo que lo publique."""
+    return getattr(_hilo, "progreso", None)
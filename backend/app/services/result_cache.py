@@ -0,0 +1,244 @@
+"""Caché de resultados de generaciones deterministas.
+
+Con el mismo workflow parcheado (prompt, semilla, parámetros) y las mismas
+imágenes de entrada, ComfyUI produce siempre la misma imagen. Antes de enviar un
+workflow se busca en esta caché cada imagen que va a generar; si ya existe, se
+devuelve el archivo guardado sin pasar por la GPU.
+
+La clave de cada imagen es un hash canónico de la rama del grafo de la que
+depende su nodo SaveImage: cada nodo se resume con su tipo, sus entradas y los
+hashes de los nodos a los que enlaza, de modo que no influyen los IDs de los
+nodos, el orden del JSON ni el ``filename_prefix`` (único por petición). Las
+imágenes de entrada llegan a ComfyUI con el nombre ``staged-<sha256>`` de
+``staging.StagingArea``, así que el hash de su contenido forma parte de la
+clave; si algún LoadImage apunta a un archivo que no es direccionado por
+contenido, la imagen no se cachea.
+
+Las entradas se ordenan por uso (LRU) y se descartan las más antiguas cuando el
+tamaño total de las imágenes referenciadas supera ``GENERATION_CACHE_MAX_BYTES``.
+Descartar una entrada no borra el archivo, que sigue perteneciendo a sus
+registros ``Image``. El índice se persiste en disco para sobrevivir a los reinicios.
+
+Attributes:
+    GENERATION_CACHE_MAX_BYTES (int): Tamaño máximo de las imágenes indexadas (0 = caché desactivada).
+    GENERATION_CACHE_FILE (str): Archivo JSON del índice persistente ("" para no persistirlo).
+    cache (ResultCache): Caché de resultados de la aplicación.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+from dotenv import load_dotenv
+from .ingestion import ImagenIngerida
+from .staging import PREFIJO
+from .workflows import _es_enlace
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).parent.parent.parent
+
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+GENERATION_CACHE_FILE = os.getenv("GENERATION_CACHE_FILE", str(BASE_DIR / "generation_cache.json"))
+
+# Entradas que no afectan a la imagen generada
+_ENTRADAS_IGNORADAS = {"SaveImage": ("filename_prefix",)}
+
+
+def _huella(workflow: Mapping[str, Any], node_id: str, memo: Dict[str, Optional[str]]) -> Optional[str]:
+    """Hash de un nodo y de todo lo que depende; None si no es cacheable."""
+    if node_id in memo:
+        return memo[node_id]
+    nodo = workflow[node_id]
+    tipo = nodo["class_type"]
+    ignoradas = _ENTRADAS_IGNORADAS.get(tipo, ())
+    entradas = {}
+    huella = None
+    for clave, valor in nodo["inputs"].items():
+        if clave in ignoradas:
+            continue
+        if _es_enlace(valor):
+            origen = _huella(workflow, valor[0], memo)
+            if origen is None:
+                break
+            entradas[clave] = ["@", origen, valor[1]]
+        elif tipo == "LoadImage" and clave == "image" and not str(valor).startswith(PREFIJO):
+            break
+        else:
+            entradas[clave] = valor
+    else:
+        canonico = json.dumps([tipo, entradas], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        huella = hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+    memo[node_id] = huella
+    return huella
+
+
+def clave_resultado(workflow: Mapping[str, Any], nodo_salida: str) -> Optional[str]:
+    """Clave de caché de la imagen que genera un nodo SaveImage.
+
+    Args:
+        workflow (Mapping): Workflow ya parcheado.
+        nodo_salida (str): ID del nodo SaveImage.
+
+    Returns:
+        str | None: Hash canónico de la rama, o None si depende de una entrada
+        que no está direccionada por contenido.
+    """
+    return _huella(workflow, nodo_salida, {})
+
+
+class ResultCache:
+    """Índice LRU de imágenes ya generadas, acotado por tamaño.
+
+    Args:
+        max_bytes (int): Tamaño máximo de las imágenes indexadas (0 = desactivada).
+        cache_file (str, optional): Archivo JSON del índice persistente.
+
+    Attributes:
+        hits (int): Búsquedas resueltas con una imagen existente.
+        misses (int): Búsquedas sin resultado.
+        desalojos (int): Entradas descartadas por tamaño.
+        invalidadas (int): Entradas descartadas porque el archivo ya no existe o cambió.
+    """
+
+    def __init__(self, max_bytes: int = GENERATION_CACHE_MAX_BYTES, cache_file: Optional[str] = GENERATION_CACHE_FILE):
+        self.max_bytes = max(0, max_bytes)
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.hits = 0
+        self.misses = 0
+        self.desalojos = 0
+        self.invalidadas = 0
+        self._entradas: "OrderedDict[str, ImagenIngerida]" = OrderedDict()
+        self._bytes = 0
+        self._cargada = False
+        self._lock = threading.Lock()
+
+    @property
+    def activa(self) -> bool:
+        return self.max_bytes > 0
+
+    def buscar(self, clave: str) -> Optional[ImagenIngerida]:
+        """Busca la imagen generada para una clave.
+
+        Args:
+            clave (str): Clave de ``clave_resultado``.
+
+        Returns:
+            ImagenIngerida | None: Imagen existente, o None si no está o su archivo
+            ya no coincide con el registrado.
+        """
+        if not self.activa:
+            return None
+        with self._lock:
+            self._cargar()
+            imagen = self._entradas.get(clave)
+            if imagen is not None and not self._vigente(imagen):
+                self._quitar(clave)
+                self.invalidadas += 1
+                self._guardar()
+                imagen = None
+            if imagen is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return imagen
+
+    def guardar(self, clave: str, imagen: ImagenIngerida):
+        """Registra la imagen generada para una clave.
+
+        Args:
+            clave (str): Clave de ``clave_resultado``.
+            imagen (ImagenIngerida): Imagen ya guardada en su ubicación final.
+        """
+        if not self.activa or imagen.tamano > self.max_bytes:
+            return
+        with self._lock:
+            self._cargar()
+            self._escribir(clave, imagen)
+            self._guardar()
+
+    def limpiar(self):
+        """Vacía el índice en memoria y en disco (no borra las imágenes)."""
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+            self._cargada = True
+            self._guardar()
+
+    def metricas(self) -> dict:
+        """Estado de la caché.
+
+        Returns:
+            dict: Entradas, bytes indexados y límite, aciertos, fallos, tasa de
+            aciertos, desalojos e invalidaciones.
+        """
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "entries": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / consultas, 3) if consultas else 0.0,
+                "evictions": self.desalojos,
+                "invalidated": self.invalidadas,
+            }
+
+    @staticmethod
+    def _vigente(imagen: ImagenIngerida) -> bool:
+        """Comprueba que el archivo sigue en su sitio con el mismo tamaño."""
+        try:
+            return os.stat(imagen.ruta).st_size == imagen.tamano
+        except OSError:
+            return False
+
+    def _quitar(self, clave: str):
+        imagen = self._entradas.pop(clave, None)
+        if imagen is not None:
+            self._bytes -= imagen.tamano
+
+    def _escribir(self, clave: str, imagen: ImagenIngerida):
+        self._quitar(clave)
+        self._entradas[clave] = imagen
+        self._bytes += imagen.tamano
+        while self._bytes > self.max_bytes:
+            antigua, _ = next(iter(self._entradas.items()))
+            self._quitar(antigua)
+            self.desalojos += 1
+
+    def _cargar(self):
+        """Lee el índice persistente la primera vez que se usa la caché."""
+        if self._cargada:
+            return
+        self._cargada = True
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            # Las entradas se guardan de la menos a la más reciente
+            for clave, campos in datos.items():
+                self._escribir(clave, ImagenIngerida(**campos))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"No se pudo leer la caché de generaciones: {e}")
+
+    def _guardar(self):
+        """Escribe el índice en disco de forma atómica."""
+        if self.cache_file is None:
+            return
+        temporal = self.cache_file.with_name(f".{self.cache_file.name}.tmp")
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({clave: asdict(imagen) for clave, imagen in self._entradas.items()}, f, ensure_ascii=False)
+            os.replace(temporal, self.cache_file)
+        except OSError as e:
+            print(f"No se pudo guardar la caché de generaciones: {e}")
+
+
+cache = ResultCache()
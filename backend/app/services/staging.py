@@ -0,0 +1,195 @@
+"""Preparación de imágenes de entrada en la carpeta input de ComfyUI.
+
+Los workflows img2img, sketch2img y de múltiples imágenes necesitan que la imagen
+de origen esté en la carpeta input de ComfyUI. En lugar de copiarla en cada
+petición, cada contenido se guarda una sola vez con un nombre derivado de su
+hash (``staged-<sha256>.png``): si ya está preparado no se vuelve a escribir.
+Cuando el sistema de archivos lo permite se crea un enlace duro en lugar de una
+copia.
+
+Los trabajos en curso mantienen una referencia a sus entradas; los archivos sin
+referencias que llevan más de ``COMFY_STAGING_TTL`` segundos sin usarse se borran.
+
+Attributes:
+    COMFY_STAGING_TTL (int): Segundos que se conserva un archivo preparado sin uso.
+    COMFY_STAGING_GC_INTERVAL (int): Segundos mínimos entre dos limpiezas.
+    PREFIJO (str): Prefijo de los archivos gestionados por este módulo.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COMFY_STAGING_TTL = int(os.getenv("COMFY_STAGING_TTL", "86400"))
+COMFY_STAGING_GC_INTERVAL = int(os.getenv("COMFY_STAGING_GC_INTERVAL", "600"))
+
+PREFIJO = "staged-"
+
+
+def hash_archivo(ruta: Path) -> str:
+    """Calcula el SHA-256 del contenido de un archivo.
+
+    Args:
+        ruta (Path): Archivo a leer.
+
+    Returns:
+        str: Hash en hexadecimal.
+    """
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+class StagingArea:
+    """Carpeta de entradas de ComfyUI direccionada por contenido.
+
+    Args:
+        carpeta (Path): Carpeta input de ComfyUI.
+        ttl (int): Segundos que se conserva un archivo sin referencias.
+        gc_interval (int): Segundos mínimos entre limpiezas automáticas.
+
+    Attributes:
+        copias (int): Archivos escritos (copiados o enlazados).
+        reutilizados (int): Preparaciones resueltas con un archivo ya existente.
+    """
+
+    def __init__(self, carpeta: Path, ttl: int = COMFY_STAGING_TTL, gc_interval: int = COMFY_STAGING_GC_INTERVAL):
+        self.carpeta = Path(carpeta)
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.copias = 0
+        self.reutilizados = 0
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._referencias: Dict[str, int] = {}
+        self._ultimo_uso: Dict[str, float] = {}
+        self._ultima_limpieza = time.time()
+        self._lock = threading.Lock()
+
+    def _hash(self, origen: Path) -> str:
+        """Hash del origen, recordado mientras no cambien su tamaño ni su fecha."""
+        st = os.stat(origen)
+        clave = (str(origen), st.st_size, st.st_mtime_ns)
+        digest = self._hashes.get(clave)
+        if digest is None:
+            digest = hash_archivo(origen)
+            self._hashes[clave] = digest
+        return digest
+
+    def preparar(self, origen: Path) -> str:
+        """Deja una imagen disponible en la carpeta input y la marca como en uso.
+
+        Args:
+            origen (Path): Imagen de origen.
+
+        Returns:
+            str: Nombre del archivo en la carpeta input, para el nodo LoadImage.
+
+        Raises:
+            OSError: Si no se puede leer el origen o escribir en la carpeta input.
+
+        Note:
+            Cada llamada debe ir seguida de ``liberar`` cuando el trabajo termine.
+        """
+        origen = Path(origen)
+        nombre = f"{PREFIJO}{self._hash(origen)}{origen.suffix.lower()}"
+        destino = self.carpeta / nombre
+
+        with self._lock:
+            self._referencias[nombre] = self._referencias.get(nombre, 0) + 1
+            self._ultimo_uso[nombre] = time.time()
+        try:
+            if destino.exists():
+                self.reutilizados += 1
+            else:
+                self._escribir(origen, destino)
+                self.copias += 1
+        except OSError:
+            self.liberar([nombre])
+            raise
+
+        self._limpiar_si_toca()
+        return nombre
+
+    def _escribir(self, origen: Path, destino: Path):
+        """Enlaza o copia el origen en el destino de forma atómica."""
+        os.makedirs(self.carpeta, exist_ok=True)
+        temporal = destino.with_name(f".{destino.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            try:
+                os.link(origen, temporal)
+            except OSError:
+                # Otro sistema de archivos o sin soporte de enlaces: copia
+                shutil.copyfile(origen, temporal)
+            os.replace(temporal, destino)
+        finally:
+            if temporal.exists():
+                temporal.unlink()
+
+    def liberar(self, nombres: Iterable[str]):
+        """Quita la referencia de un trabajo terminado a sus entradas.
+
+        Args:
+            nombres (Iterable[str]): Nombres devueltos por ``preparar``.
+        """
+        ahora = time.time()
+        with self._lock:
+            for nombre in nombres:
+                restantes = self._referencias.get(nombre, 0) - 1
+                if restantes > 0:
+                    self._referencias[nombre] = restantes
+                else:
+                    self._referencias.pop(nombre, None)
+                self._ultimo_uso[nombre] = ahora
+
+    def en_uso(self, nombre: str) -> bool:
+        """Indica si algún trabajo en curso usa el archivo."""
+        with self._lock:
+            return nombre in self._referencias
+
+    def _limpiar_si_toca(self):
+        if time.time() - self._ultima_limpieza >= self.gc_interval:
+            self.limpiar()
+
+    def limpiar(self) -> int:
+        """Borra los archivos preparados sin referencias y sin uso reciente.
+
+        Returns:
+            int: Número de archivos borrados.
+        """
+        self._ultima_limpieza = time.time()
+        limite = self._ultima_limpieza - self.ttl
+        borrados = 0
+        try:
+            candidatos = [e for e in os.scandir(self.carpeta) if e.name.startswith(PREFIJO) and e.is_file()]
+        except OSError as e:
+            print(f"No se pudo revisar la carpeta input de ComfyUI: {e}")
+            return 0
+
+        for entrada in candidatos:
+            with self._lock:
+                if entrada.name in self._referencias:
+                    continue
+                ultimo_uso = self._ultimo_uso.get(entrada.name)
+                if ultimo_uso is None:
+                    ultimo_uso = entrada.stat().st_mtime
+                if ultimo_uso > limite:
+                    continue
+                try:
+                    os.unlink(entrada.path)
+                    borrados += 1
+                except OSError as e:
+                    print(f"No se pudo borrar {entrada.name}: {e}")
+                self._ultimo_uso.pop(entrada.name, None)
+        if borrados:
+            print(f"Eliminadas {borrados} entradas preparadas sin uso de la carpeta input de ComfyUI")
+        return borrados
@@ -0,0 +1,258 @@
+"""Traducción de prompts del español al inglés.
+
+Los modelos SDXL entienden mejor los prompts en inglés, así que los textos de los
+pacientes se traducen antes de enviarlos a ComfyUI. Como los mismos prompts
+cortos se repiten constantemente, las traducciones se guardan en una caché LRU
+con caducidad, indexada por el texto normalizado, que se persiste en disco para
+sobrevivir a los reinicios.
+
+El traductor es configurable: "translate" (servicio en línea de la librería
+``translate``) o "none" para instalaciones sin conexión, que deja el texto tal
+cual. Cada llamada al traductor tiene un tiempo máximo; si se agota o falla se
+usa el texto original para no bloquear la generación.
+
+Attributes:
+    TRANSLATION_BACKEND (str): "translate" o "none".
+    TRANSLATION_TIMEOUT (float): Segundos máximos de espera por traducción.
+    TRANSLATION_CACHE_SIZE (int): Entradas máximas de la caché.
+    TRANSLATION_CACHE_TTL (int): Segundos de validez de cada entrada.
+    TRANSLATION_CACHE_FILE (str): Archivo JSON de la caché persistente ("" para desactivarla).
+    traductor (TranslationService): Servicio de traducción de la aplicación.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from translate import Translator
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = Path(__file__).parent.parent.parent
+
+TRANSLATION_BACKEND = os.getenv("TRANSLATION_BACKEND", "translate").lower()
+TRANSLATION_TIMEOUT = float(os.getenv("TRANSLATION_TIMEOUT", "5"))
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "1000"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600)))
+TRANSLATION_CACHE_FILE = os.getenv("TRANSLATION_CACHE_FILE", str(BASE_DIR / "translation_cache.json"))
+
+# Respuestas de error que el proveedor de ``translate`` devuelve como si fueran traducciones
+_RESPUESTAS_DE_ERROR = ("MYMEMORY WARNING", "QUERY LENGTH LIMIT", "INVALID LANGUAGE PAIR")
+
+
+class NoopBackend:
+    """Traductor que devuelve el texto sin cambios (instalaciones sin conexión)."""
+
+    def traducir(self, texto: str) -> str:
+        return texto
+
+
+class TranslateBackend:
+    """Traductor en línea basado en la librería ``translate``.
+
+    Args:
+        from_lang (str): Idioma de origen.
+        to_lang (str): Idioma de destino.
+    """
+
+    def __init__(self, from_lang: str = "es", to_lang: str = "en"):
+        self._translator = Translator(from_lang=from_lang, to_lang=to_lang)
+
+    def traducir(self, texto: str) -> str:
+        traducido = self._translator.translate(texto)
+        if not traducido or traducido.upper().startswith(_RESPUESTAS_DE_ERROR):
+            raise RuntimeError(f"Respuesta no válida del traductor: {traducido}")
+        return traducido
+
+
+def crear_backend(nombre: str):
+    """Crea el traductor configurado.
+
+    Args:
+        nombre (str): "translate" o "none".
+
+    Returns:
+        NoopBackend | TranslateBackend: Traductor.
+
+    Raises:
+        ValueError: Si el nombre no es un traductor conocido.
+    """
+    if nombre in ("none", "noop", "off"):
+        return NoopBackend()
+    if nombre == "translate":
+        return TranslateBackend()
+    raise ValueError(f"TRANSLATION_BACKEND desconocido: {nombre}")
+
+
+def normalizar(texto: str) -> str:
+    """Clave de caché de un texto: espacios colapsados y sin distinguir mayúsculas.
+
+    Args:
+        texto (str): Texto original.
+
+    Returns:
+        str: Texto normalizado.
+    """
+    return " ".join(texto.split()).casefold()
+
+
+class TranslationService:
+    """Traductor con caché LRU+TTL persistente y tiempo máximo por llamada.
+
+    Args:
+        backend: Objeto con un método ``traducir(texto) -> str``.
+        cache_size (int): Entradas máximas de la caché.
+        ttl (int): Segundos de validez de cada entrada.
+        cache_file (str, optional): Archivo JSON de la caché persistente.
+        timeout (float): Segundos máximos de espera por traducción.
+        workers (int): Traducciones simultáneas máximas.
+    """
+
+    def __init__(self, backend, cache_size: int = TRANSLATION_CACHE_SIZE, ttl: int = TRANSLATION_CACHE_TTL,
+                 cache_file: Optional[str] = TRANSLATION_CACHE_FILE, timeout: float = TRANSLATION_TIMEOUT,
+                 workers: int = 4):
+        self.backend = backend
+        self.cache_size = max(1, cache_size)
+        self.ttl = ttl
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._cargada = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translation")
+
+    def traducir(self, texto: str) -> str:
+        """Traduce un texto usando la caché.
+
+        Args:
+            texto (str): Texto en español.
+
+        Returns:
+            str: Texto en inglés, o el original si el traductor falla o tarda demasiado.
+        """
+        return self.traducir_lote([texto])[0]
+
+    def traducir_lote(self, textos: List[str]) -> List[str]:
+        """Traduce varios textos; solo se envían al traductor los que no están en caché.
+
+        Las traducciones pendientes se lanzan a la vez y comparten el mismo tiempo máximo.
+
+        Args:
+            textos (list[str]): Textos en español.
+
+        Returns:
+            list[str]: Traducciones en el mismo orden.
+        """
+        limpios = [" ".join(t.split()) for t in textos]
+        resultados: Dict[str, str] = {}
+        pendientes: Dict[str, str] = {}
+        with self._lock:
+            self._cargar()
+            for limpio in limpios:
+                clave = normalizar(limpio)
+                if not clave or clave in resultados or clave in pendientes:
+                    continue
+                cacheado = self._leer(clave)
+                if cacheado is not None:
+                    self.hits += 1
+                    resultados[clave] = cacheado
+                else:
+                    self.misses += 1
+                    pendientes[clave] = limpio
+
+        if pendientes:
+            futuros = {clave: self._executor.submit(self.backend.traducir, limpio) for clave, limpio in pendientes.items()}
+            limite = time.monotonic() + self.timeout
+            nuevas = {}
+            for clave, futuro in futuros.items():
+                try:
+                    nuevas[clave] = futuro.result(timeout=max(0.0, limite - time.monotonic()))
+                except FuturesTimeoutError:
+                    print(f"Traducción agotó el tiempo, se usa el texto original: {pendientes[clave]}")
+                except Exception as e:
+                    print(f"Error al traducir, se usa el texto original: {e}")
+            if nuevas:
+                with self._lock:
+                    for clave, traducido in nuevas.items():
+                        self._escribir(clave, traducido)
+                    self._guardar()
+            resultados.update(nuevas)
+
+        return [resultados.get(normalizar(limpio), limpio) for limpio in limpios]
+
+    def limpiar(self):
+        """Vacía la caché en memoria y en disco."""
+        with self._lock:
+            self._cache.clear()
+            self._cargada = True
+            self._guardar()
+
+    def _leer(self, clave: str) -> Optional[str]:
+        entrada = self._cache.get(clave)
+        if entrada is None:
+            return None
+        traducido, guardado = entrada
+        if time.time() - guardado > self.ttl:
+            del self._cache[clave]
+            return None
+        self._cache.move_to_end(clave)
+        return traducido
+
+    def _escribir(self, clave: str, traducido: str):
+        self._cache[clave] = (traducido, time.time())
+        self._cache.move_to_end(clave)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cargar(self):
+        """Lee la caché persistente la primera vez que se usa el servicio."""
+        if self._cargada:
+            return
+        self._cargada = True
+        if self.cache_file is None or not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer la caché de traducciones: {e}")
+            return
+        ahora = time.time()
+        # Las entradas se guardan de la menos a la más reciente
+        for clave, (traducido, guardado) in datos.items():
+            if ahora - guardado <= self.ttl:
+                self._escribir(clave, traducido)
+
+    def _guardar(self):
+        """Escribe la caché en disco de forma atómica."""
+        if self.cache_file is None:
+            return
+        temporal = self.cache_file.with_name(f".{self.cache_file.name}.tmp")
+        try:
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump({clave: list(entrada) for clave, entrada in self._cache.items()}, f, ensure_ascii=False)
+            os.replace(temporal, self.cache_file)
+        except OSError as e:
+            print(f"No se pudo guardar la caché de traducciones: {e}")
+
+
+traductor = TranslationService(crear_backend(TRANSLATION_BACKEND))
+
+
+def traducir(texto: str) -> str:
+    """Traduce un prompt del español al inglés con el servicio de la aplicación.
+
+    Args:
+        texto (str): Texto en español.
+
+    Returns:
+        str: Texto en inglés (o el original si no se pudo traducir).
+    """
+    return traductor.traducir(texto)
@@ -0,0 +1,320 @@
+"""Registro de plantillas de workflow de ComfyUI.
+
+Las plantillas JSON de ``backend/workflows`` se leen una sola vez (en el startup
+de la aplicación o en su primer uso) y se guardan congeladas. Al cargarlas se
+comprueba que existen los nodos y entradas que parchea cada tipo de generación,
+de modo que un workflow exportado de nuevo con otros IDs falla al arrancar y no
+en mitad de una generación.
+
+Cada trabajo obtiene su workflow con ``WorkflowTemplate.parchear``, que copia
+solo los nodos modificados y comparte el resto con la plantilla (copy-on-write).
+
+Para generar varias variaciones en un solo envío, ``ramificar`` duplica la rama
+del grafo que cuelga del KSampler (sampler → decodificación → SaveImage) y
+comparte el resto (checkpoint, codificación del texto, imagen de entrada).
+
+Si un archivo cambia en disco se vuelve a cargar en el siguiente uso; si la nueva
+versión no es válida se sigue usando la anterior.
+
+Cada plantilla conoce el conjunto de modelos que carga (``WorkflowTemplate.modelos``,
+sacado de sus nodos cargadores: checkpoint, ControlNet, IPAdapter, CLIP Vision...),
+que la cola de trabajos usa para agrupar generaciones que comparten modelos.
+
+Attributes:
+    CARPETA_WORKFLOWS (Path): Carpeta con los workflows en formato API.
+    PLANTILLAS (dict): Archivo y nodos parcheados (ID → entradas) de cada plantilla.
+    NODOS_IMAGENES_MULTIPLES (dict): Nodos LoadImage de cada workflow de 2, 3 y 4 imágenes.
+    registro (WorkflowRegistry): Registro global de plantillas.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+BASE_DIR = Path(__file__).parent.parent.parent
+CARPETA_WORKFLOWS = BASE_DIR / "workflows"
+
+PLANTILLAS: Dict[str, Tuple[str, Dict[str, Tuple[str, ...]]]] = {
+    "txt2img": ("sdxl txt2img api workflow.json", {
+        "11": ("text_positive",), "3": ("seed",), "9": ("filename_prefix",),
+    }),
+    "img2img": ("sdxl img2img api workflow.json", {
+        "17": ("text_positive",), "10": ("image",), "3": ("seed",), "9": ("filename_prefix",),
+    }),
+    "sketch2img": ("sdxl sketch2img api workflow.json", {
+        "199": ("text_positive",), "138": ("image",), "128": ("seed",), "132": ("filename_prefix",),
+    }),
+    "multimg2": ("sdxl twoimgs2img api workflow.json", {
+        "1": ("image",), "2": ("image",), "16": ("seed",), "17": ("filename_prefix",),
+    }),
+    "multimg3": ("sdxl threeimgs2img api workflow.json", {
+        "1": ("image",), "2": ("image",), "5": ("image",), "16": ("seed",), "17": ("filename_prefix",),
+    }),
+    "multimg4": ("sdxl fourimgs2img api workflow.json", {
+        "1": ("image",), "2": ("image",), "28": ("image",), "29": ("image",), "16": ("seed",), "17": ("filename_prefix",),
+    }),
+}
+
+NODOS_IMAGENES_MULTIPLES = {
+    2: ("1", "2"),
+    3: ("1", "2", "5"),
+    4: ("1", "2", "28", "29"),
+}
+
+
+class _DictCongelado(dict):
+    """Diccionario de solo lectura; sigue siendo serializable con ``json``."""
+
+    def _inmutable(self, *args, **kwargs):
+        raise TypeError("Las plantillas de workflow son inmutables; usa WorkflowTemplate.parchear")
+
+    __setitem__ = __delitem__ = __ior__ = _inmutable
+    clear = pop = popitem = setdefault = update = _inmutable
+
+
+def _congelar(valor: Any) -> Any:
+    """Convierte recursivamente dicts y listas en estructuras inmutables."""
+    if isinstance(valor, dict):
+        return _DictCongelado((k, _congelar(v)) for k, v in valor.items())
+    if isinstance(valor, list):
+        return tuple(_congelar(v) for v in valor)
+    return valor
+
+
+def modelos_de(grafo: Mapping[str, Any]) -> FrozenSet[str]:
+    """Modelos que carga un workflow.
+
+    Args:
+        grafo (Mapping): Nodos del workflow.
+
+    Returns:
+        frozenset[str]: Valores de texto de las entradas de los nodos cargadores
+        (``CheckpointLoaderSimple``, ``ControlNetLoader``, ``IPAdapterModelLoader``...).
+    """
+    return frozenset(
+        valor
+        for nodo in grafo.values()
+        if "Loader" in nodo.get("class_type", "")
+        for valor in nodo.get("inputs", {}).values()
+        if isinstance(valor, str)
+    )
+
+
+class WorkflowTemplate:
+    """Plantilla de workflow congelada.
+
+    Attributes:
+        nombre (str): Nombre de la plantilla (p. ej. "txt2img").
+        ruta (Path): Archivo JSON de origen.
+        mtime (int): Fecha de modificación (ns) del archivo cargado.
+        grafo (Mapping): Nodos del workflow, de solo lectura.
+        modelos (frozenset[str]): Modelos que carga el workflow.
+    """
+
+    def __init__(self, nombre: str, ruta: Path, mtime: int, grafo: Mapping[str, Any]):
+        self.nombre = nombre
+        self.ruta = ruta
+        self.mtime = mtime
+        self.grafo = grafo
+        self.modelos = modelos_de(grafo)
+
+    def input(self, node_id: str, clave: str) -> Any:
+        """Valor original de una entrada de un nodo.
+
+        Args:
+            node_id (str): ID del nodo.
+            clave (str): Nombre de la entrada.
+
+        Returns:
+            Any: Valor de la plantilla.
+        """
+        return self.grafo[node_id]["inputs"][clave]
+
+    def parchear(self, cambios: Dict[str, Dict[str, Any]]) -> dict:
+        """Genera el workflow de un trabajo a partir de la plantilla.
+
+        Solo se copian los nodos modificados; el resto se comparte con la plantilla.
+
+        Args:
+            cambios (dict): Entradas a sustituir por nodo, p. ej. ``{"3": {"seed": 42}}``.
+
+        Returns:
+            dict: Workflow listo para enviar a ComfyUI.
+
+        Raises:
+            KeyError: Si algún nodo no existe en la plantilla.
+        """
+        workflow = dict(self.grafo)
+        for node_id, inputs in cambios.items():
+            if node_id not in self.grafo:
+                raise KeyError(f"El workflow {self.nombre} no tiene el nodo {node_id}")
+            original = self.grafo[node_id]
+            nodo = dict(original)
+            nodo["inputs"] = {**original["inputs"], **inputs}
+            workflow[node_id] = nodo
+        return workflow
+
+
+def _es_enlace(valor: Any) -> bool:
+    """Indica si una entrada es un enlace ``[node_id, salida]`` a otro nodo."""
+    return isinstance(valor, (list, tuple)) and len(valor) == 2 and isinstance(valor[0], str) and isinstance(valor[1], int)
+
+
+def descendientes(workflow: Mapping[str, Any], raiz: str) -> List[str]:
+    """Nodos que dependen (directa o indirectamente) de ``raiz``, incluida ella.
+
+    Args:
+        workflow (Mapping): Grafo del workflow.
+        raiz (str): ID del nodo de partida.
+
+    Returns:
+        list[str]: IDs de la rama en el orden del workflow.
+    """
+    rama = {raiz}
+    cambiado = True
+    while cambiado:
+        cambiado = False
+        for node_id, nodo in workflow.items():
+            if node_id in rama:
+                continue
+            if any(_es_enlace(v) and v[0] in rama for v in nodo["inputs"].values()):
+                rama.add(node_id)
+                cambiado = True
+    return [node_id for node_id in workflow if node_id in rama]
+
+
+def ramificar(workflow: Mapping[str, Any], raiz: str, variantes: List[Dict[str, Dict[str, Any]]]) -> dict:
+    """Replica la rama que cuelga de ``raiz`` una vez por variante.
+
+    La primera variante parchea la rama original; las siguientes son copias con
+    IDs numéricos nuevos cuyos enlaces internos apuntan a la copia y los externos
+    a los nodos compartidos. ComfyUI ejecuta una sola vez los nodos compartidos.
+
+    Args:
+        workflow (Mapping): Workflow ya parcheado (o plantilla).
+        raiz (str): ID del nodo que se varía (normalmente el KSampler).
+        variantes (list[dict]): Cambios de cada variante indexados por el ID
+            original del nodo, p. ej. ``[{"3": {"seed": 1}, "9": {"filename_prefix": "a"}}, ...]``.
+
+    Returns:
+        dict: Workflow con todas las ramas.
+    """
+    rama = descendientes(workflow, raiz)
+    siguiente = max((int(node_id) for node_id in workflow if node_id.isdigit()), default=0) + 1
+    resultado = dict(workflow)
+    for i, cambios in enumerate(variantes):
+        if i == 0:
+            ids = {node_id: node_id for node_id in rama}
+        else:
+            ids = {node_id: str(siguiente + j) for j, node_id in enumerate(rama)}
+            siguiente += len(rama)
+        for node_id in rama:
+            original = workflow[node_id]
+            inputs = {
+                clave: [ids[valor[0]], valor[1]] if _es_enlace(valor) and valor[0] in ids else valor
+                for clave, valor in original["inputs"].items()
+            }
+            inputs.update(cambios.get(node_id, {}))
+            nodo = dict(original)
+            nodo["inputs"] = inputs
+            resultado[ids[node_id]] = nodo
+    return resultado
+
+
+def _cargar_plantilla(nombre: str, ruta: Path, nodos: Dict[str, Tuple[str, ...]]) -> WorkflowTemplate:
+    """Lee y valida una plantilla.
+
+    Raises:
+        ValueError: Si el JSON no es válido o falta algún nodo o entrada parcheada.
+    """
+    mtime = os.stat(ruta).st_mtime_ns
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            grafo = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"El workflow {nombre} ({ruta.name}) no es JSON válido: {e}")
+
+    faltan = [
+        f"{node_id}.{clave}"
+        for node_id, claves in nodos.items()
+        for clave in claves
+        if clave not in (grafo.get(node_id) or {}).get("inputs", {})
+    ]
+    if faltan:
+        raise ValueError(f"Al workflow {nombre} ({ruta.name}) le faltan las entradas {', '.join(faltan)}")
+    return WorkflowTemplate(nombre, ruta, mtime, _congelar(grafo))
+
+
+class WorkflowRegistry:
+    """Registro de plantillas con recarga automática.
+
+    Args:
+        carpeta (Path): Carpeta de los workflows.
+        plantillas (dict): Especificación de plantillas (ver ``PLANTILLAS``).
+    """
+
+    def __init__(self, carpeta: Path = CARPETA_WORKFLOWS, plantillas: Optional[dict] = None):
+        self.carpeta = Path(carpeta)
+        self.plantillas = plantillas if plantillas is not None else PLANTILLAS
+        self._cargadas: Dict[str, WorkflowTemplate] = {}
+        self._mtimes_descartados: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def cargar(self):
+        """Carga y valida todas las plantillas.
+
+        Raises:
+            ValueError: Si alguna plantilla no es válida.
+            OSError: Si falta algún archivo.
+        """
+        cargadas = {
+            nombre: _cargar_plantilla(nombre, self.carpeta / archivo, nodos)
+            for nombre, (archivo, nodos) in self.plantillas.items()
+        }
+        with self._lock:
+            self._cargadas = cargadas
+            self._mtimes_descartados.clear()
+
+    def get(self, nombre: str) -> WorkflowTemplate:
+        """Obtiene una plantilla, recargándola si su archivo ha cambiado.
+
+        Args:
+            nombre (str): Nombre de la plantilla (clave de ``PLANTILLAS``).
+
+        Returns:
+            WorkflowTemplate: Plantilla vigente.
+        """
+        archivo, nodos = self.plantillas[nombre]
+        ruta = self.carpeta / archivo
+        with self._lock:
+            actual = self._cargadas.get(nombre)
+            try:
+                mtime = os.stat(ruta).st_mtime_ns
+            except OSError as e:
+                if actual is None:
+                    raise
+                print(f"No se puede comprobar el workflow {nombre}, se usa la versión cargada: {e}")
+                return actual
+
+            if actual is not None and (mtime == actual.mtime or mtime == self._mtimes_descartados.get(nombre)):
+                return actual
+
+            try:
+                plantilla = _cargar_plantilla(nombre, ruta, nodos)
+            except (ValueError, OSError) as e:
+                if actual is None:
+                    raise
+                print(f"Workflow {nombre} modificado pero no válido, se mantiene la versión anterior: {e}")
+                self._mtimes_descartados[nombre] = mtime
+                return actual
+
+            if actual is not None:
+                print(f"Workflow {nombre} recargado desde {ruta.name}")
+            self._cargadas[nombre] = plantilla
+            self._mtimes_descartados.pop(nombre, None)
+            return plantilla
+
+
+registro = WorkflowRegistry()
@@ -0,0 +1,24 @@
+"""Script para crear las miniaturas y tamaños intermedios de las imágenes ya guardadas.
+
+Las imágenes nuevas se procesan al generarse, subirse o dibujarse; este script
+recorre las carpetas de ``assets/images`` y crea las versiones reducidas que
+falten (las que ya están al día no se vuelven a generar).
+
+Ejecución (desde la carpeta `backend`):
+    python backfill_derivatives.py [carpeta ...]
+"""
+import argparse
+import app.services.derivatives as derivatives
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea las miniaturas que falten de las imágenes guardadas.")
+    parser.add_argument("carpetas", nargs="*", help="carpetas de assets/images (por defecto todas)")
+    args = parser.parse_args()
+    procesadas, errores = derivatives.rellenar(args.carpetas or None)
+    print(f"{procesadas} imágenes procesadas ({derivatives.FORMATO}, tamaños {derivatives.IMAGE_DERIVATIVE_SIZES}), "
+          f"{errores} con errores")
+
+
+if __name__ == '__main__':
+    main()
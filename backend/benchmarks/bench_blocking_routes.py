@@ -0,0 +1,105 @@
+"""Benchmark: concurrent requests to routes that do blocking work.
+
+Simulates a slow CRUD call (``time.sleep``, as a slow query or disk access
+would) behind ``GET /users/users/{id}/free-images`` and fires N concurrent
+requests. Compares running the blocking call inline in the event loop (the
+previous behaviour) with running it in ``services.executor``.
+
+Usage (from backend/):
+    python benchmarks/bench_blocking_routes.py --requests 32 --delay 0.05
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.api.users as users_api
+import app.crud as crud
+import app.dependencies as dependencies
+import app.main as main
+import app.models as models
+import app.schemas as schemas
+import app.security as security
+import app.services.executor as executor_module
+
+
+async def _inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _setup_db(directory):
+    engine = create_engine(f"sqlite:///{Path(directory) / 'bench.db'}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[dependencies.get_db] = override_get_db
+    db = SessionLocal()
+    try:
+        patient = crud.user.create_user(db, schemas.UserCreate(
+            email="bench@example.com", full_name="Bench", password="Password1!", type=schemas.UserType.patient))
+        token = security.create_access_token(data={"sub": str(patient.id), "user_type": patient.type})
+        return patient.id, token
+    finally:
+        db.close()
+
+
+async def _fire(n, user_id, token):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        headers = {"Authorization": f"Bearer {token}"}
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            http.get(f"/users/users/{user_id}/free-images", headers=headers) for _ in range(n)
+        ))
+        elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses), [r.status_code for r in responses]
+    return elapsed
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds of blocking work per request")
+    args = parser.parse_args()
+
+    def slow_images(db, user_id):
+        time.sleep(args.delay)
+        return {"data": [], "count": 0}
+
+    crud.user.get_images_for_user_no_session = slow_images
+
+    with tempfile.TemporaryDirectory() as directory:
+        user_id, token = _setup_db(directory)
+        pooled = users_api.run_blocking
+
+        users_api.run_blocking = _inline
+        inline = asyncio.run(_fire(args.requests, user_id, token))
+        users_api.run_blocking = pooled
+        executor = asyncio.run(_fire(args.requests, user_id, token))
+
+    serial = args.requests * args.delay
+    workers = executor_module.pool.workers
+    print(f"{args.requests} concurrent requests, {args.delay * 1000:.0f} ms of blocking work each")
+    print(f"  serial lower bound         : {serial:.3f} s")
+    print(f"  inline in event loop       : {inline:.3f} s")
+    print(f"  executor ({workers} workers)       : {executor:.3f} s  ({inline / executor:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,129 @@
+"""Benchmark: image serving with the default StaticFiles mount vs ImagenesEstaticas.
+
+Starts two uvicorn servers on localhost over a copy of the template images,
+stored as ``generated_images`` (finalized images): one with Starlette's
+``StaticFiles`` as ``main.py`` used to mount it, one with
+``image_serving.ImagenesEstaticas``. For each it measures:
+
+- cold: ``--clients`` concurrent clients download every image (throughput);
+- reopen: the same clients open the gallery again with a browser-like cache
+  that honours ``Cache-Control`` (fresh/immutable entries are not requested)
+  and revalidates the rest with ``If-None-Match``.
+
+Usage (from backend/):
+    python benchmarks/bench_image_serving.py --clients 8 --rounds 3
+"""
+
+import argparse
+import asyncio
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.services.derivatives as derivatives
+import app.services.image_serving as image_serving
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Server:
+    def __init__(self, files_app):
+        self.port = _free_port()
+        app = Starlette(routes=[Mount("/images", files_app)])
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="error", lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{self.port}/images/generated_images"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def _gallery(client, base, names, cache):
+    """Loads every image once; returns (requests sent, bytes received)."""
+    requests = received = 0
+    for name in names:
+        entry = cache.get(name)
+        headers = {}
+        if entry is not None:
+            if "immutable" in entry["cache-control"] or "max-age=31536000" in entry["cache-control"]:
+                continue
+            headers["If-None-Match"] = entry["etag"]
+        r = await client.get(f"{base}/{name}", headers=headers)
+        requests += 1
+        received += len(r.content)
+        if r.status_code == 200:
+            cache[name] = {"etag": r.headers.get("etag", ""), "cache-control": r.headers.get("cache-control", "")}
+    return requests, received
+
+
+async def _phase(base, names, caches):
+    limits = httpx.Limits(max_connections=len(caches))
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(_gallery(client, base, names, cache) for cache in caches))
+        elapsed = time.perf_counter() - start
+    return elapsed, sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def _measure(files_app, names, clients, rounds):
+    best = {}
+    with _Server(files_app) as base:
+        for _ in range(rounds):
+            caches = [{} for _ in range(clients)]
+            for phase in ("cold", "reopen"):
+                result = asyncio.run(_phase(base, names, caches))
+                if phase not in best or result[0] < best[phase][0]:
+                    best[phase] = result
+    return best
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent gallery viewers")
+    parser.add_argument("--rounds", type=int, default=3, help="repetitions (best is reported)")
+    args = parser.parse_args()
+
+    source = derivatives.CARPETA_IMAGENES / "template_images"
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(source, Path(tmp) / "generated_images")
+        names = sorted(p.name for p in (Path(tmp) / "generated_images").iterdir() if p.is_file())
+        total = sum((Path(tmp) / "generated_images" / n).stat().st_size for n in names)
+        print(f"{len(names)} images ({total / 1e6:.1f} MB) x {args.clients} clients, best of {args.rounds}")
+
+        variants = {
+            "StaticFiles": StaticFiles(directory=tmp),
+            "ImagenesEstaticas": image_serving.ImagenesEstaticas(directory=tmp),
+        }
+        for label, files_app in variants.items():
+            best = _measure(files_app, names, args.clients, args.rounds)
+            cold_s, cold_req, cold_bytes = best["cold"]
+            reopen_s, reopen_req, reopen_bytes = best["reopen"]
+            print(f"  {label:<18} cold: {cold_req / cold_s:7.0f} req/s {cold_bytes / cold_s / 1e6:7.0f} MB/s   "
+                  f"reopen: {reopen_req:4d} requests, {reopen_bytes / 1e6:6.1f} MB, {reopen_s * 1000:6.0f} ms")
+
+
+if __name__ == "__main__":
+    main_bench()
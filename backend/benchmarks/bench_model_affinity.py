@@ -0,0 +1,88 @@
+"""Benchmark: model-affinity grouping in the generation job queue.
+
+Simulates one ComfyUI GPU that spends ``--swap`` seconds reloading models
+whenever a job needs a different model set than the previous one, plus
+``--render`` seconds per image. Several users queue a mix of txt2img,
+sketch2img and multimg jobs. Compares the plain round-robin scheduler
+(``COMFY_AFFINITY_WINDOW=0``) with model-affinity grouping.
+
+Usage (from backend/):
+    python benchmarks/bench_model_affinity.py --users 6 --jobs 4 --window 3
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.services.jobs as jobs
+import app.services.workflows as workflows
+
+KINDS = {"txt2img": "txt2img", "sketch2img": "sketch2img", "multimg": "multimg2"}
+
+
+def _run(window, plan, render, swap):
+    gpu = {"modelos": None, "cambios": 0}
+    lock = threading.Lock()
+
+    def make_task(modelos):
+        def task(db):
+            with lock:
+                if gpu["modelos"] != modelos:
+                    gpu["cambios"] += 1
+                    time.sleep(swap)
+                    gpu["modelos"] = modelos
+                time.sleep(render)
+            return {"message": "ok"}
+        return task
+
+    manager = jobs.JobManager(workers=1, cola=jobs.ColaJusta(max_por_usuario=1, ventana=window))
+    manager._threads = [object()]  # queue every job before the worker starts
+    start = time.perf_counter()
+    submitted = []
+    for user_id, kind in plan:
+        modelos = workflows.registro.get(KINDS[kind]).modelos
+        submitted.append(manager.submit(kind, user_id, None, make_task(modelos), modelos=modelos))
+    manager._threads = []
+    manager.start()
+    for job in submitted:
+        job.finished.wait()
+    elapsed = time.perf_counter() - start
+    metrics = manager.metricas()
+    manager.stop()
+    return elapsed, gpu["cambios"], metrics["latency_by_kind"]
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--jobs", type=int, default=4, help="jobs queued per user")
+    parser.add_argument("--window", type=int, default=3, help="affinity window to compare with 0")
+    parser.add_argument("--render", type=float, default=0.02, help="seconds per generation")
+    parser.add_argument("--swap", type=float, default=0.1, help="seconds per model reload")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    plan = [(user_id, rng.choice(list(KINDS))) for _ in range(args.jobs) for user_id in range(1, args.users + 1)]
+    jobs.SessionLocal = sessionmaker(bind=create_engine("sqlite://"))
+
+    print(f"{len(plan)} jobs from {args.users} users, {args.render * 1000:.0f} ms render, "
+          f"{args.swap * 1000:.0f} ms model reload")
+    results = {window: _run(window, plan, args.render, args.swap) for window in (0, args.window)}
+    base = results[0][0]
+    for window, (elapsed, swaps, latency) in results.items():
+        print(f"  window {window}: {elapsed:.3f} s, {swaps} model loads ({base / elapsed:.2f}x)")
+        for kind, stats in sorted(latency.items()):
+            print(f"    {kind:<10} p50 {stats['total_ms_p50']:>7.0f} ms   p95 {stats['total_ms_p95']:>7.0f} ms")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,140 @@
+"""Benchmark: concurrent reads and writes on SQLite with and without the pragma profile.
+
+Reproduces the app's mix on a file database: ``--writers`` threads insert
+images and commit one by one (as ``crud.comfy`` does after each generation)
+while ``--readers`` threads run the session and gallery lookups that every
+session GET performs. Runs for ``--seconds`` with the bare engine
+(``check_same_thread=False`` only, the previous ``database.py``) and with
+``database.configurar_sqlite``, and reports throughput, p95 latency and
+``database is locked`` errors.
+
+Usage (from backend/):
+    python benchmarks/bench_sqlite_pragmas.py --writers 4 --readers 8 --seconds 5
+"""
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app.database as database
+import app.migrations as migrations
+import app.models as models
+
+PATIENTS = 20
+
+
+def _seed(SessionLocal):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    therapist = models.Therapist(email="t@bench", full_name="T", hashed_password="x")
+    db.add(therapist)
+    db.flush()
+    for i in range(PATIENTS):
+        patient = models.Patient(email=f"p{i}@bench", full_name=f"P{i}", hashed_password="x")
+        db.add(patient)
+        db.flush()
+        for day in range(-30, 30, 3):
+            start = now + timedelta(days=day)
+            db.add(models.Session(patient_id=patient.id, therapist_id=therapist.id, start_date=start,
+                                  end_date=start + timedelta(hours=1), ended_at=start if day < 0 else None))
+    db.commit()
+    db.close()
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _run(engine, writers, readers, seconds):
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    migrations.actualizar(engine)
+    _seed(SessionLocal)
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {"writes": [], "reads": [], "errors": 0}
+
+    def record(kind, elapsed):
+        with lock:
+            stats[kind].append(elapsed)
+
+    def writer(n):
+        db = SessionLocal()
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                db.add(models.Image(fileName=f"generated{n}-{i}.png", owner_id=2 + n % PATIENTS))
+                db.commit()
+                record("writes", time.perf_counter() - start)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    stats["errors"] += 1
+            i += 1
+        db.close()
+
+    def reader(n):
+        db = SessionLocal()
+        user_id = 2 + n % PATIENTS
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                now = datetime.utcnow()
+                db.query(models.Session).filter(
+                    (models.Session.patient_id == user_id) | (models.Session.therapist_id == user_id),
+                    models.Session.ended_at == None,
+                    models.Session.start_date > now,
+                ).order_by(models.Session.start_date.asc()).first()
+                db.query(models.Image).filter(models.Image.owner_id == user_id).all()
+                db.commit()
+                record("reads", time.perf_counter() - start)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    stats["errors"] += 1
+        db.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    return stats
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers + {args.readers} readers for {args.seconds:.0f} s")
+    print(f"pragma profile: {database.PRAGMAS}")
+    for label, configure in (("default", lambda e: e), ("pragmas", database.configurar_sqlite)):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = configure(create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", connect_args={"check_same_thread": False}))
+            stats = _run(engine, args.writers, args.readers, args.seconds)
+        writes, reads = stats["writes"], stats["reads"]
+        print(f"  {label:<8} writes {len(writes) / args.seconds:7.0f}/s (p95 {_percentile(writes, 0.95) * 1000:6.1f} ms)   "
+              f"reads {len(reads) / args.seconds:7.0f}/s (p95 {_percentile(reads, 0.95) * 1000:6.1f} ms)   "
+              f"locked errors {stats['errors']}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -8,11 +8,12 @@ El script es idempotente respecto a emails: no volverá a crear usuarios si ya e
 from datetime import datetime, timedelta
 from app.database import SessionLocal, engine
 import app.models as models
+import app.migrations as migrations
 from app.security import hash_password
 
 
 def ensure_tables():
-    models.Base.metadata.create_all(bind=engine)
+    migrations.actualizar(engine)
 
 
 def get_or_create_user(db, model_cls, email, plain_password, full_name):
@@ -0,0 +1,50 @@
+"""Script para consultar y aplicar las migraciones del esquema de la base de datos.
+
+Ejecución (desde la carpeta `backend`):
+    python migrate.py current
+    python migrate.py history
+    python migrate.py upgrade [versión] [--online]
+    python migrate.py downgrade versión
+
+``--online`` construye los índices nuevos uno a uno fuera de la transacción de
+la migración (``CONCURRENTLY`` en PostgreSQL) para no dejar a la API sin acceso
+a las tablas mientras se crean.
+
+La base de datos es la de ``DATABASE_URL`` (ver ``app/database.py``).
+"""
+import argparse
+from app.database import engine
+import app.migrations as migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    comandos.add_parser("current", help="versión actual del esquema")
+    comandos.add_parser("history", help="migraciones disponibles")
+    subir = comandos.add_parser("upgrade", help="aplica las migraciones pendientes")
+    subir.add_argument("version", type=int, nargs="?", help="versión final (por defecto la última)")
+    subir.add_argument("--online", action="store_true", help="construye los índices sin bloquear la API")
+    bajar = comandos.add_parser("downgrade", help="deshace las migraciones posteriores a una versión")
+    bajar.add_argument("version", type=int, help="versión a la que volver (0 = vacía)")
+    args = parser.parse_args()
+
+    if args.comando == "current":
+        print(f"Versión del esquema: {migrations.version_actual(engine)} (última: {migrations.version_final()})")
+    elif args.comando == "history":
+        actual = migrations.version_actual(engine)
+        for migracion in migrations.MIGRACIONES:
+            marca = "x" if migracion.version <= actual else " "
+            print(f"[{marca}] {migracion.version:>3}  {migracion.nombre}")
+    elif args.comando == "upgrade":
+        with migrations.bloqueo(engine):
+            aplicadas = migrations.actualizar(engine, args.version, en_linea=args.online)
+        print(f"Migraciones aplicadas: {aplicadas or 'ninguna'}")
+    else:
+        with migrations.bloqueo(engine):
+            revertidas = migrations.revertir(engine, args.version)
+        print(f"Migraciones deshechas: {revertidas or 'ninguna'}")
+
+
+if __name__ == '__main__':
+    main()
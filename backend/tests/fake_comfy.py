@@ -0,0 +1,209 @@
+"""Minimal fake ComfyUI server used by the tests.
+
+Implements the subset of the ComfyUI API the backend relies on:
+POST /prompt, GET /history/{prompt_id}, GET and POST /queue (``delete``),
+POST /interrupt, GET /view and the /ws event stream.
+Each queued prompt "renders" after ``delay`` seconds and produces one PNG per
+SaveImage node, named after its ``filename_prefix``.
+
+``fail_prompts`` makes the next N ``/prompt`` calls answer 503, ``peers`` records
+the client address of every HTTP request (to check connection reuse) and
+``max_concurrent`` the highest number of requests served at the same time.
+With ``serial=True`` prompts render one at a time, like a single GPU, and
+/queue reports the one rendering as running (otherwise every unfinished
+prompt is pending).
+With ``steps`` > 0 the render sends that many ``progress`` events and binary
+JPEG preview frames of ``preview_size`` pixels to the prompt's websocket client.
+Prompts removed from the queue are recorded in ``deleted`` and interrupted
+renders in ``interrupted``; neither produces history or files.
+"""
+
+import asyncio
+import io
+import socket
+import threading
+import time
+import uuid
+
+import uvicorn
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+
+def _png_bytes(color=(200, 120, 40), size=(8, 8)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeComfyUI:
+    """Fake ComfyUI instance running uvicorn in a background thread."""
+
+    def __init__(self, delay=0.05, websocket=True, response_delay=0, serial=False, steps=0, preview_size=512):
+        self.delay = delay
+        self.serial = serial
+        self.steps = steps
+        self.preview_size = preview_size
+        self._gpu = None
+        self.websocket = websocket
+        self.response_delay = response_delay
+        self.fail_prompts = 0
+        self.peers = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.prompts = {}
+        self.history = {}
+        self.files = {}
+        self.clients = {}
+        self.running = set()
+        self.deleted = []
+        self.interrupted = []
+        self._renders = {}
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+
+        routes = [
+            Route("/prompt", self.prompt, methods=["POST"]),
+            Route("/history/{prompt_id}", self.get_history),
+            Route("/queue", self.queue, methods=["GET", "POST"]),
+            Route("/interrupt", self.interrupt, methods=["POST"]),
+            Route("/view", self.view),
+        ]
+        if websocket:
+            routes.append(WebSocketRoute("/ws", self.ws))
+        self.app = Starlette(routes=routes)
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            assert time.time() < deadline, "fake ComfyUI did not start"
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+    @staticmethod
+    def _save_nodes(workflow):
+        return {
+            node_id: node["inputs"]["filename_prefix"]
+            for node_id, node in workflow.items()
+            if node.get("class_type") == "SaveImage"
+        } or {"9": "ComfyUI"}
+
+    async def _track(self, request):
+        self.peers.append(request.client)
+        self.concurrent += 1
+        self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            await asyncio.sleep(self.response_delay)
+        finally:
+            self.concurrent -= 1
+
+    async def prompt(self, request):
+        await self._track(request)
+        if self.fail_prompts > 0:
+            self.fail_prompts -= 1
+            return JSONResponse({"error": "busy"}, status_code=503)
+        body = await request.json()
+        prompt_id = uuid.uuid4().hex
+        self.prompts[prompt_id] = body
+        self._renders[prompt_id] = asyncio.get_running_loop().create_task(self._render(prompt_id, body.get("client_id")))
+        return JSONResponse({"prompt_id": prompt_id, "number": len(self.prompts), "node_errors": {}})
+
+    async def _render(self, prompt_id, client_id):
+        if self.serial:
+            self._gpu = self._gpu or asyncio.Lock()
+            await self._gpu.acquire()
+            self.running.add(prompt_id)
+        try:
+            if self.steps:
+                await self._progress(prompt_id, client_id)
+            else:
+                await asyncio.sleep(self.delay)
+        finally:
+            self.running.discard(prompt_id)
+            if self.serial:
+                self._gpu.release()
+        outputs = {}
+        for node_id, prefix in self._save_nodes(self.prompts[prompt_id]["prompt"]).items():
+            filename = f"{prefix}_00001_.png"
+            self.files[filename] = _png_bytes()
+            outputs[node_id] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+        self.history[prompt_id] = {
+            "outputs": outputs,
+            "status": {"status_str": "success", "completed": True},
+        }
+        ws = self.clients.get(client_id)
+        if ws is not None:
+            await ws.send_json({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    async def _progress(self, prompt_id, client_id):
+        buffer = io.BytesIO()
+        Image.new("RGB", (self.preview_size, self.preview_size), (90, 90, 200)).save(buffer, format="JPEG")
+        frame = (1).to_bytes(4, "big") + (1).to_bytes(4, "big") + buffer.getvalue()
+        for step in range(1, self.steps + 1):
+            await asyncio.sleep(self.delay / self.steps)
+            ws = self.clients.get(client_id)
+            if ws is not None:
+                await ws.send_json({"type": "progress", "data": {"value": step, "max": self.steps, "prompt_id": prompt_id, "node": "3"}})
+                await ws.send_bytes(frame)
+
+    async def queue(self, request):
+        await self._track(request)
+        if request.method == "POST":
+            for prompt_id in (await request.json()).get("delete", []):
+                if prompt_id in self._renders and prompt_id not in self.running and prompt_id not in self.history:
+                    self._renders.pop(prompt_id).cancel()
+                    self.deleted.append(prompt_id)
+            return JSONResponse({})
+        running = [[0, prompt_id] for prompt_id in self.running]
+        pending = [
+            [0, prompt_id] for prompt_id, task in self._renders.items()
+            if prompt_id not in self.running and not task.done()
+        ]
+        return JSONResponse({"queue_running": running, "queue_pending": pending})
+
+    async def interrupt(self, request):
+        await self._track(request)
+        prompt_id = (await request.json()).get("prompt_id")
+        if prompt_id in self.running:
+            self._renders.pop(prompt_id).cancel()
+            self.interrupted.append(prompt_id)
+        return JSONResponse({})
+
+    async def get_history(self, request):
+        await self._track(request)
+        prompt_id = request.path_params["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return JSONResponse({prompt_id: entry} if entry else {})
+
+    async def view(self, request):
+        await self._track(request)
+        data = self.files.get(request.query_params["filename"])
+        if data is None:
+            return Response(status_code=404)
+        return Response(data, media_type="image/png")
+
+    async def ws(self, websocket):
+        client_id = websocket.query_params.get("clientId")
+        await websocket.accept()
+        self.clients[client_id] = websocket
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            self.clients.pop(client_id, None)
@@ -1,6 +1,20 @@
+import time
 import app.services.image_generation as imgsvc
 
 
+def wait_for_job(client, job, token, timeout=5):
+    """Poll the job status endpoint until the generation job finishes."""
+    deadline = time.time() + timeout
+    while True:
+        r = client.get(f"/comfy/jobs/{job['id']}", headers={'Authorization': f'Bearer {token}'})
+        assert r.status_code == 200
+        data = r.json()
+        if data['status'] in ('done', 'failed', 'cancelled'):
+            return data
+        assert time.time() < deadline, f"job {job['id']} did not finish"
+        time.sleep(0.02)
+
+
 def test_generate_image_endpoint(client, monkeypatch):
     # monkeypatch the external generator to avoid calling ComfyUI
     def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
@@ -11,8 +25,10 @@ def test_generate_image_endpoint(client, monkeypatch):
     payload = {"promptText": "una escena bonita"}
     headers = {"Authorization": f"Bearer {client.patient_token}"}
     r = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload, headers=headers)
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    resp = job['result']
     assert resp['file'] == 'fake.png'
 
 
@@ -41,8 +57,10 @@ def test_generate_with_seed(client, monkeypatch):
     payload = {"promptText": "prueba con seed", "seed": 12345}
     headers = {"Authorization": f"Bearer {client.patient_token}"}
     r = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload, headers=headers)
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    resp = job['result']
     assert resp['file'] == 'fake_seed.png'
     assert called.get('seed') == 12345
 
@@ -60,8 +78,10 @@ def test_generate_from_existing_image(client, monkeypatch):
     img_url = "/images/uploaded_images/test_upload.png"
     payload = {"promptText": "usar imagen existente", "inputImage": img_url}
     r = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    resp = job['result']
     assert resp['file'] == 'from_img.png'
     assert recorded.get('input_img') == img_url
 
@@ -83,8 +103,8 @@ def test_regenerate_maintaining_seed_flow(client, monkeypatch):
     # initial generation (no seed)
     payload1 = {"promptText": "generar sin seed"}
     r1 = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload1, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r1.status_code == 200
-    resp1 = r1.json()
+    assert r1.status_code == 202
+    resp1 = wait_for_job(client, r1.json(), client.patient_token)['result']
     assert resp1['file'] == 'first.png'
     seed_generated = resp1.get('seed')
     assert seed_generated == 999
@@ -92,8 +112,8 @@ def test_regenerate_maintaining_seed_flow(client, monkeypatch):
     # regenerate using the returned seed
     payload2 = {"promptText": "regenerar", "seed": seed_generated}
     r2 = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload2, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r2.status_code == 200
-    resp2 = r2.json()
+    assert r2.status_code == 202
+    resp2 = wait_for_job(client, r2.json(), client.patient_token)['result']
     assert resp2['file'] == 'later.png'
     # ensure the fake received the seed on the second call
     assert calls[1][1] == 999
@@ -112,8 +132,10 @@ def test_generate_by_multiple_images_endpoint(client, monkeypatch):
 
     payload = {"data": [{"fileName": "template1.png"}, {"fileName": "template2.png"}], "count": 2}
     r = client.post(f'/comfy/users/{client.patient_id}/multiple-images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    resp = job['result']
     assert resp['file'] == 'mix.png'
     # backend should have forwarded the list (we expect the service fake to receive the list)
     assert isinstance(recorded.get('images'), list)
@@ -137,7 +159,10 @@ def test_generate_from_existing_image_not_found(monkeypatch, client):
 
     payload = {"promptText": "usar imagen", "inputImage": "/images/uploaded_images/doesnotexist.png"}
     r = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 400
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'failed'
+    assert job['status_code'] == 400
 
 
 def test_multiple_images_too_few_and_too_many(client, monkeypatch):
@@ -190,8 +215,10 @@ def test_generate_sketch_image_success(client, monkeypatch):
         "sketchText": "convertir este boceto en arte digital"
     }
     r = client.post(f'/comfy/users/{client.patient_id}/sketch-images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    resp = job['result']
     assert resp['file'] == 'generated_sketch_123.png'
     assert resp['seed'] == 7777
     assert recorded['input_img'] == payload['sketchImage']
@@ -226,7 +253,10 @@ def test_generate_sketch_image_empty_text(client, monkeypatch):
 
     payload = {"sketchImage": "http://127.0.0.1:8000/images/drawn_images/drawn_abc.png", "sketchText": ""}
     r = client.post(f'/comfy/users/{client.patient_id}/sketch-images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 400
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'failed'
+    assert job['status_code'] == 400
 
 
 def test_generate_sketch_image_invalid_image_url(client, monkeypatch):
@@ -243,7 +273,10 @@ def test_generate_sketch_image_invalid_image_url(client, monkeypatch):
         "sketchText": "convertir boceto"
     }
     r = client.post(f'/comfy/users/{client.patient_id}/sketch-images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    assert r.status_code == 404
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'failed'
+    assert job['status_code'] == 404
 
 
 def test_upload_drawn_image_success(client, monkeypatch):
@@ -319,8 +352,11 @@ def test_sketch_to_image_service_error(client, monkeypatch):
         "sketchText": "convertir boceto"
     }
     r = client.post(f'/comfy/users/{client.patient_id}/sketch-images/', json=payload, headers={'Authorization': f'Bearer {client.patient_token}'})
-    # Should return 503 service unavailable
-    assert r.status_code == 503
+    # The job should fail with 503 service unavailable
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'failed'
+    assert job['status_code'] == 503
 
 
 def test_sketch_preserves_seed_in_db(client, monkeypatch):
@@ -341,8 +377,11 @@ def test_sketch_preserves_seed_in_db(client, monkeypatch):
     }
     headers = {"Authorization": f"Bearer {client.patient_token}"}
     r = client.post(f'/comfy/users/{client.patient_id}/sketch-images/', json=payload, headers=headers)
-    assert r.status_code == 200
-    resp = r.json()
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    assert job['image']['fileName'] == 'generated_from_sketch_999.png'
+    resp = job['result']
     # Verify seed is returned
     assert resp.get('seed') == 8888
 
@@ -354,3 +393,198 @@ def test_sketch_preserves_seed_in_db(client, monkeypatch):
     matching = [img for img in images['data'] if img['fileName'] == 'generated_from_sketch_999.png']
     assert len(matching) > 0
     assert matching[0]['seed'] == 8888
+
+
+def test_generation_job_not_found_and_forbidden(client, monkeypatch):
+    """Jobs are only visible to the patient that queued them"""
+    def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
+        return {"message": "ok", "file": "owned.png", "fullPath": "/tmp/owned.png", "seed": 1}
+
+    monkeypatch.setattr(imgsvc, 'generar_imagen', fake_generar)
+
+    r = client.get('/comfy/jobs/doesnotexist', headers={'Authorization': f'Bearer {client.patient_token}'})
+    assert r.status_code == 404
+
+    r = client.post(f'/comfy/users/{client.patient_id}/images/', json={"promptText": "mío"}, headers={'Authorization': f'Bearer {client.patient_token}'})
+    assert r.status_code == 202
+    job = r.json()
+    assert job['status'] in ('queued', 'running', 'done')
+
+    r = client.get(f"/comfy/jobs/{job['id']}", headers={'Authorization': f'Bearer {client.therapist_token}'})
+    assert r.status_code == 403
+    assert wait_for_job(client, job, client.patient_token)['status'] == 'done'
+
+
+def test_generate_batch_registers_every_image(client, monkeypatch):
+    """count > 1 runs one batch generation and stores every image in the job result"""
+    calls = []
+
+    def fake_generar_imagenes(prompt_text, user_id, seeds, input_img=None):
+        calls.append(seeds)
+        return [
+            {"message": "ok", "file": f"batch-{i}.png", "fullPath": f"/tmp/batch-{i}.png", "seed": seed}
+            for i, seed in enumerate(seeds)
+        ]
+
+    monkeypatch.setattr(imgsvc, 'generar_imagenes', fake_generar_imagenes)
+    headers = {"Authorization": f"Bearer {client.patient_token}"}
+
+    payload = {"promptText": "tres variaciones", "count": 3, "seed": 10, "seedStride": 5}
+    r = client.post(f'/comfy/users/{client.patient_id}/images/', json=payload, headers=headers)
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json(), client.patient_token)
+    assert job['status'] == 'done', job['error']
+    assert calls == [[10, 15, 20]]
+    assert [res['file'] for res in job['results']] == ['batch-0.png', 'batch-1.png', 'batch-2.png']
+    assert [img['seed'] for img in job['images']] == [10, 15, 20]
+    assert len({img['id'] for img in job['images']}) == 3
+    assert job['result']['file'] == 'batch-0.png'
+
+    r = client.get(f'/comfy/users/{client.patient_id}/images', headers=headers)
+    assert {'batch-0.png', 'batch-1.png', 'batch-2.png'} <= {img['fileName'] for img in r.json()['data']}
+
+    r = client.post(f'/comfy/users/{client.patient_id}/images/', json={"promptText": "x", "seeds": [1, 2]}, headers=headers)
+    assert wait_for_job(client, r.json(), client.patient_token)['status'] == 'done'
+    assert calls[-1] == [1, 2]
+
+    r = client.post(f'/comfy/users/{client.patient_id}/images/', json={"promptText": "x", "count": imgsvc.GENERATION_MAX_BATCH + 1}, headers=headers)
+    assert r.status_code == 422
+
+    calls.clear()
+    for seeds in ([1, -1], [imgsvc.MAX_SQLITE_INT + 1], list(range(imgsvc.GENERATION_MAX_BATCH + 1))):
+        r = client.post(f'/comfy/users/{client.patient_id}/images/', json={"promptText": "x", "seeds": seeds}, headers=headers)
+        assert r.status_code == 422
+    r = client.post(f'/comfy/users/{client.patient_id}/images/', json={"promptText": "x", "seed": -1}, headers=headers)
+    assert r.status_code == 422
+    assert calls == []
+
+
+def test_identical_in_flight_requests_share_one_job(client, monkeypatch):
+    """A double-submitted prompt attaches to the running job instead of generating twice"""
+    import threading
+    release = threading.Event()
+    calls = []
+
+    def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
+        calls.append(prompt_text)
+        release.wait(5)
+        return {"message": "ok", "file": f"dup-{len(calls)}.png", "fullPath": "/tmp/dup.png", "seed": 1}
+
+    monkeypatch.setattr(imgsvc, 'generar_imagen', fake_generar)
+    headers = {"Authorization": f"Bearer {client.patient_token}"}
+    url = f'/comfy/users/{client.patient_id}/images/'
+
+    first = client.post(url, json={"promptText": "doble clic", "seed": 3}, headers=headers).json()
+    second = client.post(url, json={"seed": 3, "promptText": "doble clic"}, headers=headers).json()
+    other = client.post(url, json={"promptText": "otro prompt", "seed": 3}, headers=headers).json()
+    assert second['id'] == first['id']
+    assert other['id'] != first['id']
+
+    release.set()
+    assert wait_for_job(client, first, client.patient_token)['status'] == 'done'
+    wait_for_job(client, other, client.patient_token)
+    assert calls.count("doble clic") == 1
+    assert client.get("/metrics").json()["jobs"]["coalesced"] >= 1
+
+    # once finished, the same prompt is a new generation
+    third = client.post(url, json={"promptText": "doble clic", "seed": 3}, headers=headers).json()
+    assert third['id'] != first['id']
+    wait_for_job(client, third, client.patient_token)
+
+
+def test_idempotency_key_controls_deduplication(client, monkeypatch):
+    """The same Idempotency-Key replays the job, even after it finished; new keys force a new job"""
+    calls = []
+
+    def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
+        calls.append(prompt_text)
+        return {"message": "ok", "file": f"idem-{len(calls)}.png", "fullPath": "/tmp/idem.png"}
+
+    monkeypatch.setattr(imgsvc, 'generar_imagen', fake_generar)
+    url = f'/comfy/users/{client.patient_id}/images/'
+    auth = {"Authorization": f"Bearer {client.patient_token}"}
+
+    first = client.post(url, json={"promptText": "gato"}, headers={**auth, "Idempotency-Key": "k1"}).json()
+    wait_for_job(client, first, client.patient_token)
+    replay = client.post(url, json={"promptText": "gato"}, headers={**auth, "Idempotency-Key": "k1"})
+    assert replay.status_code == 202
+    assert replay.json()['id'] == first['id']
+    assert replay.json()['status'] == 'done'
+
+    fresh = client.post(url, json={"promptText": "gato"}, headers={**auth, "Idempotency-Key": "k2"}).json()
+    assert fresh['id'] != first['id']
+    wait_for_job(client, fresh, client.patient_token)
+    assert len(calls) == 2
+
+    r = client.post(url, json={"promptText": "perro"}, headers={**auth, "Idempotency-Key": "k1"})
+    assert r.status_code == 422
+
+
+def test_cancel_job_endpoint_and_session_end(client, monkeypatch):
+    """Jobs are cancelled by their owner or when the therapist ends their session"""
+    import threading
+    from datetime import datetime, timedelta
+    from app.services import cancellation
+    calls = []
+
+    def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
+        released = threading.Event()
+        cancellation.al_cancelar(released.set)
+        calls.append(prompt_text)
+        released.wait(5)
+        cancellation.comprobar()
+        return {"message": "ok", "file": "never.png", "fullPath": "/tmp/never.png"}
+
+    monkeypatch.setattr(imgsvc, 'generar_imagen', fake_generar)
+    patient = {"Authorization": f"Bearer {client.patient_token}"}
+    therapist = {"Authorization": f"Bearer {client.therapist_token}"}
+    url = f'/comfy/users/{client.patient_id}/images/'
+
+    job = client.post(url, json={"promptText": "cancelar"}, headers=patient).json()
+    assert client.post(f"/comfy/jobs/{job['id']}/cancel", headers=therapist).status_code == 403
+    r = client.post(f"/comfy/jobs/{job['id']}/cancel", headers=patient)
+    assert r.status_code == 200
+    done = wait_for_job(client, job, client.patient_token)
+    assert (done['status'], done['status_code']) == ('cancelled', 409)
+    assert done['error'] == "Generación cancelada: cancelada por el usuario"
+
+    now = datetime.utcnow()
+    r = client.post(f"/sessions/session/{client.patient_id}", headers=therapist,
+                    json={"start_date": now.isoformat(), "end_date": (now + timedelta(minutes=5)).isoformat()})
+    sid = r.json()['id']
+    in_session = client.post(f"{url}?session_id={sid}", json={"promptText": "en sesión"}, headers=patient).json()
+    assert client.post(f"/sessions/end/{sid}", headers=therapist).status_code == 200
+    ended = wait_for_job(client, in_session, client.patient_token)
+    assert ended['status'] == 'cancelled'
+    assert "la sesión ha finalizado" in ended['error']
+
+
+def test_only_active_sessions_get_session_priority(client, monkeypatch):
+    """Scheduled or overdue sessions queue as free mode; only an ongoing session gets priority"""
+    from datetime import datetime, timedelta
+
+    def fake_generar(prompt_text, user_id, prompt_seed=None, input_img=None):
+        return {"message": "ok", "file": "prio.png", "fullPath": "/tmp/prio.png"}
+
+    monkeypatch.setattr(imgsvc, 'generar_imagen', fake_generar)
+    patient = {"Authorization": f"Bearer {client.patient_token}"}
+    therapist = {"Authorization": f"Bearer {client.therapist_token}"}
+    url = f'/comfy/users/{client.patient_id}/images/'
+    now = datetime.utcnow()
+
+    def session(start, end):
+        r = client.post(f"/sessions/session/{client.patient_id}", headers=therapist,
+                        json={"start_date": start.isoformat(), "end_date": end.isoformat()})
+        assert r.status_code == 200
+        return r.json()['id']
+
+    cases = {
+        "free": session(now + timedelta(days=2), now + timedelta(days=2, hours=1)),  # scheduled
+        "session": session(now - timedelta(minutes=5), now + timedelta(minutes=30)),  # ongoing
+    }
+    for expected, sid in cases.items():
+        r = client.post(f"{url}?session_id={sid}", json={"promptText": f"prioridad {expected}"}, headers=patient)
+        assert r.status_code == 202
+        assert r.json()['priority'] == expected
+        wait_for_job(client, r.json(), client.patient_token)
+    client.post(f"/sessions/end/{cases['session']}", headers=therapist)
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+import app.services.comfy_client as comfy_client
+from app.dependencies import get_comfy_client
+from fake_comfy import FakeComfyUI
+from fastapi import HTTPException
+
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "generated1-abc"}},
+}
+
+
+@contextmanager
+def client_for(fake, **kwargs):
+    """Pooled client pointed at a fake ComfyUI, closed on exit"""
+    kwargs.setdefault("backoff", 0.01)
+    comfy = comfy_client.ComfyClient(fake.url, **kwargs)
+    try:
+        yield comfy
+    finally:
+        comfy.cerrar()
+
+
+@pytest.mark.parametrize("websocket", [True, False])
+def test_execute_workflow_downloads_output(tmp_path, websocket):
+    """Completion is detected through /ws events or /history polling and the output is fetched with /view"""
+    with FakeComfyUI(websocket=websocket) as fake, client_for(fake) as comfy:
+        imagen = comfy_client.ejecutar_workflow(WORKFLOW, tmp_path, timeout=10, comfy=comfy)
+
+        assert imagen.ruta == str(tmp_path / "generated1-abc_00001_.png")
+        data = fake.files["generated1-abc_00001_.png"]
+        with open(imagen.ruta, "rb") as f:
+            assert f.read() == data
+        # hash and size are computed while downloading
+        assert imagen.sha256 == hashlib.sha256(data).hexdigest()
+        assert (imagen.ancho, imagen.alto) == (8, 8)
+        # the prompt carries the client id used for the websocket subscription
+        (body,) = fake.prompts.values()
+        assert body["client_id"]
+        # no temporary files are left behind
+        assert os.listdir(tmp_path) == ["generated1-abc_00001_.png"]
+
+
+def test_execute_workflow_times_out(tmp_path):
+    """A render that never finishes returns None once the timeout is reached"""
+    with FakeComfyUI(delay=30) as fake, client_for(fake) as comfy:
+        assert comfy_client.ejecutar_workflow(WORKFLOW, tmp_path, timeout=0.3, comfy=comfy) is None
+
+
+def test_requests_reuse_pooled_connection():
+    """Sequential requests go over a single keep-alive connection"""
+    with FakeComfyUI() as fake, client_for(fake) as comfy:
+        for _ in range(5):
+            assert comfy.run(comfy.queue()) == {"queue_running": [], "queue_pending": []}
+
+        assert len(fake.peers) == 5
+        assert len(set(fake.peers)) == 1
+
+
+def test_prompt_retried_on_transient_errors():
+    """5xx answers are retried with backoff until ComfyUI accepts the prompt"""
+    with FakeComfyUI() as fake, client_for(fake, retries=3) as comfy:
+        fake.fail_prompts = 2
+        prompt_id = comfy.run(comfy.post_prompt(WORKFLOW))
+
+        assert prompt_id in fake.prompts
+        assert len(fake.peers) == 3
+
+
+def test_prompt_fails_after_exhausting_retries():
+    """Once the retries are exhausted the caller gets a 503"""
+    with FakeComfyUI() as fake, client_for(fake, retries=1) as comfy:
+        fake.fail_prompts = 5
+        with pytest.raises(HTTPException) as exc:
+            comfy.run(comfy.post_prompt(WORKFLOW))
+
+        assert exc.value.status_code == 503
+        assert len(fake.peers) == 2
+        assert fake.prompts == {}
+
+
+def test_connection_errors_are_retried_then_reported():
+    """An unreachable ComfyUI is retried and then reported as a 503"""
+    with FakeComfyUI() as fake:
+        url = fake.url
+    comfy = comfy_client.ComfyClient(url, retries=2, backoff=0.01)
+    try:
+        with pytest.raises(HTTPException) as exc:
+            comfy.run(comfy.post_prompt(WORKFLOW))
+        assert exc.value.status_code == 503
+    finally:
+        comfy.cerrar()
+
+
+def test_in_flight_requests_are_bounded():
+    """No more than max_in_flight requests reach ComfyUI at the same time"""
+    with FakeComfyUI(response_delay=0.1) as fake, client_for(fake, max_in_flight=2) as comfy:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(lambda _: comfy.run(comfy.queue()), range(6)))
+
+        assert len(results) == 6
+        assert fake.max_concurrent == 2
+
+
+def test_status_endpoint_uses_client_dependency(client):
+    """GET /comfy/status reports the queue of the injected ComfyUI client"""
+    with FakeComfyUI(delay=30) as fake, client_for(fake) as comfy:
+        client.app.dependency_overrides[get_comfy_client] = lambda: comfy
+        try:
+            comfy.run(comfy.post_prompt(WORKFLOW))
+            response = client.get("/comfy/status", headers={"Authorization": f"Bearer {client.therapist_token}"})
+        finally:
+            client.app.dependency_overrides.pop(get_comfy_client)
+
+    assert response.status_code == 200
+    assert response.json() == {"reachable": True, "running": 0, "pending": 1}
+
+
+def test_status_endpoint_reports_unreachable(client):
+    """GET /comfy/status answers reachable=false when ComfyUI is down"""
+    with FakeComfyUI() as fake:
+        url = fake.url
+    comfy = comfy_client.ComfyClient(url, retries=0)
+    client.app.dependency_overrides[get_comfy_client] = lambda: comfy
+    try:
+        response = client.get("/comfy/status", headers={"Authorization": f"Bearer {client.therapist_token}"})
+    finally:
+        client.app.dependency_overrides.pop(get_comfy_client)
+        comfy.cerrar()
+
+    assert response.status_code == 200
+    assert response.json()["reachable"] is False
+
+
+def test_execute_batch_downloads_every_output(tmp_path):
+    """A fanned-out workflow yields one downloaded image per SaveImage node"""
+    workflow = dict(WORKFLOW, **{
+        "10": {"class_type": "KSampler", "inputs": {"seed": 2}},
+        "11": {"class_type": "SaveImage", "inputs": {"filename_prefix": "generated1-abc-1"}},
+    })
+    with FakeComfyUI() as fake, client_for(fake) as comfy:
+        imagenes = comfy_client.ejecutar_workflow_lote(workflow, tmp_path, timeout=10, comfy=comfy)
+
+    assert sorted(i.nombre for i in imagenes) == ["generated1-abc-1_00001_.png", "generated1-abc_00001_.png"]
+    assert len(fake.prompts) == 1
+
+
+def test_cancel_interrupts_running_prompt_and_releases_waiter(tmp_path):
+    """Cancelling while ComfyUI renders interrupts that prompt and returns at once"""
+    from app.services.cancellation import Cancelacion, GeneracionCancelada, activa
+
+    with FakeComfyUI(delay=30, serial=True) as fake, client_for(fake) as comfy:
+        token = Cancelacion()
+
+        def run():
+            with activa(token):
+                comfy_client.ejecutar_workflow(WORKFLOW, tmp_path, timeout=30, comfy=comfy)
+
+        with ThreadPoolExecutor(1) as executor:
+            future = executor.submit(run)
+            deadline = time.time() + 5
+            while not fake.running:
+                assert time.time() < deadline
+                time.sleep(0.01)
+            start = time.time()
+            token.cancelar("test")
+            with pytest.raises(GeneracionCancelada):
+                future.result(timeout=5)
+            assert time.time() - start < 3
+        assert fake.interrupted == list(fake.prompts)
+
+
+def test_cancel_prompt_deletes_pending_and_interrupts_running():
+    """A queued prompt is deleted from the queue; only the running one is interrupted"""
+    with FakeComfyUI(delay=30, serial=True) as fake, client_for(fake) as comfy:
+        running = comfy.run(comfy.post_prompt(WORKFLOW))
+        pending = comfy.run(comfy.post_prompt(WORKFLOW))
+        deadline = time.time() + 5
+        while running not in fake.running:
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+        comfy.run(comfy.cancelar_prompt(pending))
+        assert (fake.deleted, fake.interrupted) == ([pending], [])
+        comfy.run(comfy.cancelar_prompt(running))
+        assert fake.interrupted == [running]
+        assert comfy.run(comfy.queue()) == {"queue_running": [], "queue_pending": []}
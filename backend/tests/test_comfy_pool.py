@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+import app.services.comfy_client as comfy_client
+from app.services.comfy_pool import ComfyPool, modelo_requerido
+from fake_comfy import FakeComfyUI, _free_port
+
+
+def workflow(prefix, ckpt="juggernautXL_ragnarokBy.safetensors"):
+    return {
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt}},
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1, "model": ["4", 0]}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": prefix}},
+    }
+
+
+def make_pool(urls, **kwargs):
+    return ComfyPool([comfy_client.ComfyClient(url, retries=0, backoff=0.01) for url in urls], health_interval=0, **kwargs)
+
+
+def run(pool, wf, tmp_path):
+    return pool.ejecutar(wf, lambda comfy: comfy_client.ejecutar_workflow_lote(wf, tmp_path, timeout=10, comfy=comfy))
+
+
+def test_least_outstanding_dispatch_and_per_node_download(tmp_path):
+    """Concurrent jobs spread over the nodes and each output is fetched from the node that rendered it"""
+    with ExitStack() as stack:
+        fakes = [stack.enter_context(FakeComfyUI(delay=0.3)) for _ in range(2)]
+        pool = make_pool([f.url for f in fakes])
+        stack.callback(pool.cerrar)
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda i: run(pool, workflow(f"job{i}"), tmp_path), range(4)))
+
+        assert [len(f.prompts) for f in fakes] == [2, 2]
+        assert sorted(imgs[0].nombre for imgs in results) == [f"job{i}_00001_.png" for i in range(4)]
+        assert all(n["outstanding"] == 0 and n["completed"] == 2 for n in pool.metricas())
+
+
+def test_failed_node_leaves_rotation_until_health_check(tmp_path):
+    """A node that rejects a prompt is skipped and the job fails over; a health check brings it back"""
+    with FakeComfyUI() as flaky, FakeComfyUI() as healthy:
+        flaky.fail_prompts = 1
+        pool = make_pool([flaky.url, healthy.url])
+        try:
+            assert run(pool, workflow("a"), tmp_path)[0].nombre == "a_00001_.png"
+            assert len(healthy.prompts) == 1
+            flaky_state = pool.metricas()[0]
+            assert not flaky_state["healthy"] and flaky_state["failures"] == 1
+
+            run(pool, workflow("b"), tmp_path)
+            assert len(healthy.prompts) == 2 and not flaky.prompts
+
+            pool.comprobar()
+            assert pool.metricas()[0]["healthy"]
+            # the healthy node has this checkpoint loaded, so use another one
+            run(pool, workflow("c", ckpt="other.safetensors"), tmp_path)
+            assert len(flaky.prompts) == 1
+        finally:
+            pool.cerrar()
+
+
+def test_unreachable_node_is_marked_down(tmp_path):
+    """Connection errors fail over and health checks keep the dead node out"""
+    dead = f"http://127.0.0.1:{_free_port()}"
+    with FakeComfyUI() as fake:
+        pool = make_pool([dead, fake.url])
+        try:
+            assert run(pool, workflow("a"), tmp_path)
+            pool.comprobar()
+            states = pool.metricas()
+            assert not states[0]["healthy"] and states[1]["healthy"]
+        finally:
+            pool.cerrar()
+
+
+def test_model_affinity():
+    """Nodes with the checkpoint loaded are preferred unless they are clearly busier"""
+    pool = make_pool(["http://a", "http://b"], afinidad=1)
+    a, b = pool.nodos
+    b.modelo = "juggernautXL_ragnarokBy.safetensors"
+    assert modelo_requerido(workflow("x")) == b.modelo
+
+    assert pool.elegir(workflow("x")) is b  # same load: affinity wins
+    assert pool.elegir(workflow("y")) is b  # one more job: within the slack
+    assert pool.elegir(workflow("z")) is a  # two more jobs: least outstanding wins
+    assert pool.elegir(workflow("w", ckpt="other.safetensors")) is a
@@ -0,0 +1,89 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app.schemas as schemas
+import app.services.derivatives as derivatives
+import app.services.image_generation as imgsvc
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    monkeypatch.setattr(derivatives, "CARPETA_IMAGENES", images)
+    monkeypatch.setattr(derivatives, "CARPETA_DERIVADAS", tmp_path / "derived")
+    monkeypatch.setattr(derivatives, "IMAGE_DERIVATIVE_SIZES", {"thumb": 64, "medium": 200})
+    monkeypatch.setattr(derivatives, "FORMATO", "webp")
+    return images
+
+
+def save_png(path, size=(800, 600)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size, (200, 100, 50)).save(path, format="PNG")
+    return path
+
+
+def test_generate_creates_every_size_once(folders):
+    """Each configured size is written as a downscaled WebP and reused while newer than the original"""
+    original = save_png(folders / "generated_images" / "generated1-abc_00001_.png")
+
+    rutas = derivatives.generar(original)
+
+    assert set(rutas) == {"thumb", "medium"}
+    for tamano, lado in (("thumb", 64), ("medium", 200)):
+        with Image.open(rutas[tamano]) as img:
+            assert img.format == "WEBP" and max(img.size) == lado
+    assert rutas["thumb"].parent.name == "generated_images"
+    assert os.path.getsize(rutas["thumb"]) < os.path.getsize(original)
+
+    mtime = rutas["thumb"].stat().st_mtime_ns
+    derivatives.generar(original)
+    assert rutas["thumb"].stat().st_mtime_ns == mtime
+
+
+def test_endpoint_serves_size_on_demand(client, folders):
+    """A derived URL creates the missing size on first request; bad sizes and names are 404"""
+    save_png(folders / "template_images" / "plantilla.png")
+
+    r = client.get("/derived/thumb/plantilla.png")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/webp"
+    assert max(Image.open(io.BytesIO(r.content)).size) == 64
+    assert derivatives.ruta_derivada("plantilla.png", "thumb").exists()
+
+    assert client.get("/derived/huge/plantilla.png").status_code == 404
+    assert client.get("/derived/thumb/missing.png").status_code == 404
+    assert client.get("/derived/thumb/..%2Fsecret.png").status_code == 404
+
+
+def test_image_schemas_expose_derived_urls():
+    """Image lists and generation responses carry the thumbnail and medium URLs"""
+    image = schemas.ImageOut(fileName="generated1-a b.png", seed=1, id=3).model_dump()
+    assert image["thumbnailUrl"] == "/derived/thumb/generated1-a%20b.png"
+    assert image["mediumUrl"] == "/derived/medium/generated1-a%20b.png"
+
+    response = schemas.ImageGenerationResponse(message="ok", file="drawn_x.png", fullPath="/tmp/drawn_x.png")
+    assert response.model_dump()["thumbnailUrl"] == "/derived/thumb/drawn_x.png"
+
+
+def test_drawn_upload_and_backfill(folders, monkeypatch):
+    """Saving a drawing schedules its derivatives; the backfill covers files saved before"""
+    monkeypatch.setattr(imgsvc, "CARPETA_DESTINO_DRAWN", folders / "drawn_images")
+    scheduled = []
+    monkeypatch.setattr(derivatives, "programar", lambda ruta: scheduled.append(derivatives.generar(ruta)))
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 300)).save(buffer, format="PNG")
+    buffer.seek(0)
+    upload = type("Upload", (), {"filename": "canvas.png", "file": buffer})()
+    result = imgsvc.publicar_dibujo(upload)
+    assert scheduled and scheduled[0]["thumb"].exists()
+    assert scheduled[0]["thumb"].stem == os.path.splitext(result["file"])[0]
+
+    save_png(folders / "uploaded_images" / "uploaded_image_old.png")
+    (folders / "uploaded_images" / "uploaded_image_broken.png").write_bytes(b"not an image")
+    (folders / "uploaded_images" / "notes.txt").write_text("skipped")
+    assert derivatives.rellenar() == (2, 1)
+    assert derivatives.ruta_derivada("uploaded_image_old.png", "medium").exists()
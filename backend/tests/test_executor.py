@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import app.crud as crud
+import app.main as main
+from app.services.executor import BlockingExecutor
+
+
+def test_blocking_calls_overlap_and_are_measured():
+    """Blocking calls run in parallel up to the pool size and update the metrics"""
+    executor = BlockingExecutor(workers=2, queue_limit=0)
+
+    async def run():
+        return await asyncio.gather(*(executor.ejecutar(time.sleep, 0.2) for _ in range(4)))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    elapsed = time.monotonic() - start
+
+    assert 0.35 < elapsed < 0.7
+    metrics = executor.metricas()
+    assert metrics["completed"] == 4
+    assert metrics["peak_active"] == 2
+    assert metrics["peak_queued"] >= 2
+    assert metrics["max_wait_ms"] > 100
+    assert metrics["active"] == metrics["queued"] == 0
+    executor.cerrar()
+
+
+def test_full_queue_is_rejected():
+    """Once queue_limit tasks are waiting further calls get a 503"""
+    executor = BlockingExecutor(workers=1, queue_limit=1)
+
+    async def run():
+        running = asyncio.ensure_future(executor.ejecutar(time.sleep, 0.2))
+        await asyncio.sleep(0.05)  # the first task now holds the only thread
+        waiting = asyncio.ensure_future(executor.ejecutar(time.sleep, 0))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc:
+            await executor.ejecutar(time.sleep, 0)
+        await asyncio.gather(running, waiting)
+        return exc.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert executor.metricas()["rejected"] == 1
+    executor.cerrar()
+
+
+def test_cancelled_queued_call_leaves_the_queue():
+    """A request cancelled while its task is still queued does not leak the queued counter"""
+    executor = BlockingExecutor(workers=1, queue_limit=1)
+    calls = []
+
+    async def run():
+        running = asyncio.ensure_future(executor.ejecutar(time.sleep, 0.2))
+        await asyncio.sleep(0.05)  # the first task now holds the only thread
+        waiting = asyncio.ensure_future(executor.ejecutar(calls.append, "never"))
+        await asyncio.sleep(0)
+        assert executor.metricas()["queued"] == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert executor.metricas()["queued"] == 0
+        await executor.ejecutar(time.sleep, 0)  # the queue has room again
+        await running
+
+    asyncio.run(run())
+    metrics = executor.metricas()
+    assert metrics["queued"] == metrics["active"] == 0
+    assert metrics["completed"] == 2
+    assert calls == []
+    executor.cerrar()
+
+
+def test_concurrent_requests_overlap(client, monkeypatch):
+    """Slow CRUD calls from concurrent requests no longer serialize the event loop"""
+    def slow_templates():
+        time.sleep(0.2)
+        return []
+
+    monkeypatch.setattr(crud.comfy, "get_template_images", slow_templates)
+    completed_before = client.get("/metrics").json()["executor"]["completed"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.get("/comfy/template-images") for _ in range(4)))
+
+    start = time.monotonic()
+    responses = asyncio.run(run())
+    elapsed = time.monotonic() - start
+
+    assert all(r.status_code == 200 for r in responses)
+    assert elapsed < 0.6  # 0.8 s if the four calls ran one after another
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.json()["executor"]["completed"] - completed_before >= 4
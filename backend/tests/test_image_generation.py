@@ -0,0 +1,205 @@
+import hashlib
+import io
+import os
+import time
+
+from PIL import Image
+
+import app.services.image_generation as imgsvc
+from app.services.staging import StagingArea
+from app.services.translation import NoopBackend, TranslationService
+from app.services.ingestion import ImagenIngerida, imagen_completa, ingerir
+from app.services.result_cache import ResultCache
+
+
+def png_bytes(size=(4, 3)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (10, 20, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fake_imagen(prefix):
+    name = f"{prefix}_00001_.png"
+    return ImagenIngerida(f"/tmp/{name}", name, "0" * 64, 10, 8, 8)
+
+
+def test_dispatcher_routes_files_by_prefix(tmp_path):
+    """A single watcher resolves each waiter with the file carrying its prefix"""
+    dispatcher = imgsvc.DespachadorImagenes()
+    dispatcher.iniciar(str(tmp_path))
+    try:
+        first = dispatcher.registrar("generated1")
+        second = dispatcher.registrar("generated2")
+
+        (tmp_path / "generated2_00001_.png").write_bytes(png_bytes())
+        (tmp_path / "generated1_00001_.png").write_bytes(png_bytes())
+        (tmp_path / "unrelated_00001_.png").write_bytes(png_bytes())
+
+        assert first.result(timeout=5).endswith("generated1_00001_.png")
+        assert second.result(timeout=5).endswith("generated2_00001_.png")
+        assert dispatcher.pendientes == 0
+    finally:
+        dispatcher.detener()
+
+
+def test_wait_timeout_releases_registration(tmp_path, monkeypatch):
+    """A timed out wait leaves no pending registration behind"""
+    dispatcher = imgsvc.DespachadorImagenes()
+    dispatcher.iniciar(str(tmp_path))
+    monkeypatch.setattr(imgsvc, 'despachador', dispatcher)
+    try:
+        assert imgsvc.esperar_imagen("generated9", timeout=0.1) is None
+        assert dispatcher.pendientes == 0
+    finally:
+        dispatcher.detener()
+
+
+def test_concurrent_generations_use_unique_prefixes(monkeypatch):
+    """Two renders for the same patient never share a SaveImage prefix"""
+    sent = []
+
+    def fake_enviar(workflow, prefix):
+        assert workflow["9"]["inputs"]["filename_prefix"] == prefix
+        sent.append(prefix)
+        return fake_imagen(prefix)
+
+    monkeypatch.setattr(imgsvc.translation, 'traductor', TranslationService(NoopBackend(), cache_file=None))
+    monkeypatch.setattr(imgsvc, '_enviar_workflow', fake_enviar)
+
+    first = imgsvc.generar_imagen("un gato", user_id=7)
+    second = imgsvc.generar_imagen("un gato", user_id=7)
+
+    assert len(set(sent)) == 2
+    assert all(prefix.startswith("generated7") for prefix in sent)
+    assert first["file"] != second["file"]
+
+
+def test_img2img_stages_input_by_hash(tmp_path, monkeypatch):
+    """The LoadImage node receives the staged name and the reference is released afterwards"""
+    area = StagingArea(tmp_path / "input")
+    source = imgsvc.CARPETA_TEMPLATES / sorted(os.listdir(imgsvc.CARPETA_TEMPLATES))[0]
+    staged = []
+
+    def fake_enviar(workflow, prefix):
+        name = workflow["10"]["inputs"]["image"]
+        assert area.en_uso(name)
+        staged.append(name)
+        return fake_imagen(prefix)
+
+    monkeypatch.setattr(imgsvc, 'entradas', area)
+    monkeypatch.setattr(imgsvc.translation, 'traductor', TranslationService(NoopBackend(), cache_file=None))
+    monkeypatch.setattr(imgsvc, '_enviar_workflow', fake_enviar)
+
+    for _ in range(2):
+        imgsvc.generar_imagen("un gato", user_id=7, input_img=f"images/template_images/{source.name}")
+
+    assert staged[0] == staged[1]
+    assert staged[0].startswith("staged-")
+    assert not area.en_uso(staged[0])
+    assert area.copias == 1
+
+
+def test_dispatcher_waits_for_complete_file(tmp_path):
+    """A file still being written is only dispatched once its PNG trailer lands"""
+    dispatcher = imgsvc.DespachadorImagenes()
+    dispatcher.iniciar(str(tmp_path))
+    try:
+        waiter = dispatcher.registrar("generated3")
+        data = png_bytes()
+        path = tmp_path / "generated3_00001_.png"
+        with open(path, "wb") as f:
+            f.write(data[:20])
+            f.flush()
+            time.sleep(0.3)
+            assert not waiter.done()
+            f.write(data[20:])
+
+        assert waiter.result(timeout=5) == str(path)
+    finally:
+        dispatcher.detener()
+
+
+def test_ingest_moves_and_reports_hash_and_size(tmp_path):
+    """Ingestion renames the render into storage and measures it in the same pass"""
+    source_dir, storage = tmp_path / "output", tmp_path / "storage"
+    source_dir.mkdir()
+    data = png_bytes((5, 7))
+    source = source_dir / "generated1-a_00001_.png"
+    source.write_bytes(data)
+    assert imagen_completa(str(source))
+    assert not imagen_completa(str(tmp_path / "missing.png"))
+
+    imagen = ingerir(str(source), storage, mover=True)
+
+    assert not source.exists()
+    assert imagen.ruta == str(storage / source.name)
+    assert imagen.sha256 == hashlib.sha256(data).hexdigest()
+    assert (imagen.ancho, imagen.alto, imagen.tamano) == (5, 7, len(data))
+
+
+def test_ingest_copy_is_atomic(tmp_path):
+    """When renaming is not possible the file is streamed and published with a rename"""
+    source = tmp_path / "generated1-b_00001_.png"
+    source.write_bytes(png_bytes())
+    storage = tmp_path / "storage"
+
+    imagen = ingerir(str(source), storage, mover=False)
+
+    assert source.exists()
+    assert os.listdir(storage) == [source.name]
+    assert (storage / source.name).read_bytes() == source.read_bytes()
+    assert (imagen.ancho, imagen.alto) == (4, 3)
+
+
+def test_batch_generation_submits_one_workflow(monkeypatch):
+    """N variations go out in a single workflow with one seed and prefix per branch"""
+    sent = []
+
+    def fake_lote(workflow, prefijos):
+        sent.append(workflow)
+        saves = {n["inputs"]["filename_prefix"] for n in workflow.values() if n["class_type"] == "SaveImage"}
+        assert saves == set(prefijos)
+        # the last render did not arrive in time
+        return [fake_imagen(p) for p in prefijos[:-1]] + [None]
+
+    monkeypatch.setattr(imgsvc.translation, 'traductor', TranslationService(NoopBackend(), cache_file=None))
+    monkeypatch.setattr(imgsvc, '_enviar_workflow_lote', fake_lote)
+
+    results = imgsvc.generar_imagenes("un gato", user_id=7, seeds=[11, 22, 33])
+
+    assert len(sent) == 1
+    assert sorted(n["inputs"]["seed"] for n in sent[0].values() if "seed" in n["inputs"]) == [11, 22, 33]
+    assert [r["seed"] for r in results] == [11, 22]
+    assert imgsvc.semillas_lote(3, seed=5, stride=2) == [5, 7, 9]
+    assert imgsvc.semillas_lote(2, seeds=[4, 8]) == [4, 8]
+    assert len(imgsvc.semillas_lote(4)) == 4
+
+
+def test_seeded_generation_served_from_result_cache(tmp_path, monkeypatch):
+    """Repeating a prompt with the same seed reuses the stored file without calling ComfyUI"""
+    rendered = []
+
+    def fake_renderizar(workflow, prefijos):
+        rendered.append(list(prefijos))
+        imagenes = []
+        for prefix in prefijos:
+            path = tmp_path / f"{prefix}_00001_.png"
+            path.write_bytes(png_bytes())
+            imagenes.append(ImagenIngerida(str(path), path.name, "0" * 64, path.stat().st_size, 4, 3))
+        return imagenes
+
+    monkeypatch.setattr(imgsvc.result_cache, 'cache', ResultCache(cache_file=None))
+    monkeypatch.setattr(imgsvc.translation, 'traductor', TranslationService(NoopBackend(), cache_file=None))
+    monkeypatch.setattr(imgsvc, '_renderizar_lote', fake_renderizar)
+
+    first = imgsvc.generar_imagen("un gato", user_id=7, prompt_seed=42)
+    second = imgsvc.generar_imagen("un gato", user_id=8, prompt_seed=42)
+    assert second["file"] == first["file"]
+    assert len(rendered) == 1
+
+    # a batch only renders the seeds that are not cached yet
+    results = imgsvc.generar_imagenes("un gato", user_id=7, seeds=[42, 43])
+    assert [r["seed"] for r in results] == [42, 43]
+    assert results[0]["file"] == first["file"]
+    assert len(rendered) == 2 and len(rendered[1]) == 1
+    assert imgsvc.result_cache.cache.metricas()["hits"] == 2
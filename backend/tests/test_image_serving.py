@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+import app.services.derivatives as derivatives
+import app.services.image_serving as image_serving
+from app.services.image_serving import HuellasContenido, ImagenesEstaticas, RespuestaImagen
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_serving, "huellas", HuellasContenido())
+    (tmp_path / "generated_images").mkdir()
+    (tmp_path / "template_images").mkdir()
+    content = os.urandom(300_000)
+    (tmp_path / "generated_images" / "generated1-abc_00001_.png").write_bytes(content)
+    (tmp_path / "template_images" / "plantilla.png").write_bytes(b"template")
+    app = Starlette(routes=[Mount("/images", ImagenesEstaticas(directory=str(tmp_path)))])
+    return TestClient(app), content
+
+
+def test_finalized_images_are_immutable_with_content_etag(images):
+    """Generated images carry a SHA-256 ETag and a one-year immutable Cache-Control"""
+    client, content = images
+    r = client.get("/images/generated_images/generated1-abc_00001_.png")
+    assert r.status_code == 200 and r.content == content
+    assert r.headers["etag"] == f'"{hashlib.sha256(content).hexdigest()}"'
+    assert r.headers["cache-control"] == image_serving.CACHE_INMUTABLE
+    assert r.headers["content-type"] == "image/png"
+
+    template = client.get("/images/template_images/plantilla.png")
+    assert template.headers["cache-control"] == image_serving.CACHE_REVALIDAR
+
+
+def test_if_none_match_returns_304_without_rehashing(images):
+    """A revalidation with the current ETag gets an empty 304 and the hash is reused"""
+    client, _ = images
+    etag = client.get("/images/generated_images/generated1-abc_00001_.png").headers["etag"]
+
+    r = client.get("/images/generated_images/generated1-abc_00001_.png", headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert r.status_code == 304 and r.content == b""
+    assert r.headers["etag"] == etag and "immutable" in r.headers["cache-control"]
+    assert image_serving.huellas.metricas()["hashed"] == 1
+
+    assert client.get("/images/generated_images/missing.png").status_code == 404
+    assert client.post("/images/generated_images/generated1-abc_00001_.png").status_code == 405
+
+
+def test_range_requests_return_partial_content(images):
+    """Range requests are answered with 206 and only the requested bytes"""
+    client, content = images
+    r = client.get("/images/generated_images/generated1-abc_00001_.png", headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.content == content[100:200]
+    assert r.headers["content-range"] == f"bytes 100-199/{len(content)}"
+
+
+def test_etag_follows_file_changes(tmp_path):
+    """A rewritten file gets a new ETag; an unchanged one is served from memory"""
+    path = tmp_path / "a.png"
+    path.write_bytes(b"first")
+    huellas = HuellasContenido(capacidad=1)
+    first = huellas.calcular(str(path), path.stat())
+    assert huellas.buscar(str(path), path.stat()) == first
+
+    path.write_bytes(b"second version")
+    assert huellas.buscar(str(path), path.stat()) is None
+    assert huellas.calcular(str(path), path.stat()) != first
+
+
+def test_pathsend_lets_the_server_send_the_file(tmp_path):
+    """With the pathsend extension the body is handed to the ASGI server instead of read in Python"""
+    path = tmp_path / "a.png"
+    path.write_bytes(b"x" * 10)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    scope = {"type": "http", "method": "GET", "headers": [], "extensions": {"http.response.pathsend": {}}}
+    asyncio.run(RespuestaImagen(str(path), stat_result=path.stat())(scope, receive, send))
+    assert [m["type"] for m in sent] == ["http.response.start", "http.response.pathsend"]
+    assert sent[1]["path"] == str(path)
+
+
+def test_app_mount_revalidates_templates(client):
+    """The application's /images mount uses the same ETag and Cache-Control policy"""
+    name = sorted(os.listdir(derivatives.CARPETA_IMAGENES / "template_images"))[0]
+    r = client.get(f"/images/template_images/{name}")
+    assert r.status_code == 200 and r.headers["cache-control"] == image_serving.CACHE_REVALIDAR
+    assert client.get(f"/images/template_images/{name}", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
@@ -0,0 +1,148 @@
+import threading
+
+from app.services.jobs import PRIORIDAD_LIBRE, PRIORIDAD_SESION, ColaJusta, GenerationJob, JobManager
+
+
+def make_job(name, user_id, prioridad=PRIORIDAD_LIBRE):
+    return GenerationJob(id=name, kind="txt2img", user_id=user_id, session_id=None, task=None, prioridad=prioridad)
+
+
+def drain(cola):
+    order = []
+    while True:
+        with cola._cond:
+            job = cola._extraer()
+        if job is None:
+            return order
+        order.append(job.id)
+
+
+def test_session_jobs_first_then_round_robin_between_users():
+    """Live-session jobs jump the queue and users take turns within a priority level"""
+    cola = ColaJusta(max_por_usuario=0)
+    for i in range(3):
+        cola.poner(make_job(f"a{i}", user_id=1))
+    cola.poner(make_job("b0", user_id=2))
+    cola.poner(make_job("b1", user_id=2))
+    cola.poner(make_job("s0", user_id=3, prioridad=PRIORIDAD_SESION))
+
+    assert cola.posicion(cola._niveles[PRIORIDAD_LIBRE][1][2]) == 6
+    assert [cola.posicion(j) for j in cola._niveles[PRIORIDAD_LIBRE][2]] == [3, 5]
+    assert drain(cola) == ["s0", "a0", "b0", "a1", "b1", "a2"]
+
+
+def test_per_user_cap_lets_other_users_through():
+    """A user at the in-flight cap is skipped until one of their jobs finishes"""
+    cola = ColaJusta(max_por_usuario=1)
+    for name, user in (("a0", 1), ("a1", 1), ("b0", 2)):
+        cola.poner(make_job(name, user))
+
+    first = cola.siguiente()
+    second = cola.siguiente()
+    assert (first.id, second.id) == ("a0", "b0")
+    assert cola.metricas()["running_by_user"] == {1: 1, 2: 1}
+
+    got = []
+    worker = threading.Thread(target=lambda: got.append(cola.siguiente()))
+    worker.start()
+    worker.join(timeout=0.2)
+    assert worker.is_alive()  # a1 waits for a0
+
+    cola.terminar(first)
+    worker.join(timeout=2)
+    assert got[0].id == "a1"
+    cola.detener(1)
+    assert cola.siguiente() is None
+
+
+def test_manager_reports_queue_position():
+    """Queued jobs expose their position and priority; metrics split the queue by priority"""
+    manager = JobManager(workers=1)
+    manager._threads = [object()]  # keep the jobs queued: no worker is started
+    release = threading.Event()
+
+    def task(db):
+        release.wait(5)
+        return {"message": "ok", "file": "x.png", "fullPath": "/tmp/x.png"}
+
+    free = manager.submit("multimg", 1, None, task)
+    live = manager.submit("txt2img", 2, 10, task, prioridad=PRIORIDAD_SESION)
+
+    assert manager.describir(live)["queue_position"] == 1
+    assert manager.describir(free)["queue_position"] == 2
+    assert manager.describir(live)["priority"] == "session"
+    metrics = manager.metricas()
+    assert metrics["queued_by_priority"] == {"session": 1, "free": 1}
+    assert metrics["waiting_users"] == 2
+
+
+def test_model_affinity_overtakes_within_window():
+    """Jobs that reuse the loaded models go first, but a job is overtaken at most `ventana` times"""
+    sdxl, sketch = frozenset({"sdxl"}), frozenset({"sdxl", "controlnet"})
+    cola = ColaJusta(max_por_usuario=0, ventana=2)
+    for name, user, models in (("a0", 1, sdxl), ("b0", 2, sketch), ("c0", 3, sdxl), ("d0", 4, sdxl), ("e0", 5, sdxl)):
+        job = make_job(name, user)
+        job.modelos = models
+        cola.poner(job)
+
+    # b0 would switch models: c0 and d0 overtake it, then its window is exhausted
+    assert drain(cola) == ["a0", "c0", "d0", "b0", "e0"]
+    metrics = cola.metricas()
+    assert (metrics["affinity_picks"], metrics["model_switches"]) == (2, 2)
+
+    plain = ColaJusta(max_por_usuario=0, ventana=0)
+    for name, user, models in (("a0", 1, sdxl), ("b0", 2, sketch), ("c0", 3, sdxl)):
+        job = make_job(name, user)
+        job.modelos = models
+        plain.poner(job)
+    assert drain(plain) == ["a0", "b0", "c0"]
+
+
+def test_manager_reports_latency_by_kind():
+    """Finished jobs feed the per-kind wait and run latency figures"""
+    manager = JobManager(workers=1)
+    jobs = [manager.submit(kind, 1, None, lambda db: {"message": "ok"}) for kind in ("txt2img", "txt2img", "multimg")]
+    for job in jobs:
+        assert job.finished.wait(5)
+    latency = manager.metricas()["latency_by_kind"]
+    manager.stop()
+
+    assert latency["txt2img"]["count"] == 2 and latency["multimg"]["count"] == 1
+    assert set(latency["multimg"]) == {"count", "wait_ms_avg", "wait_ms_p95", "run_ms_avg", "total_ms_p50", "total_ms_p95"}
+
+
+def test_cancel_queued_and_running_jobs():
+    """A queued job leaves the queue at once; a running one is released through its cancellation actions"""
+    from app.schemas import JobStatus
+    from app.services import cancellation
+
+    manager = JobManager(workers=1)
+    started = threading.Event()
+
+    def task(db):
+        released = threading.Event()
+        cancellation.al_cancelar(released.set)
+        started.set()
+        released.wait(5)
+        cancellation.comprobar()
+        return {"message": "ok"}
+
+    running = manager.submit("txt2img", 1, 7, task)
+    queued = manager.submit("txt2img", 1, 7, task)
+    other = manager.submit("txt2img", 2, 8, task)
+    assert started.wait(5)
+
+    assert manager.cancelar(queued, "test")
+    assert queued.status == JobStatus.cancelled and queued.finished.is_set()
+    assert not manager.cancelar(queued, "test")
+
+    assert manager.cancelar_sesion(7, "la sesión ha finalizado") == 1
+    assert running.finished.wait(5)
+    assert running.status == JobStatus.cancelled
+    assert running.to_dict()["error"] == "Generación cancelada: la sesión ha finalizado"
+
+    assert manager.cancelar_sesion(8, "test", user_id=3) == 0
+    manager.cancelar(other, "test")
+    assert other.finished.wait(5)
+    assert manager.metricas()["cancelled"] == 3
+    manager.stop()
@@ -0,0 +1,97 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import app.migrations as migrations
+import app.models as models
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    yield engine
+    engine.dispose()
+
+
+def schema(engine, tables=("users", "sessions", "images")):
+    inspector = inspect(engine)
+    return {
+        table: (
+            sorted(column["name"] for column in inspector.get_columns(table)),
+            sorted(index["name"] for index in inspector.get_indexes(table)),
+        )
+        for table in tables
+    }
+
+
+def test_upgrade_builds_the_model_schema(engine, tmp_path):
+    """Migrating an empty database yields exactly the tables, columns and indexes of the models"""
+    assert migrations.actualizar(engine) == [1, 2, 3]
+    assert migrations.version_actual(engine) == migrations.version_final()
+
+    reference = create_engine(f"sqlite:///{tmp_path / 'reference.db'}")
+    models.Base.metadata.create_all(bind=reference)
+    assert schema(engine) == schema(reference)
+    reference.dispose()
+
+    assert migrations.actualizar(engine) == []
+
+
+def test_downgrade_steps_back(engine):
+    """Downgrading undoes migrations one by one; version 0 leaves an empty database"""
+    migrations.actualizar(engine)
+
+    assert migrations.revertir(engine, 1) == [3, 2]
+    assert "ix_images_owner_file" not in schema(engine)["images"][1]
+    assert migrations.version_actual(engine) == 1
+
+    assert migrations.revertir(engine, 0) == [1]
+    assert inspect(engine).get_table_names() == []
+    assert migrations.version_actual(engine) == 0
+
+
+def test_database_created_before_migrations_is_adopted(engine):
+    """A create_all database without version table is stamped as version 1 and keeps its rows"""
+    migrations._tablas_iniciales().create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (email, full_name, hashed_password, type) VALUES ('a@x.com', 'A', 'x', 'patient')"))
+
+    assert migrations.version_actual(engine) == 1
+    assert migrations.actualizar(engine) == [2, 3]
+    assert "ix_sessions_patient_open" in schema(engine)["sessions"][1]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM users")).scalar() == 1
+
+
+def test_online_upgrade_builds_indexes_one_by_one(engine, monkeypatch):
+    """Online mode builds indexes after the migration transaction and records the version last"""
+    migrations.actualizar(engine, hasta=1)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX ix_images_session ON images (session_id)")  # left by an interrupted run
+
+    built = []
+    original = migrations._construir_en_linea
+
+    def spy(engine, indices):
+        assert migrations.version_actual(engine) == 1
+        built.extend(name for name, _, _ in indices)
+        original(engine, indices)
+
+    monkeypatch.setattr(migrations, "_construir_en_linea", spy)
+    assert migrations.actualizar(engine, en_linea=True) == [2, 3]
+    assert len(built) == 6
+    assert migrations.version_actual(engine) == 3
+    assert "ix_sessions_open_end" in schema(engine)["sessions"][1]
+
+
+def test_startup_check(engine, monkeypatch):
+    """Startup refuses a pending schema unless auto-migration is on, and a schema newer than the code"""
+    with pytest.raises(RuntimeError, match="migrate.py upgrade"):
+        migrations.comprobar(engine, auto=False)
+
+    migrations.comprobar(engine, auto=True)
+    assert migrations.version_actual(engine) == migrations.version_final()
+    migrations.comprobar(engine, auto=False)
+
+    monkeypatch.setattr(migrations, "MIGRACIONES", migrations.MIGRACIONES[:1])
+    with pytest.raises(RuntimeError, match="solo conoce"):
+        migrations.comprobar(engine, auto=False)
@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import io
+import time
+
+from PIL import Image
+
+import app.api.ws as ws_module
+import app.services.comfy_client as comfy_client
+from app.services import progress
+from app.services.progress import Progreso
+from fake_comfy import FakeComfyUI
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "progress-abc"}},
+}
+
+
+def preview_frame(size=512, kind=1):
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (10, 20, 30)).save(buffer, format="JPEG")
+    return kind.to_bytes(4, "big") + (1).to_bytes(4, "big") + buffer.getvalue()
+
+
+def decode(data_url):
+    header, encoded = data_url.split(",", 1)
+    return header, Image.open(io.BytesIO(base64.b64decode(encoded)))
+
+
+def test_steps_are_throttled_but_last_step_is_sent():
+    """Only one step message per interval goes out, and the final step always does"""
+    sent = []
+    reporter = Progreso(sent.append, intervalo=10)
+    for step in range(1, 31):
+        reporter.paso(step, 30, "3")
+
+    assert [m["step"] for m in sent] == [1, 30]
+    assert reporter.descartados == 28
+
+
+def test_previews_are_downscaled_and_throttled():
+    """Preview frames become small data URLs, at most one per interval; other frames are ignored"""
+    sent = []
+    reporter = Progreso(sent.append, intervalo_vista=10, tamano=64)
+    reporter.frame(preview_frame())
+    reporter.frame(preview_frame())
+    reporter.frame(preview_frame(kind=3))
+
+    (message,) = sent
+    header, image = decode(message["preview"])
+    assert header.startswith("data:image/")
+    assert max(image.size) == 64
+
+
+def test_api_mode_forwards_progress_and_previews(tmp_path):
+    """Progress events and preview frames of the awaited prompt reach the active reporter"""
+    sent = []
+    with FakeComfyUI(delay=0.25, steps=5) as fake:
+        comfy = comfy_client.ComfyClient(fake.url, backoff=0.01)
+        try:
+            with progress.activo(Progreso(sent.append, intervalo=0, intervalo_vista=0, tamano=64)):
+                assert comfy_client.ejecutar_workflow(WORKFLOW, tmp_path, timeout=10, comfy=comfy)
+        finally:
+            comfy.cerrar()
+
+    assert [m["step"] for m in sent if "step" in m] == [1, 2, 3, 4, 5]
+    assert sum("preview" in m for m in sent) == 5
+
+
+def test_listener_forwards_progress_without_waiting_for_completion():
+    """In filesystem mode a background listener follows the prompt's events"""
+    sent = []
+    with FakeComfyUI(delay=0.25, steps=3) as fake:
+        comfy = comfy_client.ComfyClient(fake.url, backoff=0.01)
+        try:
+            with progress.activo(Progreso(sent.append, intervalo=0, intervalo_vista=0, tamano=32)):
+                listener = comfy_client.OyenteProgreso.abrir(comfy)
+            prompt_id = comfy.run(comfy.post_prompt(WORKFLOW, listener.client_id))
+            listener.seguir(prompt_id)
+            deadline = time.time() + 5
+            while prompt_id not in fake.history:
+                assert time.time() < deadline
+                time.sleep(0.02)
+            listener.cerrar()
+        finally:
+            comfy.cerrar()
+
+    assert [m["step"] for m in sent if "step" in m] == [1, 2, 3]
+    assert comfy_client.OyenteProgreso.abrir(comfy) is None  # no active reporter
+
+
+class SlowSocket:
+    def __init__(self, delay):
+        self.delay = delay
+        self.messages = []
+
+    async def send_text(self, text):
+        await asyncio.sleep(self.delay)
+        self.messages.append(text)
+
+
+def test_relay_drops_progress_for_busy_sockets(monkeypatch):
+    """A socket still receiving a progress message skips newer ones; other sockets get them all"""
+    slow, fast = SlowSocket(0.2), SlowSocket(0)
+    monkeypatch.setitem(ws_module.active_sessions, 99, {"patient": slow, "therapist": fast})
+    update = {"job_id": "j", "user_id": 1, "session_id": 99, "kind": "txt2img", "steps": 30}
+
+    async def relay():
+        first = asyncio.create_task(ws_module.notify_job_progress({**update, "step": 1}))
+        await asyncio.sleep(0.05)
+        await ws_module.notify_job_progress({**update, "step": 2})
+        await first
+
+    asyncio.run(relay())
+    assert len(slow.messages) == 1 and len(fast.messages) == 2
+    assert ['"step": 1' in m for m in fast.messages] == [True, False]
+    assert '"event": "generation_progress"' in fast.messages[1]
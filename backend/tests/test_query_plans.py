@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.api.sessions as sessions_api
+import app.crud as crud
+import app.database as database
+import app.migrations as migrations
+import app.models as models
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    migrations.actualizar(engine)
+    session = sessionmaker(bind=engine)()
+    patient = models.Patient(email="p@x.com", full_name="P", hashed_password="x")
+    therapist = models.Therapist(email="t@x.com", full_name="T", hashed_password="x")
+    session.add_all([patient, therapist])
+    session.commit()
+    now = datetime.utcnow()
+    for offset in (-2, 0, 2):
+        session.add(models.Session(patient_id=patient.id, therapist_id=therapist.id,
+                                   start_date=now + timedelta(hours=offset) - timedelta(minutes=30),
+                                   end_date=now + timedelta(hours=offset) + timedelta(minutes=30)))
+    session.commit()
+    session.add(models.Image(fileName="generated1-a.png", owner_id=patient.id, session_id=2))
+    session.commit()
+    yield engine, session, patient, therapist
+    session.close()
+    engine.dispose()
+
+
+def capture_plans(engines, run):
+    """Runs the given calls and returns the query plan of every statement on sessions/images."""
+    engine = engines[0]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE")) and ("sessions" in statement or "images" in statement):
+            statements.append((statement, parameters))
+
+    for e in engines:
+        event.listen(e, "before_cursor_execute", record)
+    try:
+        run()
+    finally:
+        for e in engines:
+            event.remove(e, "before_cursor_execute", record)
+
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plans.append((statement, [row[-1] for row in rows]))
+    return plans
+
+
+def test_hot_session_and_image_queries_use_indexes(db):
+    """EXPLAIN QUERY PLAN of every hot lookup shows an index search, never a full table scan"""
+    engine, session, patient, therapist = db
+    async_engine = create_async_engine(database.url_asincrona(str(engine.url)))
+
+    async def run_async():
+        async with database.crear_sesiones_asincronas(async_engine)() as db_async:
+            await crud.session.finalize_expired_sessions_async(db_async)
+            for user in (patient, therapist):
+                await sessions_api.get_sessions_active_user(db_async, user)
+                await sessions_api.get_active_session(db_async, user)
+                await sessions_api.get_next_session(db_async, user)
+            await crud.session.get_images_for_session_async(db_async, 2)
+            await crud.comfy.get_images_for_user_async(db_async, patient.id)
+            await crud.user.get_images_for_user_no_session_async(db_async, patient.id)
+            await crud.comfy.link_image_to_session_async(db_async, "generated1-a.png", patient.id, 3)
+        await async_engine.dispose()
+
+    def run():
+        crud.session.finalize_expired_sessions(session)
+        for user in (patient, therapist):
+            crud.session.finalize_expired_sessions(session, user.id)
+        crud.session.get_images_for_session(session, 2)
+        crud.comfy.get_images_for_user(session, patient.id)
+        crud.user.get_images_for_user_no_session(session, patient.id)
+        crud.comfy.link_image_to_session(session, "generated1-a.png", patient.id, 3)
+        asyncio.run(run_async())
+
+    plans = capture_plans([engine, async_engine.sync_engine], run)
+    assert len(plans) >= 20
+    for statement, steps in plans:
+        scans = [step for step in steps if step.startswith("SCAN") and ("sessions" in step or "images" in step)]
+        assert not scans, f"{scans} in:\n{statement}"
+
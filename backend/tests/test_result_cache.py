@@ -0,0 +1,69 @@
+import app.services.workflows as workflows
+from app.services.ingestion import ImagenIngerida
+from app.services.result_cache import ResultCache, clave_resultado
+
+
+def stored_image(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return ImagenIngerida(str(path), name, "0" * 64, size, 8, 8)
+
+
+def txt2img(seed, prefix="generated1-a"):
+    return workflows.registro.get("txt2img").parchear({"3": {"seed": seed}, "9": {"filename_prefix": prefix}})
+
+
+def test_key_ignores_prefix_and_node_ids():
+    """The key depends on what is rendered, not on the request-specific prefix or the graph numbering"""
+    assert clave_resultado(txt2img(1, "generated1-a"), "9") == clave_resultado(txt2img(1, "generated2-b"), "9")
+    assert clave_resultado(txt2img(1), "9") != clave_resultado(txt2img(2), "9")
+
+    fanned = workflows.ramificar(txt2img(1), "3", [{}, {"3": {"seed": 2}}])
+    clone = next(node_id for node_id, n in fanned.items() if n["class_type"] == "SaveImage" and node_id != "9")
+    assert clave_resultado(fanned, clone) == clave_resultado(txt2img(2), "9")
+
+
+def test_key_requires_content_addressed_inputs():
+    """A LoadImage that does not point to a staged-<sha256> file is not cacheable"""
+    plantilla = workflows.registro.get("img2img")
+    staged = plantilla.parchear({"10": {"image": "staged-" + "a" * 64 + ".png"}})
+    other = plantilla.parchear({"10": {"image": "staged-" + "b" * 64 + ".png"}})
+    assert clave_resultado(staged, "9") != clave_resultado(other, "9")
+    assert clave_resultado(plantilla.parchear({"10": {"image": "photo.png"}}), "9") is None
+
+
+def test_lru_eviction_by_size(tmp_path):
+    """Least recently used entries are dropped once the indexed bytes exceed the limit"""
+    cache = ResultCache(max_bytes=250, cache_file=None)
+    cache.guardar("a", stored_image(tmp_path, "a.png"))
+    cache.guardar("b", stored_image(tmp_path, "b.png"))
+    assert cache.buscar("a").nombre == "a.png"
+    cache.guardar("c", stored_image(tmp_path, "c.png"))
+
+    assert cache.buscar("b") is None
+    assert cache.buscar("a") and cache.buscar("c")
+    stats = cache.metricas()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 200, 1)
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+
+def test_missing_file_invalidates_entry(tmp_path):
+    """An entry whose file was deleted or rewritten is a miss"""
+    cache = ResultCache(cache_file=None)
+    image = stored_image(tmp_path, "a.png")
+    cache.guardar("a", image)
+    (tmp_path / "a.png").unlink()
+
+    assert cache.buscar("a") is None
+    assert cache.metricas()["invalidated"] == 1
+    assert cache.metricas()["entries"] == 0
+
+
+def test_index_persists_across_restarts(tmp_path):
+    """A new cache instance reloads the index from disk"""
+    index = tmp_path / "index.json"
+    ResultCache(cache_file=str(index)).guardar("a", stored_image(tmp_path, "a.png"))
+
+    reloaded = ResultCache(cache_file=str(index))
+    assert reloaded.buscar("a") == stored_image(tmp_path, "a.png")
+    assert ResultCache(max_bytes=0, cache_file=str(index)).buscar("a") is None
@@ -0,0 +1,70 @@
+import os
+
+from app.services import staging
+from app.services.staging import StagingArea
+
+
+def make_source(path, data=b"template-png"):
+    path.write_bytes(data)
+    return path
+
+
+def test_same_content_is_staged_once(tmp_path):
+    """Repeated and duplicate inputs map to a single staged file"""
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    area = StagingArea(tmp_path / "input")
+    first = make_source(src_dir / "a.png")
+    copy = make_source(src_dir / "b.png")
+
+    names = [area.preparar(first), area.preparar(first), area.preparar(copy)]
+
+    assert len(set(names)) == 1
+    assert names[0] == f"staged-{staging.hash_archivo(first)}.png"
+    assert os.listdir(tmp_path / "input") == [names[0]]
+    assert (area.copias, area.reutilizados) == (1, 2)
+
+
+def test_hardlink_with_copy_fallback(tmp_path, monkeypatch):
+    """Inputs are hardlinked when possible and copied otherwise"""
+    src = make_source(tmp_path / "a.png")
+    area = StagingArea(tmp_path / "input")
+    name = area.preparar(src)
+    assert os.stat(tmp_path / "input" / name).st_ino == os.stat(src).st_ino
+
+    def no_link(*args):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(staging.os, "link", no_link)
+    other = make_source(tmp_path / "b.png", b"another")
+    name = area.preparar(other)
+    staged = tmp_path / "input" / name
+    assert staged.read_bytes() == b"another"
+    assert os.stat(staged).st_ino != os.stat(other).st_ino
+
+
+def test_gc_removes_only_unreferenced_staged_files(tmp_path):
+    """Garbage collection keeps inputs of running jobs and foreign files"""
+    input_dir = tmp_path / "input"
+    area = StagingArea(input_dir, ttl=0)
+    in_use = area.preparar(make_source(tmp_path / "a.png", b"a"))
+    done = area.preparar(make_source(tmp_path / "b.png", b"b"))
+    area.liberar([done])
+    (input_dir / "user_upload.png").write_bytes(b"keep")
+
+    assert area.limpiar() == 1
+    assert sorted(os.listdir(input_dir)) == sorted([in_use, "user_upload.png"])
+
+    area.liberar([in_use])
+    assert area.limpiar() == 1
+    assert os.listdir(input_dir) == ["user_upload.png"]
+
+
+def test_gc_respects_ttl(tmp_path):
+    """Recently used staged files survive collection"""
+    area = StagingArea(tmp_path / "input", ttl=3600)
+    name = area.preparar(make_source(tmp_path / "a.png"))
+    area.liberar([name])
+
+    assert area.limpiar() == 0
+    assert os.listdir(tmp_path / "input") == [name]
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from app.services.translation import NoopBackend, TranslationService, crear_backend
+
+
+class CountingBackend:
+    def __init__(self, delay=0):
+        self.calls = []
+        self.delay = delay
+
+    def traducir(self, texto):
+        self.calls.append(texto)
+        time.sleep(self.delay)
+        return f"en:{texto}"
+
+
+def test_cache_hits_on_normalized_text():
+    """Whitespace and case variants of a prompt reuse one translation"""
+    backend = CountingBackend()
+    service = TranslationService(backend, cache_file=None)
+
+    assert service.traducir("Un gato  azul") == "en:Un gato azul"
+    assert service.traducir("  un GATO azul ") == "en:Un gato azul"
+    assert backend.calls == ["Un gato azul"]
+    assert (service.hits, service.misses) == (1, 1)
+
+
+def test_batch_translates_only_missing_texts():
+    """A batch sends each distinct uncached text to the backend once"""
+    backend = CountingBackend()
+    service = TranslationService(backend, cache_file=None)
+    service.traducir("un perro")
+
+    result = service.traducir_lote(["un perro", "una casa", "Una  casa", "un árbol"])
+
+    assert result == ["en:un perro", "en:una casa", "en:una casa", "en:un árbol"]
+    assert sorted(backend.calls) == ["un perro", "un árbol", "una casa"]
+
+
+def test_lru_eviction_and_ttl():
+    """Least recently used entries are evicted and expired ones are re-translated"""
+    backend = CountingBackend()
+    service = TranslationService(backend, cache_size=2, ttl=3600, cache_file=None)
+    service.traducir("a")
+    service.traducir("b")
+    service.traducir("a")
+    service.traducir("c")  # evicts "b"
+    service.traducir("b")
+    assert backend.calls == ["a", "b", "c", "b"]
+
+    service.ttl = 0
+    time.sleep(0.01)
+    service.traducir("b")
+    assert backend.calls[-1] == "b" and len(backend.calls) == 5
+
+
+def test_cache_persists_across_restarts(tmp_path):
+    """Translations are reloaded from disk by a new service instance"""
+    cache_file = tmp_path / "cache.json"
+    first = TranslationService(CountingBackend(), cache_file=str(cache_file))
+    first.traducir("un gato")
+
+    backend = CountingBackend()
+    second = TranslationService(backend, cache_file=str(cache_file))
+    assert second.traducir("un gato") == "en:un gato"
+    assert backend.calls == []
+
+
+def test_slow_or_failing_backend_falls_back_to_original():
+    """A timeout or error returns the original text and is not cached"""
+    service = TranslationService(CountingBackend(delay=1), cache_file=None, timeout=0.05)
+    start = time.monotonic()
+    assert service.traducir("un gato") == "un gato"
+    assert time.monotonic() - start < 0.5
+
+    class Failing:
+        def traducir(self, texto):
+            raise RuntimeError("MYMEMORY WARNING")
+
+    service = TranslationService(Failing(), cache_file=None)
+    assert service.traducir("un gato") == "un gato"
+    assert service.traducir_lote(["un gato"]) == ["un gato"]
+    assert service.misses == 2
+
+
+def test_offline_backend():
+    """The "none" backend keeps prompts untouched"""
+    assert isinstance(crear_backend("none"), NoopBackend)
+    assert TranslationService(crear_backend("none"), cache_file=None).traducir("un gato") == "un gato"
+    with pytest.raises(ValueError):
+        crear_backend("unknown")
@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import app.services.workflows as workflows
+
+
+def copy_templates(tmp_path):
+    for archivo, _ in workflows.PLANTILLAS.values():
+        shutil.copy(workflows.CARPETA_WORKFLOWS / archivo, tmp_path / archivo)
+    return workflows.WorkflowRegistry(tmp_path)
+
+
+def rewrite(path, graph):
+    """Write a new version of a template with a different mtime"""
+    stat = os.stat(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(graph, f)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_bundled_templates_are_valid():
+    """Every shipped workflow contains the nodes its code path patches"""
+    registry = workflows.WorkflowRegistry()
+    registry.cargar()
+    for nombre in workflows.PLANTILLAS:
+        assert registry.get(nombre).nombre == nombre
+
+
+def test_patch_is_copy_on_write():
+    """Patching copies only the touched nodes and leaves the template untouched"""
+    plantilla = workflows.registro.get("txt2img")
+    original_seed = plantilla.input("3", "seed")
+
+    workflow = plantilla.parchear({"3": {"seed": 42}, "9": {"filename_prefix": "generated1-x"}})
+
+    assert workflow["3"]["inputs"]["seed"] == 42
+    assert workflow["3"]["inputs"]["steps"] == plantilla.input("3", "steps")
+    assert workflow["9"]["inputs"]["filename_prefix"] == "generated1-x"
+    assert plantilla.input("3", "seed") == original_seed
+    # untouched nodes are shared with the template, patched ones are not
+    assert workflow["5"] is plantilla.grafo["5"]
+    assert workflow["3"] is not plantilla.grafo["3"]
+    # the payload is plain JSON
+    assert json.loads(json.dumps(workflow))["3"]["inputs"]["seed"] == 42
+
+
+def test_template_cannot_be_mutated():
+    """Shared template nodes are read-only"""
+    plantilla = workflows.registro.get("txt2img")
+    with pytest.raises(TypeError):
+        plantilla.grafo["3"]["inputs"]["seed"] = 1
+    with pytest.raises(KeyError):
+        plantilla.parchear({"999": {"seed": 1}})
+
+
+def test_missing_patched_node_is_rejected(tmp_path):
+    """Loading fails when a template lacks a node the code path patches"""
+    registry = copy_templates(tmp_path)
+    path = tmp_path / workflows.PLANTILLAS["sketch2img"][0]
+    graph = json.loads(path.read_text(encoding="utf-8"))
+    del graph["138"]
+    rewrite(path, graph)
+
+    with pytest.raises(ValueError, match="138.image"):
+        registry.cargar()
+
+
+def test_hot_reload_on_file_change(tmp_path):
+    """A modified template is reloaded; an invalid one keeps the previous version"""
+    registry = copy_templates(tmp_path)
+    registry.cargar()
+    path = tmp_path / workflows.PLANTILLAS["txt2img"][0]
+    graph = json.loads(path.read_text(encoding="utf-8"))
+
+    graph["3"]["inputs"]["steps"] = 7
+    rewrite(path, graph)
+    assert registry.get("txt2img").input("3", "steps") == 7
+
+    del graph["9"]
+    rewrite(path, graph)
+    assert registry.get("txt2img").input("3", "steps") == 7
+    assert "9" in registry.get("txt2img").grafo
+
+
+def test_branch_fan_out_shares_upstream_nodes():
+    """Each variant gets its own sampler/decode/save branch; loaders and text encoding are shared"""
+    plantilla = workflows.registro.get("txt2img")
+    base = plantilla.parchear({"11": {"text_positive": "a cat"}})
+    rama = workflows.descendientes(base, "3")
+    assert "3" in rama and "9" in rama and "11" not in rama
+
+    workflow = workflows.ramificar(base, "3", [
+        {"3": {"seed": seed}, "9": {"filename_prefix": f"p-{i}"}} for i, seed in enumerate((1, 2, 3))
+    ])
+
+    assert len(workflow) == len(base) + 2 * len(rama)
+    samplers = [n for n in workflow.values() if n["class_type"] == plantilla.grafo["3"]["class_type"]]
+    saves = {n["inputs"]["filename_prefix"] for n in workflow.values() if n["class_type"] == "SaveImage"}
+    assert sorted(n["inputs"]["seed"] for n in samplers) == [1, 2, 3]
+    assert saves == {"p-0", "p-1", "p-2"}
+    for node_id, node in workflow.items():
+        for valor in node["inputs"].values():
+            if workflows._es_enlace(valor):
+                assert valor[0] in workflow, f"{node_id} links to missing node {valor[0]}"
+    # the template is not modified
+    assert plantilla.input("9", "filename_prefix") != "p-0"
+
+
+def test_templates_expose_their_models():
+    """Each template lists the models its loader nodes load"""
+    txt2img = workflows.registro.get("txt2img").modelos
+    assert txt2img == {"juggernautXL_ragnarokBy.safetensors"}
+    assert workflows.registro.get("img2img").modelos == txt2img
+    assert txt2img < workflows.registro.get("sketch2img").modelos
+    assert "ip-adapter-plus_sdxl_vit-h.safetensors" in workflows.registro.get("multimg2").modelos
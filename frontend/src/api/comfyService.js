@@ -8,6 +8,10 @@
 import axios from '@/plugins/axios'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
+const JOB_POLL_INTERVAL_MS = 1000
+
+// Trabajos que se están esperando, para poder cancelarlos al salir de la vista
+const activeJobs = new Set()
 
 export const comfyService = {
 
@@ -17,6 +21,9 @@ export const comfyService = {
    * @param {Object} prompt - Parámetros de generación.
    * @param {string} prompt.prompt_text - Texto descriptivo de la imagen.
    * @param {number} [prompt.seed] - Semilla para reproducibilidad.
+   * @param {number} [prompt.count] - Número de variaciones (el trabajo las devuelve en `results`).
+   * @param {number[]} [prompt.seeds] - Semillas explícitas de cada variación.
+   * @param {number} [prompt.seedStride] - Incremento entre semillas consecutivas.
    * @param {number} userId - ID del usuario propietario.
    * @param {number|null} [sessionId=null] - ID de sesión opcional.
    * @returns {Promise<Object>} Imagen generada con metadata.
@@ -30,7 +37,7 @@ export const comfyService = {
       const response = await axios.post(url, prompt, {
         headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` }
       })
-      return response.data
+      return await this.waitForJob(response.data)
     } catch (err) {
       console.error('createImage error response:', err?.response?.data || err)
       throw err
@@ -57,7 +64,7 @@ export const comfyService = {
       const response = await axios.post(url, prompt, {
         headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` }
       })
-      return response.data
+      return await this.waitForJob(response.data)
     } catch (err) {
       console.error('convertirBoceto error response:', err?.response?.data || err)
       throw err
@@ -83,13 +90,79 @@ export const comfyService = {
       const response = await axios.post(url, payload, {
         headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` }
       })
-      return response.data
+      return await this.waitForJob(response.data)
     } catch (err) {
       console.error('generateImageByMultiple error response:', err?.response?.data || err)
       throw err
     }
   },
 
+  /**
+   * Obtiene el estado de un trabajo de generación.
+   * @async
+   * @param {string} jobId - ID del trabajo devuelto al encolar la generación.
+   * @returns {Promise<Object>} Estado del trabajo (queued, running, done, failed, cancelled).
+   */
+  async getJob(jobId) {
+    const token = localStorage.getItem('token')
+    const response = await axios.get(`${API_URL}/comfy/jobs/${jobId}`, {
+      headers: { Authorization: `Bearer ${token}` }
+    })
+    return response.data
+  },
+
+  /**
+   * Espera a que termine un trabajo de generación consultando su estado.
+   * @async
+   * @param {Object} job - Trabajo devuelto por el backend (respuesta 202).
+   * @returns {Promise<Object>} Imagen generada con metadata (resultado del trabajo).
+   * @throws {Object} Error con el mismo formato que axios (`response.data.detail`) si el trabajo falla o se cancela.
+   */
+  async waitForJob(job) {
+    let current = job
+    activeJobs.add(current.id)
+    try {
+      while (current.status === 'queued' || current.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS))
+        if (!activeJobs.has(current.id)) {
+          throw { response: { status: 409, data: { detail: 'Generación cancelada' } } }
+        }
+        current = await this.getJob(current.id)
+      }
+    } finally {
+      activeJobs.delete(current.id)
+    }
+    if (current.status === 'failed' || current.status === 'cancelled') {
+      throw { response: { status: current.status_code, data: { detail: current.error } } }
+    }
+    return current.result
+  },
+
+  /**
+   * Cancela un trabajo de generación en cola o en ejecución.
+   * @async
+   * @param {string} jobId - ID del trabajo.
+   * @returns {Promise<Object>} Estado del trabajo tras cancelarlo.
+   */
+  async cancelJob(jobId) {
+    const token = localStorage.getItem('token')
+    activeJobs.delete(jobId)
+    const response = await axios.post(`${API_URL}/comfy/jobs/${jobId}/cancel`, null, {
+      headers: { Authorization: `Bearer ${token}` }
+    })
+    return response.data
+  },
+
+  /**
+   * Cancela todos los trabajos que se están esperando (p. ej. al salir de la vista).
+   * Los errores se ignoran: el trabajo puede haber terminado entretanto.
+   */
+  cancelActiveJobs() {
+    for (const jobId of [...activeJobs]) {
+      this.cancelJob(jobId).catch(err => console.warn('cancelJob error:', err?.response?.data || err))
+    }
+  },
+
   /**
    * Sube una imagen desde el cliente al servidor.
    * @async